@@ -0,0 +1,124 @@
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from myblog.models import User, Card, MediaFile, Role
+from myblog.models.models import card_media
+from myblog.rendering import RENDERER_VERSION, render_markdown
+from myblog.routers.auth import get_password_hash
+
+# Synthetic data for the benchmark suite. Everything is drawn from one seeded
+# random generator, so the same arguments always produce the same dataset.
+
+BENCH_PASSWORD = "benchmark-password"
+
+WORDS = (
+    "async request cache index query render template media upload stream cursor page "
+    "latency worker process thread pool markdown card author visible image audio video "
+    "database session commit batch token user route server client response header"
+).split()
+
+INSERT_BATCH_SIZE = 1000
+
+
+def sentence(rng, words=12):
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(words // 2, words * 2)))
+    return text.capitalize() + "."
+
+
+def markdown_body(rng, target_size):
+    # Headings, paragraphs, lists and code blocks until the target size is reached
+    blocks = []
+    size = 0
+    while size < target_size:
+        kind = rng.random()
+        if kind < 0.1:
+            block = "## " + sentence(rng, 4).rstrip(".")
+        elif kind < 0.25:
+            block = "\n".join("- " + sentence(rng, 6) for _ in range(rng.randint(2, 6)))
+        elif kind < 0.35:
+            block = "    " + "\n    ".join(f"{rng.choice(WORDS)} = {rng.randint(0, 999)}" for _ in range(rng.randint(2, 8)))
+        else:
+            block = " ".join(sentence(rng) for _ in range(rng.randint(2, 6)))
+            if rng.random() < 0.3:
+                block += f" See [{rng.choice(WORDS)}](https://example.com/{rng.choice(WORDS)})."
+        blocks.append(block)
+        size += len(block) + 2
+    return "\n\n".join(blocks)
+
+
+def card_size(rng, mean_size):
+    # Log-normal around the mean: mostly short cards with a long tail of big ones
+    return max(200, int(rng.lognormvariate(0, 0.75) * mean_size * 0.75))
+
+
+async def insert_rows(session, model, rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        await session.execute(insert(model), rows[start:start + INSERT_BATCH_SIZE])
+
+
+async def seed_dataset(session_factory, users=20, cards=1000, media=200, mean_card_size=2000, seed=1):
+    rng = random.Random(seed)
+    # One bcrypt hash shared by every user; hashing each one would dominate seeding
+    hashed_password = get_password_hash(BENCH_PASSWORD)
+    now = datetime.utcnow()
+
+    user_rows = [
+        {
+            "id": user_id,
+            "username": f"user{user_id}",
+            "email": f"user{user_id}@example.com",
+            "hashed_password": hashed_password,
+            "created_at": now,
+            "role": Role.ADMIN if user_id == 1 else Role.DEVELOPER,
+        }
+        for user_id in range(1, users + 1)
+    ]
+    media_rows = [
+        {
+            "id": media_id,
+            "filename": f"file{media_id}.mp3",
+            "file_path": f"/static/media/bench/file{media_id}.mp3",
+            "file_type": "mp3",
+            "content_hash": f"{media_id:064x}",
+            "ref_count": 1,
+            "size": rng.randint(10_000, 5_000_000),
+            "uploaded_at": now - timedelta(minutes=media_id),
+            "uploader_id": rng.randint(1, users),
+        }
+        for media_id in range(1, media + 1)
+    ]
+    card_rows, link_rows = [], []
+    for card_id in range(1, cards + 1):
+        content = markdown_body(rng, card_size(rng, mean_card_size))
+        created_at = now - timedelta(minutes=cards - card_id)
+        card_rows.append({
+            "id": card_id,
+            "title": sentence(rng, 5).rstrip("."),
+            "content": content,
+            "content_html": render_markdown(content),
+            "render_version": RENDERER_VERSION,
+            "to_all": rng.random() < 0.8,
+            "author_id": rng.randint(1, users),
+            "created_at": created_at,
+            "updated_at": created_at,
+        })
+        if media:
+            attached = rng.sample(range(1, media + 1), k=min(media, rng.choice((0, 0, 1, 2, 4))))
+            link_rows.extend(
+                {"card_id": card_id, "media_id": media_id, "position": position}
+                for position, media_id in enumerate(attached)
+            )
+
+    async with session_factory() as session:
+        await insert_rows(session, User, user_rows)
+        await insert_rows(session, MediaFile, media_rows)
+        await insert_rows(session, Card, card_rows)
+        if link_rows:
+            await insert_rows(session, card_media, link_rows)
+        await session.commit()
+
+    return {
+        "users": [row["username"] for row in user_rows],
+        "cards": [(row["id"], row["author_id"], row["to_all"]) for row in card_rows],
+        "media": len(media_rows),
+    }
@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# In-process load test for the ASGI app.
+#
+#   python -m benchmarks.run --cards 5000 --concurrency 16 --output results.json
+#   python -m benchmarks.run --baseline results.json    # exits 1 on a regression
+#
+# A fresh SQLite database and media directory are created in a temporary
+# directory for every run, so results never depend on local data.
+
+ROUTES = ("GET /cards", "GET /cards/{id}", "POST /auth/token", "POST /media/upload")
+
+LATENCY_KEYS = ("p50", "p95", "p99")
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    to_ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": to_ms(sum(values) / len(values)) if values else None,
+            "p50": to_ms(percentile(values, 0.50)),
+            "p95": to_ms(percentile(values, 0.95)),
+            "p99": to_ms(percentile(values, 0.99)),
+            "max": to_ms(values[-1]) if values else None,
+        },
+    }
+
+
+async def drive(send, total, concurrency):
+    # Keep `concurrency` requests in flight until `total` have been sent
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            response = await send()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(min(concurrency, total))])
+    return latencies, errors, time.perf_counter() - started
+
+
+def compare(current, baseline, threshold=0.10, min_delta_ms=1.0):
+    # Latency regresses when it grows by more than `threshold` (and by at least
+    # min_delta_ms, so sub-millisecond noise is ignored); throughput when it drops
+    regressions = []
+    for route, result in current["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if previous is None:
+            continue
+        for key in LATENCY_KEYS:
+            now, before = result["latency_ms"][key], previous["latency_ms"][key]
+            if now is None or before is None:
+                continue
+            if now > before * (1 + threshold) and now - before >= min_delta_ms:
+                regressions.append({"route": route, "metric": f"latency_ms.{key}", "baseline": before, "current": now})
+        now, before = result["throughput_rps"], previous["throughput_rps"]
+        if now is not None and before and now < before * (1 - threshold):
+            regressions.append({"route": route, "metric": "throughput_rps", "baseline": before, "current": now})
+    return regressions
+
+
+def route_senders(client, dataset, rng, create_access_token, password, upload_size):
+    tokens = {
+        username: {"Authorization": f"Bearer {create_access_token({'sub': username})}"}
+        for username in dataset["users"]
+    }
+    users = dataset["users"]
+    cards = dataset["cards"]
+
+    async def list_cards():
+        return await client.get("/cards/", headers=tokens[rng.choice(users)])
+
+    async def get_card():
+        card_id, author_id, to_all = rng.choice(cards)
+        viewer = rng.choice(users) if to_all else f"user{author_id}"
+        return await client.get(f"/cards/{card_id}", headers=tokens[viewer])
+
+    async def token():
+        return await client.post("/auth/token", data={"username": rng.choice(users), "password": password})
+
+    async def upload():
+        # Random bytes, so every upload is new content rather than a dedup hit
+        payload = os.urandom(upload_size)
+        return await client.post(
+            "/media/upload",
+            files={"file": ("bench.mp3", payload, "audio/mpeg")},
+            headers=tokens[rng.choice(users)],
+        )
+
+    return {
+        "GET /cards": list_cards,
+        "GET /cards/{id}": get_card,
+        "POST /auth/token": token,
+        "POST /media/upload": upload,
+    }
+
+
+async def run(args, workdir):
+    # The app reads its configuration at import time, so point it at the
+    # benchmark database before importing anything from it
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir / 'bench.db'}"
+    os.environ.setdefault("SHARED_CACHE_PATH", str(workdir / "cache.sqlite3"))
+    # The token route is driven from one address with one user
+    os.environ.setdefault("AUTH_RATE_LIMIT_ENABLED", "false")
+    from httpx import AsyncClient
+    from main import app
+    from myblog.database import AsyncSessionLocal
+    from myblog.routers import media
+    from myblog.routers.auth import create_access_token
+    from benchmarks.dataset import seed_dataset, BENCH_PASSWORD
+
+    media.MEDIA_DIR = workdir / "media"
+    media.MEDIA_TMP_DIR = media.MEDIA_DIR / ".tmp"
+    media.MEDIA_TMP_DIR.mkdir(parents=True)
+
+    await app.router.startup()
+    try:
+        seed_started = time.perf_counter()
+        dataset = await seed_dataset(
+            AsyncSessionLocal,
+            users=args.users,
+            cards=args.cards,
+            media=args.media,
+            mean_card_size=args.card_size,
+            seed=args.seed,
+        )
+        seed_seconds = time.perf_counter() - seed_started
+
+        rng = random.Random(args.seed)
+        results = {}
+        async with AsyncClient(app=app, base_url="http://bench") as client:
+            senders = route_senders(client, dataset, rng, create_access_token, BENCH_PASSWORD, args.upload_size)
+            for route in args.routes:
+                send = senders[route]
+                if args.warmup:
+                    await drive(send, args.warmup, args.concurrency)
+                latencies, errors, elapsed = await drive(send, args.requests, args.concurrency)
+                results[route] = summarize(latencies, errors, elapsed)
+                print(f"{route}: {results[route]['throughput_rps']} req/s, "
+                      f"p95 {results[route]['latency_ms']['p95']} ms", file=sys.stderr)
+    finally:
+        await app.router.shutdown()
+
+    return {
+        "config": {
+            "users": args.users,
+            "cards": args.cards,
+            "media": args.media,
+            "card_size": args.card_size,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "seed_seconds": round(seed_seconds, 3),
+        "routes": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Benchmark the blog app in-process")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--cards", type=int, default=1000)
+    parser.add_argument("--media", type=int, default=200)
+    parser.add_argument("--card-size", type=int, default=2000, help="Mean Markdown size of a card in characters")
+    parser.add_argument("--upload-size", type=int, default=64 * 1024)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per route")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per route")
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Compare against a stored report and exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative change before flagging")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore latency changes smaller than this")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="myblog-bench-") as tmp:
+        report = asyncio.run(run(args, Path(tmp)))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as stream:
+            baseline = json.load(stream)
+        regressions = compare(report, baseline, args.threshold, args.min_delta_ms)
+        report["comparison"] = {
+            "baseline": args.baseline,
+            "threshold": args.threshold,
+            "regressions": regressions,
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as stream:
+            stream.write(output + "\n")
+    else:
+        print(output)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression['route']} {regression['metric']}: "
+              f"{regression['baseline']} -> {regression['current']}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
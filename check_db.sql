@@ -8,4 +8,9 @@ SELECT name FROM sqlite_master WHERE type='table';
 SELECT * FROM article_media;
 
 UPDATE users SET role = 'ADMIN' WHERE id = 1;
-UPDATE users SET role = 'DEVELOPER' WHERE id = 2;
\ No newline at end of file
+UPDATE users SET role = 'DEVELOPER' WHERE id = 2;
+
+-- Schema changes are versioned migrations in src/myblog/migrations, applied at
+-- startup or with: python -m myblog.cli migrate
+-- Check the applied revision with: python -m myblog.cli migrate --status
+SELECT * FROM schema_version;
@@ -1,10 +1,11 @@
 from fastapi import FastAPI, Request, Depends
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pathlib import Path
 from dotenv import load_dotenv
-from myblog.database import init_db
+from myblog.database import init_db, AsyncSessionLocal
+from myblog import assets, compression, jobs, metrics, querylog
+from myblog.templating import templates, precompile_templates
 from myblog.routers.auth import get_current_user
 from myblog.models import User
 from starlette.middleware.sessions import SessionMiddleware
@@ -27,15 +28,38 @@ app.add_middleware(
 # Add session middleware
 app.add_middleware(SessionMiddleware, secret_key="your-secret-key")
 
+# Slow-query logging and N+1 detection per request
+if querylog.QUERY_TRACKING_ENABLED:
+    app.add_middleware(querylog.QueryTrackingMiddleware)
+
+# Negotiated gzip/brotli for dynamic responses; /static serves prebuilt sidecars
+if compression.COMPRESSION_ENABLED:
+    app.add_middleware(compression.CompressionMiddleware, exclude_prefixes=("/static/",))
+
+# Request metrics; added last so it wraps (and times) every other middleware
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # Setup database initialization event
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    precompile_templates()
+    assets.manifest.load()
+    # Each worker process claims and runs queued background jobs
+    if jobs.JOB_WORKER_ENABLED:
+        jobs.runner.start(AsyncSessionLocal)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Also shuts down the process pool shared by jobs, media and bulk rendering
+    await jobs.runner.drain()
 
 # Setup static files and templates
 BASE_DIR = Path(__file__).resolve().parent / "src" / "myblog"
-app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
-templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+# Fingerprinted asset URLs are cached for good; uploaded media under
+# static/media is served as stored, never from sidecars
+app.mount("/static", assets.FingerprintedStaticFiles(directory=str(BASE_DIR / "static"), skip=("media",)), name="static")
 
 # Root endpoint
 @app.get("/", response_model=None)
@@ -45,11 +69,19 @@ async def home(request: Request, current_user: User | None = Depends(get_current
         {"request": request, "title": "Welcome to My Blog", "current_user": current_user}
     )
 
+# Prometheus scrape endpoint, only when METRICS_ENABLED; guarded by METRICS_TOKEN
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False, dependencies=[Depends(metrics.authorize_scrape)])
+    async def metrics_endpoint():
+        return PlainTextResponse(metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
 # Include routers
 from myblog.routers import auth, cards, media, users
 
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(cards.router, prefix="/cards", tags=["cards"])
+# The JSON card routes, always answering in JSON
+app.include_router(cards.api_router, prefix="/api/cards", tags=["api"])
 app.include_router(media.router, prefix="/media", tags=["media"])
 app.include_router(users.router, prefix="/users", tags=["users"])
 
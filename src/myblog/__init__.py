@@ -2,10 +2,10 @@
 
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
 from dotenv import load_dotenv
+from myblog.templating import templates
 
 # Load environment variables
 load_dotenv()
@@ -25,7 +25,6 @@ app.add_middleware(
 # Setup static files and templates
 BASE_DIR = Path(__file__).resolve().parent
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
-templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
 # Export the app instance
 __all__ = ["app"]
\ No newline at end of file
@@ -0,0 +1,96 @@
+from datetime import datetime
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from starlette.responses import Response
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library is the fallback
+    orjson = None
+
+# JSON mode for routes that otherwise render HTML. A request gets JSON when it
+# came in under the /api prefix, or when its Accept header ranks
+# application/json above text/html.
+API_PREFIX = "/api/"
+JSON_MEDIA_TYPE = "application/json"
+
+
+def _accept_weights(accept):
+    weights = {}
+    for part in (accept or "").split(","):
+        media_range, _, params = part.partition(";")
+        media_range = media_range.strip().lower()
+        if not media_range:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[media_range] = weight
+    return weights
+
+
+def wants_json(request):
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or request.url.path
+    if path.startswith(API_PREFIX):
+        return True
+    # Wildcards count for HTML only, so browsers and */* clients keep getting pages
+    weights = _accept_weights(request.headers.get("accept"))
+    json_weight = weights.get(JSON_MEDIA_TYPE, 0.0)
+    return json_weight > 0 and json_weight >= weights.get("text/html", 0.0)
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    # Returns bytes; orjson writes datetimes as ISO 8601 like pydantic does
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(body, status_code=200, headers=None):
+    # `body` is already serialized, e.g. when it came from the page cache
+    if not isinstance(body, bytes):
+        body = dumps(body)
+    return Response(body, status_code=status_code, headers=headers, media_type=JSON_MEDIA_TYPE)
+
+
+def parse_names(value, allowed, param):
+    # "a,b" -> ["a", "b"] in `allowed` order; unknown names are a 400
+    if value is None:
+        return None
+    names = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = names - set(allowed)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown {param}: {', '.join(sorted(unknown))}. Allowed: {', '.join(allowed)}",
+        )
+    return [name for name in allowed if name in names]
+
+
+async def read_model(request, model, form_fields=None):
+    # Validates a JSON body, or a form post mapped through `form_fields`
+    # ({name: converter}); only fields present in the request are set
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.split(";", 1)[0].strip().lower() == JSON_MEDIA_TYPE:
+            return model.model_validate_json(await request.body())
+        form_data = await request.form()
+        values = {
+            name: convert(form_data[name]) for name, convert in (form_fields or {}).items() if name in form_data
+        }
+        return model.model_validate(values)
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors(include_url=False))
@@ -0,0 +1,116 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import re
+import threading
+from myblog.compression import PrecompressedStaticFiles
+
+# Fingerprinted static URLs: css/site.css is linked as css/site.<hash>.css, so
+# the URL changes whenever the content does and can be cached forever. The
+# manifest is read from ASSET_MANIFEST_PATH when `python -m myblog.cli
+# build-assets` wrote one, and built by hashing the files at startup otherwise.
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+STATIC_URL_PREFIX = "/static"
+ASSET_MANIFEST_PATH = Path(os.getenv("ASSET_MANIFEST_PATH", str(STATIC_DIR / "manifest.json")))
+# Hex digits of the content hash kept in the file name
+ASSET_HASH_LENGTH = 12
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Uploads are linked by their stored URL, never fingerprinted
+SKIP_DIRS = ("media",)
+# Uploads and their variants are stored under the SHA-256 of the upload, so
+# these URLs never change content either
+CONTENT_ADDRESSED_PATH = re.compile(r"media/(?:variants/)?[0-9a-f]{2}/[0-9a-f]{64}[-.][\w.-]+")
+
+
+def fingerprint(relative_path, data):
+    digest = hashlib.blake2b(data, digest_size=ASSET_HASH_LENGTH // 2).hexdigest()
+    path = Path(relative_path)
+    return path.with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+
+
+def build_manifest(directory, skip=SKIP_DIRS):
+    # {"css/site.css": "css/site.3f2a9c1b7d4e.css", ...}
+    directory = Path(directory)
+    manifest = {}
+    for path in sorted(directory.rglob("*")):
+        relative = path.relative_to(directory)
+        if (
+            not path.is_file() or relative.parts[0] in skip or path.name.startswith(".")
+            or path.suffix in (".gz", ".br") or path.name == "manifest.json"
+        ):
+            continue
+        manifest[relative.as_posix()] = fingerprint(relative, path.read_bytes())
+    return manifest
+
+
+def write_manifest(directory, path=ASSET_MANIFEST_PATH):
+    manifest = build_manifest(directory)
+    Path(path).write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+    return manifest
+
+
+class AssetManifest:
+    def __init__(self, directory=STATIC_DIR, path=ASSET_MANIFEST_PATH, prefix=STATIC_URL_PREFIX):
+        self.directory = Path(directory)
+        self.path = Path(path) if path else None
+        self.prefix = prefix
+        self.assets = None
+        self.originals = {}
+        self.version = ""
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self.path is not None and self.path.exists():
+            assets = json.loads(self.path.read_text())
+        else:
+            assets = build_manifest(self.directory)
+        with self._lock:
+            self.assets = assets
+            self.originals = {hashed: name for name, hashed in assets.items()}
+            # Changes whenever any asset does; part of the page validators
+            self.version = hashlib.blake2b(
+                json.dumps(assets, sort_keys=True).encode(), digest_size=8
+            ).hexdigest()
+        return assets
+
+    def _ensure_loaded(self):
+        if self.assets is None:
+            self.load()
+
+    def url(self, name):
+        # Unknown names fall back to the plain URL, which is served (and revalidated) as before
+        self._ensure_loaded()
+        name = name.lstrip("/")
+        return f"{self.prefix}/{self.assets.get(name, name)}"
+
+    def original(self, hashed):
+        self._ensure_loaded()
+        return self.originals.get(hashed)
+
+
+manifest = AssetManifest()
+
+
+def static_url(name):
+    return manifest.url(name)
+
+
+class FingerprintedStaticFiles(PrecompressedStaticFiles):
+    # Fingerprinted and content-addressed paths are marked immutable (the
+    # former mapped back to the file on disk); other paths are served with the
+    # usual validators
+    def __init__(self, *args, manifest=manifest, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path, scope):
+        path = Path(path).as_posix()
+        original = self.manifest.original(path)
+        if original is None and not CONTENT_ADDRESSED_PATH.fullmatch(path):
+            return await super().get_response(path, scope)
+        response = await super().get_response(original or path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
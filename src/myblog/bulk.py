@@ -0,0 +1,210 @@
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, insert, or_
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import json
+from myblog.models import Card, User, MediaFile
+from myblog.models.models import card_media
+from myblog.jobs import runner
+from myblog.rendering import RENDERER_VERSION, render_many
+
+# Bulk export / import of cards as NDJSON: one JSON object per line.
+
+EXPORT_BATCH_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+
+# Per-row errors are reported up to this many; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+async def render_contents(contents):
+    # Markdown rendering dominates import time, so a batch is split across the
+    # job runner's process pool
+    workers = runner.limits["cpu"]
+    if workers <= 1:
+        return await run_in_threadpool(render_many, contents)
+    step = -(-len(contents) // workers)
+    slices = await asyncio.gather(*[
+        runner.run_cpu(render_many, contents[start:start + step])
+        for start in range(0, len(contents), step)
+    ])
+    return [html for rendered in slices for html in rendered]
+
+
+class CardImport(BaseModel):
+    title: str
+    content: str
+    to_all: bool = False
+    author: Optional[str] = None
+    author_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    media_ids: List[int] = []
+
+
+def card_record(card, author, media_ids):
+    return {
+        "id": card.id,
+        "title": card.title,
+        "content": card.content,
+        "to_all": bool(card.to_all),
+        "author_id": card.author_id,
+        "author": author,
+        "created_at": card.created_at.isoformat() if card.created_at else None,
+        "updated_at": card.updated_at.isoformat() if card.updated_at else None,
+        "media_ids": media_ids,
+    }
+
+
+async def export_cards(session, batch_size=EXPORT_BATCH_SIZE):
+    # Yields NDJSON lines. Rows come from a server-side cursor one partition at a
+    # time, so memory stays constant however many cards there are.
+    query = (
+        select(Card, User.username)
+        .outerjoin(User, Card.author_id == User.id)
+        .order_by(Card.id)
+        .execution_options(yield_per=batch_size)
+    )
+    result = await session.stream(query)
+    async for partition in result.partitions():
+        card_ids = [card.id for card, _ in partition]
+        media = await session.execute(
+            select(card_media.c.card_id, card_media.c.media_id)
+            .where(card_media.c.card_id.in_(card_ids))
+            .order_by(card_media.c.card_id, card_media.c.position)
+        )
+        media_ids = {}
+        for card_id, media_id in media:
+            media_ids.setdefault(card_id, []).append(media_id)
+        lines = [
+            json.dumps(card_record(card, username, media_ids.get(card.id, [])), ensure_ascii=False)
+            for card, username in partition
+        ]
+        # The identity map only holds weak references, so exported rows are freed
+        yield "\n".join(lines) + "\n"
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_number, "error": message})
+
+    def as_dict(self):
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors}
+
+
+async def _import_batch(session, batch, default_author_id, report):
+    # Resolve authors and media for the whole batch with one query each
+    usernames = {row.author for _, row in batch if row.author}
+    author_ids = {row.author_id or default_author_id for _, row in batch if not row.author} - {None}
+    authors, known_authors = {}, set()
+    if usernames or author_ids:
+        result = await session.execute(
+            select(User.username, User.id).where(or_(User.username.in_(usernames), User.id.in_(author_ids)))
+        )
+        for username, user_id in result:
+            if username in usernames:
+                authors[username] = user_id
+            known_authors.add(user_id)
+    requested_media = {media_id for _, row in batch for media_id in row.media_ids}
+    known_media = set()
+    if requested_media:
+        result = await session.execute(select(MediaFile.id).where(MediaFile.id.in_(requested_media)))
+        known_media = set(result.scalars())
+
+    now = datetime.utcnow()
+    values, links = [], []
+    for line_number, row in batch:
+        if row.author:
+            author_id = authors.get(row.author)
+            if author_id is None:
+                report.add_error(line_number, f"Unknown author {row.author!r}")
+                continue
+        else:
+            author_id = row.author_id or default_author_id
+            if author_id is None:
+                report.add_error(line_number, "No author given")
+                continue
+            if author_id not in known_authors:
+                report.add_error(line_number, f"Unknown author id {author_id}")
+                continue
+        created_at = row.created_at or now
+        values.append({
+            "title": row.title,
+            "content": row.content,
+            "content_html": None,
+            "render_version": RENDERER_VERSION,
+            "to_all": row.to_all,
+            "author_id": author_id,
+            "created_at": created_at,
+            "updated_at": row.updated_at or created_at,
+        })
+        links.append([media_id for media_id in row.media_ids if media_id in known_media])
+
+    if not values:
+        return
+    rendered = await render_contents([value["content"] for value in values])
+    for value, html in zip(values, rendered):
+        value["content_html"] = html
+    # One executemany per batch; RETURNING gives the new ids in parameter order
+    result = await session.execute(insert(Card).returning(Card.id, sort_by_parameter_order=True), values)
+    card_ids = result.scalars().all()
+    media_rows = [
+        {"card_id": card_id, "media_id": media_id, "position": position}
+        for card_id, media_ids in zip(card_ids, links)
+        for position, media_id in enumerate(dict.fromkeys(media_ids))
+    ]
+    if media_rows:
+        await session.execute(insert(card_media), media_rows)
+    await session.commit()
+    report.imported += len(values)
+
+
+async def import_cards(session, lines, default_author_id, batch_size=IMPORT_BATCH_SIZE, on_progress=None):
+    # Reads NDJSON lines from an (async) iterable and inserts them in sized
+    # transactions. Malformed rows are reported and skipped.
+    report = ImportReport()
+    batch = []
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            batch.append((line_number, CardImport.model_validate_json(line)))
+        except ValidationError as e:
+            report.add_error(line_number, "; ".join(
+                f"{'.'.join(str(part) for part in error['loc']) or 'line'}: {error['msg']}"
+                for error in e.errors(include_url=False)
+            ))
+            continue
+        if len(batch) >= batch_size:
+            await _import_batch(session, batch, default_author_id, report)
+            batch = []
+            if on_progress:
+                on_progress(report)
+    if batch:
+        await _import_batch(session, batch, default_author_id, report)
+        if on_progress:
+            on_progress(report)
+    return report
+
+
+async def iter_lines(chunks):
+    # Split an async stream of bytes into text lines
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8", errors="replace")
+    if pending:
+        yield pending.decode("utf-8", errors="replace")
@@ -0,0 +1,501 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import anyio
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import secrets
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    # Bounded in-process cache: least recently used entries are evicted once
+    # maxsize is reached, and entries older than ttl seconds are never served.
+
+    def __init__(self, maxsize=1024, ttl=30.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._data[key] = (self.clock() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Shared cache file for every worker on this host; empty disables the shared tier.
+# The default lives in a directory only this user can enter, and is per database,
+# so two deployments on one host never share entries.
+SHARED_CACHE_DIR = os.getenv("SHARED_CACHE_DIR", str(Path(tempfile.gettempdir()) / f"myblog-{os.getuid()}"))
+_DATABASE_KEY = hashlib.blake2b(
+    f"{os.getcwd()}|{os.getenv('DATABASE_URL', '')}".encode(), digest_size=6
+).hexdigest()
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", str(Path(SHARED_CACHE_DIR) / f"cache-{_DATABASE_KEY}.sqlite3"))
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# How often each worker checks for invalidations published by the others. This
+# bounds how long another worker can serve a value after it was invalidated.
+SHARED_CACHE_POLL_SECONDS = float(os.getenv("SHARED_CACHE_POLL_SECONDS", "1.0"))
+# Invalidation events are kept this long; a worker that falls further behind
+# clears its whole in-process tier instead
+SHARED_CACHE_EVENT_RETENTION_SECONDS = 600
+# Run size-based eviction after this many writes
+SHARED_CACHE_EVICTION_INTERVAL = 64
+# Values are pickled, so every blob carries an HMAC; the key is read from
+# SHARED_CACHE_SECRET or generated once into a private file next to the cache
+SHARED_CACHE_SECRET = os.getenv("SHARED_CACHE_SECRET", "")
+_SIGNATURE_SIZE = hashlib.sha256().digest_size
+
+SHARED_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_entries_accessed_at ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS versions (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _check_owned(path, private):
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & (0o077 if private else 0o022):
+        raise PermissionError(f"{path} must be owned by this user and not writable by others")
+    return st
+
+
+def connect_shared_file(path, timeout):
+    # Opens a shared SQLite file for this host's workers. The directory must not
+    # be writable by other users, and the file (with its WAL) is created 0600.
+    directory = Path(path).parent
+    if str(directory) == SHARED_CACHE_DIR:
+        directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if not stat.S_ISDIR(_check_owned(directory, private=False).st_mode):
+        raise NotADirectoryError(directory)
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600))
+    _check_owned(path, private=True)
+    return sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+
+
+def _load_secret(path):
+    if SHARED_CACHE_SECRET:
+        return SHARED_CACHE_SECRET.encode()
+    key_path = f"{path}.key"
+    try:
+        _check_owned(key_path, private=True)
+    except FileNotFoundError:
+        # Written under a temporary name and linked into place, so a worker
+        # starting at the same time never reads a half-written key
+        temp_path = f"{key_path}.{os.getpid()}.{secrets.token_hex(4)}"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            os.write(fd, secrets.token_bytes(32))
+        finally:
+            os.close(fd)
+        try:
+            os.link(temp_path, key_path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp_path)
+        _check_owned(key_path, private=True)
+    return Path(key_path).read_bytes()
+
+
+# Publishing an invalidation writes to the shared file; doing it here keeps
+# commits on the event loop from waiting on the file lock
+_publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+_PENDING_INVALIDATIONS = "shared_cache_invalidations"
+
+
+def invalidate_on_commit(session, cache, key):
+    # Called from flush events or next to Core statements. Invalidating before
+    # the commit would let a concurrent reader cache the old row under the new
+    # version, so keys are collected on the session and published once it commits.
+    session = getattr(session, "sync_session", session)
+    session.info.setdefault(_PENDING_INVALIDATIONS, set()).add((cache, key))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_invalidations(session):
+    for cache, key in session.info.pop(_PENDING_INVALIDATIONS, ()):
+        cache.invalidate_in_background(key)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_invalidations(session, previous_transaction):
+    # A savepoint rollback keeps the outer transaction and what it has written
+    if not session.in_transaction():
+        session.info.pop(_PENDING_INVALIDATIONS, None)
+
+
+class SharedCache:
+    # Two-tier cache shared by every worker process on a host: a TTLCache in
+    # front of a SQLite file. Each key carries a version. invalidate() bumps the
+    # version and publishes an event, and every worker drops its in-process copy
+    # within SHARED_CACHE_POLL_SECONDS. A value computed from data read before an
+    # invalidation is discarded: pass the version read beforehand to set().
+    # Errors from the cache file are logged and treated as misses. Async code
+    # uses the a* methods, which only leave the event loop for the shared file.
+
+    def __init__(self, name, maxsize=1024, ttl=60.0, path=None, max_bytes=None, poll_interval=None, clock=time.time):
+        self.name = name
+        self.ttl = ttl
+        self.path = SHARED_CACHE_PATH if path is None else path
+        self.max_bytes = SHARED_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.poll_interval = SHARED_CACHE_POLL_SECONDS if poll_interval is None else poll_interval
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl, clock=time.monotonic)
+        self._versions = TTLCache(maxsize=maxsize, ttl=ttl, clock=time.monotonic)
+        self._thread = threading.local()
+        self._lock = threading.Lock()
+        self._secret = None
+        self._last_seq = None
+        self._last_poll = None
+        self._writes = 0
+        # Shared hits are recorded here and written out with the next poll
+        self._touched = {}
+
+    def _key(self, key):
+        return f"{self.name}:{key}"
+
+    def _connect(self):
+        conn = getattr(self._thread, "conn", None)
+        if conn is None:
+            conn = connect_shared_file(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # The cache can always be rebuilt, so durability is not needed
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.executescript(SHARED_CACHE_SCHEMA)
+            with self._lock:
+                if self._secret is None:
+                    self._secret = _load_secret(self.path)
+            self._thread.conn = conn
+        return conn
+
+    def _shared(self, operation, default=None):
+        if not self.path:
+            return default
+        try:
+            return operation(self._connect())
+        except sqlite3.Error as e:
+            logger.warning("Shared cache %s unavailable: %s", self.name, e)
+            return default
+        except OSError as e:
+            # An unsafe location stays unsafe; keep this process local from now on
+            logger.warning("Shared cache %s disabled: %s", self.name, e)
+            self.path = ""
+            return default
+
+    def _sign(self, blob):
+        return hmac.new(self._secret, blob, hashlib.sha256).digest()
+
+    def _dumps(self, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        return self._sign(blob) + blob
+
+    def _loads(self, data):
+        # Only blobs signed with this host's key are unpickled
+        signature, blob = data[:_SIGNATURE_SIZE], data[_SIGNATURE_SIZE:]
+        if not hmac.compare_digest(signature, self._sign(blob)):
+            logger.warning("Shared cache %s: discarding an entry with a bad signature", self.name)
+            return _MISSING
+        return pickle.loads(blob)
+
+    def _write_touched(self, conn):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            conn.executemany(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", [(at, key) for key, at in touched.items()]
+            )
+
+    def _poll_due(self):
+        return self._last_poll is None or time.monotonic() - self._last_poll >= self.poll_interval
+
+    def _poll(self):
+        # Drop local entries invalidated by any worker since the last poll
+        now = time.monotonic()
+        if not self.path or not self._poll_due():
+            return
+        with self._lock:
+            if not self._poll_due():
+                return
+            self._last_poll = now
+
+        def read_events(conn):
+            self._write_touched(conn)
+            if self._last_seq is None:
+                return None, conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0], []
+            oldest = conn.execute("SELECT MIN(seq) FROM events").fetchone()[0]
+            rows = conn.execute("SELECT seq, key FROM events WHERE seq > ? ORDER BY seq", (self._last_seq,)).fetchall()
+            return oldest, rows[-1][0] if rows else self._last_seq, [key for _, key in rows]
+
+        result = self._shared(read_events)
+        if result is None:
+            return
+        oldest, last_seq, keys = result
+        if self._last_seq is not None and oldest is not None and oldest > self._last_seq + 1:
+            # Events were pruned before this worker saw them
+            self.local.clear()
+            self._versions.clear()
+        # In-process tiers use the full shared key, so events apply directly
+        for key in keys:
+            self.local.invalidate(key)
+            self._versions.invalidate(key)
+        self._last_seq = last_seq
+
+    def _local_only(self):
+        # True when a call can be answered without touching the shared file
+        return not self.path or not self._poll_due()
+
+    def version(self, key):
+        self._poll()
+        key = self._key(key)
+        cached = self._versions.get(key)
+        if cached is not None:
+            return cached
+
+        def read_version(conn):
+            row = conn.execute("SELECT version FROM versions WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else 0
+
+        version = self._shared(read_version, 0)
+        self._versions.set(key, version)
+        return version
+
+    async def aversion(self, key):
+        if self._local_only():
+            cached = self._versions.get(self._key(key))
+            if cached is not None:
+                return cached
+        return await anyio.to_thread.run_sync(self.version, key)
+
+    def get(self, key, default=None):
+        self._poll()
+        key = self._key(key)
+        entry = self.local.get(key, _MISSING)
+        if entry is not _MISSING:
+            self.hits += 1
+            return entry[1]
+
+        now = self.clock()
+
+        def read_entry(conn):
+            return conn.execute(
+                "SELECT e.version, e.value, e.expires_at FROM entries e "
+                "LEFT JOIN versions v ON v.key = e.key "
+                "WHERE e.key = ? AND e.expires_at > ? AND e.version = COALESCE(v.version, 0)",
+                (key, now),
+            ).fetchone()
+
+        row = self._shared(read_entry)
+        value = _MISSING if row is None else self._loads(row[1])
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        version, _, expires_at = row
+        with self._lock:
+            self._touched[key] = now
+        self.local.set(key, (version, value), ttl=expires_at - now)
+        self.hits += 1
+        return value
+
+    async def aget(self, key, default=None):
+        if self._local_only():
+            entry = self.local.get(self._key(key), _MISSING)
+            if entry is not _MISSING:
+                self.hits += 1
+                return entry[1]
+            if not self.path:
+                self.misses += 1
+                return default
+        return await anyio.to_thread.run_sync(self.get, key, default)
+
+    def set(self, key, value, ttl=None, version=None):
+        # With a version, the value is only stored if the key was not invalidated since
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        current = self.version(key)
+        key = self._key(key)
+        if version is not None and version != current:
+            return False
+        now = self.clock()
+
+        def write_entry(conn):
+            blob = self._dumps(value)
+            cursor = conn.execute(
+                "INSERT OR REPLACE INTO entries (key, version, value, size, expires_at, accessed_at) "
+                "SELECT ?, ?, ?, ?, ?, ? WHERE COALESCE((SELECT version FROM versions WHERE key = ?), 0) = ?",
+                (key, current, blob, len(blob), now + ttl, now, key, current),
+            )
+            return cursor.rowcount > 0
+
+        stored = self._shared(write_entry, True)
+        if stored:
+            self.local.set(key, (current, value), ttl=ttl)
+            self._writes += 1
+            if self._writes % SHARED_CACHE_EVICTION_INTERVAL == 0:
+                self.evict()
+        return stored
+
+    async def aset(self, key, value, ttl=None, version=None):
+        if not self.path:
+            return self.set(key, value, ttl=ttl, version=version)
+        return await anyio.to_thread.run_sync(partial(self.set, key, value, ttl=ttl, version=version))
+
+    def _invalidate_local(self, key):
+        self.local.invalidate(key)
+        self._versions.invalidate(key)
+
+    def _publish(self, key):
+        now = self.clock()
+
+        def publish(conn):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO versions (key, version) VALUES (?, 1) "
+                    "ON CONFLICT (key) DO UPDATE SET version = version + 1",
+                    (key,),
+                )
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                conn.execute("INSERT INTO events (key, created_at) VALUES (?, ?)", (key, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        self._shared(publish)
+
+    def invalidate(self, key):
+        key = self._key(key)
+        self._invalidate_local(key)
+        self._publish(key)
+
+    def invalidate_in_background(self, key):
+        # This worker stops serving the key at once; the shared file is updated
+        # on the publisher thread. A value stored in between carries the old
+        # version, so it is dropped again when the publication lands.
+        key = self._key(key)
+        self._invalidate_local(key)
+        if not self.path:
+            return None
+
+        def publish():
+            self._publish(key)
+            self._invalidate_local(key)
+
+        return _publisher.submit(publish)
+
+    def evict(self):
+        # Drop expired entries and old events, then least recently used entries
+        # until the file holds at most max_bytes of values
+        now = self.clock()
+
+        def run_eviction(conn):
+            self._write_touched(conn)
+            conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM events WHERE created_at < ?", (now - SHARED_CACHE_EVENT_RETENTION_SECONDS,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            excess = total - self.max_bytes * 0.9
+            evicted = 0
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+                if excess <= 0:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                excess -= size
+                evicted += 1
+            return evicted
+
+        return self._shared(run_eviction, 0)
+
+    def clear(self):
+        self.local.clear()
+        self._versions.clear()
+        with self._lock:
+            self._touched.clear()
+        self._shared(lambda conn: conn.execute("DELETE FROM entries WHERE key LIKE ?", (f"{self.name}:%",)))
+
+    def __len__(self):
+        return len(self.local)
+
+    def stats(self):
+        stats = {"name": self.name, "hits": self.hits, "misses": self.misses, "local": self.local.stats()}
+        size = self._shared(
+            lambda conn: conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE key LIKE ?", (f"{self.name}:%",)
+            ).fetchone()
+        )
+        if size is not None:
+            stats["shared_entries"], stats["shared_bytes"] = size
+        return stats
@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import sys
+from sqlalchemy import select, or_, bindparam
+from myblog.assets import write_manifest, ASSET_MANIFEST_PATH, STATIC_DIR
+from myblog.bulk import export_cards, import_cards, IMPORT_BATCH_SIZE
+from myblog.compression import compress_static
+from myblog.database import AsyncSessionLocal, engine
+from myblog.migrations import migrate, schema_status
+from myblog.models import Card, User
+from myblog.rendering import RENDERER_VERSION, render_markdown
+
+
+async def backfill_rendered_cards(batch_size=500, force=False, session_factory=AsyncSessionLocal):
+    # Re-render cards whose stored HTML came from another renderer version.
+    # updated_at is kept, like the render job does: the cards did not change.
+    rendered = 0
+    last_id = 0
+    store = (
+        Card.__table__.update()
+        .where(Card.id == bindparam("card_id"))
+        .values(content_html=bindparam("html"), render_version=RENDERER_VERSION, updated_at=Card.updated_at)
+    )
+    async with session_factory() as session:
+        while True:
+            query = select(Card.id, Card.content).where(Card.id > last_id).order_by(Card.id).limit(batch_size)
+            if not force:
+                query = query.where(or_(Card.render_version.is_(None), Card.render_version != RENDERER_VERSION))
+            result = await session.execute(query)
+            rows = result.all()
+            if not rows:
+                break
+            await session.execute(store, [{"card_id": row.id, "html": render_markdown(row.content)} for row in rows])
+            await session.commit()
+            rendered += len(rows)
+            last_id = rows[-1].id
+            print(f"Rendered {rendered} cards (up to id {last_id})")
+    return rendered
+
+
+async def read_lines(stream):
+    for line in stream:
+        yield line
+
+
+async def import_cards_file(path, author=None, batch_size=IMPORT_BATCH_SIZE):
+    async with AsyncSessionLocal() as session:
+        default_author_id = None
+        if author:
+            result = await session.execute(select(User.id).where(User.username == author))
+            default_author_id = result.scalar_one_or_none()
+            if default_author_id is None:
+                raise SystemExit(f"Unknown user {author!r}")
+
+        def progress(report):
+            print(f"Imported {report.imported} cards, {report.failed} failed", file=sys.stderr)
+
+        with open(path, encoding="utf-8") as stream:
+            report = await import_cards(session, read_lines(stream), default_author_id, batch_size, on_progress=progress)
+    for error in report.errors:
+        print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+    return report
+
+
+async def export_cards_file(path):
+    async with AsyncSessionLocal() as session:
+        with open(path, "w", encoding="utf-8") as stream:
+            async for chunk in export_cards(session):
+                stream.write(chunk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m myblog.cli", description="My Blog maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backfill = subparsers.add_parser("backfill-html", help="Re-render stored card HTML")
+    backfill.add_argument("--batch-size", type=int, default=500)
+    backfill.add_argument("--force", action="store_true", help="Re-render every card, not only stale ones")
+
+    import_parser = subparsers.add_parser("import-cards", help="Import cards from an NDJSON file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--author", help="Username for rows that do not name an author")
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+
+    export_parser = subparsers.add_parser("export-cards", help="Export all cards to an NDJSON file")
+    export_parser.add_argument("path")
+
+    migrate_parser = subparsers.add_parser("migrate", help="Apply pending schema migrations")
+    migrate_parser.add_argument("--target", type=int, help="Stop at this revision")
+    migrate_parser.add_argument("--status", action="store_true", help="Only show the current and latest revision")
+
+    compress_parser = subparsers.add_parser("compress-static", help="Write .gz/.br sidecars for static assets")
+    compress_parser.add_argument("--directory", default=str(STATIC_DIR))
+
+    assets_parser = subparsers.add_parser("build-assets", help="Write the fingerprinted static asset manifest")
+    assets_parser.add_argument("--directory", default=str(STATIC_DIR))
+    assets_parser.add_argument("--output", default=str(ASSET_MANIFEST_PATH))
+
+    args = parser.parse_args(argv)
+
+    if args.command == "backfill-html":
+        total = asyncio.run(backfill_rendered_cards(batch_size=args.batch_size, force=args.force))
+        print(f"Done: {total} cards re-rendered with renderer {RENDERER_VERSION}")
+    elif args.command == "import-cards":
+        report = asyncio.run(import_cards_file(args.path, author=args.author, batch_size=args.batch_size))
+        print(f"Done: {report.imported} imported, {report.failed} failed")
+    elif args.command == "export-cards":
+        asyncio.run(export_cards_file(args.path))
+    elif args.command == "migrate":
+        if args.status:
+            version, head = asyncio.run(schema_status(engine))
+            print(f"Schema revision {version} of {head}")
+        else:
+            applied = asyncio.run(migrate(engine, target=args.target))
+            print(f"Applied {len(applied)} migrations" + (f": {', '.join(map(str, applied))}" if applied else ""))
+    elif args.command == "compress-static":
+        # Uploaded media is stored as uploaded and never precompressed
+        written = compress_static(args.directory, skip=("media",))
+        print(f"Wrote {written} compressed sidecars")
+    elif args.command == "build-assets":
+        manifest = write_manifest(args.directory, args.output)
+        print(f"Fingerprinted {len(manifest)} assets into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
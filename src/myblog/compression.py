@@ -0,0 +1,264 @@
+from mimetypes import guess_type
+from pathlib import Path
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+import gzip
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is produced
+    brotli = None
+
+# Negotiated compression. Dynamic responses are compressed on the fly by
+# CompressionMiddleware; static assets are compressed once by
+# `python -m myblog.cli compress-static` and served from .br / .gz sidecars.
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+# Bodies smaller than this are sent as they are; compression would not pay off
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Per-request levels favour speed; the static build step uses the maximum
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+# Server preference order
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+SIDECAR_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Everything else (images, video, audio, archives, fonts in woff/woff2) is
+# already compressed or not worth it
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/x-ndjson",
+    "application/xml",
+    "application/wasm",
+    "font/ttf",
+    "font/otf",
+    "image/svg+xml",
+    "image/x-icon",
+}
+
+
+def is_compressible(content_type):
+    media_type = (content_type or "").split(";", 1)[0].strip().lower()
+    return (
+        media_type.startswith("text/")
+        or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith("+json")
+        or media_type.endswith("+xml")
+    )
+
+
+def negotiate_encoding(accept_encoding, available=ENCODINGS):
+    # Picks the available coding with the highest q-value; ties go to the
+    # server's order. Returns None when identity should be sent.
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    best, best_weight = None, 0.0
+    for coding in available:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        # Flushed per chunk, so streamed pages still arrive progressively
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self._brotli is not None:
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+def _add_vary(headers):
+    vary = headers.get("vary")
+    if vary is None:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower() and vary.strip() != "*":
+        headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+class CompressionMiddleware:
+    # Plain ASGI middleware. Whole bodies under minimum_size pass through;
+    # streamed bodies are compressed chunk by chunk without buffering.
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE, exclude_prefixes=()):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = None
+        if scope["method"] != "HEAD":
+            encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        start = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows how much is coming
+                start = message
+                return
+            if compressor is not None and message["type"] == "http.response.body":
+                body = compressor.chunk(message.get("body", b""))
+                if not message.get("more_body", False):
+                    body += compressor.finish()
+                await send({**message, "body": body})
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=list(start["headers"]))
+            message_start, start = start, None
+            if (
+                message_start["status"] < 200 or message_start["status"] in (204, 206, 304)
+                or not is_compressible(headers.get("content-type"))
+                or "content-encoding" in headers
+                # Byte ranges refer to the identity body, so range-able files
+                # (uploaded media) are left alone
+                or "content-range" in headers or headers.get("accept-ranges", "none") != "none"
+            ):
+                await send(message_start)
+                await send(message)
+                return
+            _add_vary(headers)
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            length = headers.get("content-length")
+            size = len(body) if not more_body else int(length) if length else None
+            if encoding is None or (size is not None and size < self.minimum_size):
+                await send({**message_start, "headers": headers.raw})
+                await send(message)
+                return
+
+            compressor = _Compressor(encoding)
+            body = compressor.chunk(body)
+            if not more_body:
+                body += compressor.finish()
+                headers["Content-Length"] = str(len(body))
+            elif "content-length" in headers:
+                del headers["content-length"]
+            headers["Content-Encoding"] = encoding
+            # The compressed body is a different representation; a weak
+            # validator still matches the route's own If-None-Match checks
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            await send({**message_start, "headers": headers.raw})
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    # Serves foo.css.br / foo.css.gz in place of foo.css when the client accepts
+    # it. Sidecars are never produced per request; top-level directories named
+    # in `skip` (user uploads) are always served as stored.
+    def __init__(self, *args, skip=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.skip = set(skip)
+        self._sidecars = {}
+
+    def _skipped(self, full_path):
+        try:
+            relative = Path(full_path).resolve().relative_to(Path(self.directory).resolve())
+        except ValueError:
+            return True
+        return not relative.parts or relative.parts[0] in self.skip
+
+    def _sidecar(self, full_path, stat_result, encoding):
+        # Cached per source file version; a sidecar older than its source is ignored
+        key = (str(full_path), encoding)
+        version = (stat_result.st_mtime_ns, stat_result.st_size)
+        cached = self._sidecars.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        path = f"{full_path}{SIDECAR_SUFFIXES[encoding]}"
+        try:
+            sidecar = os.stat(path)
+        except OSError:
+            sidecar = None
+        found = (path, sidecar) if sidecar is not None and sidecar.st_mtime_ns >= stat_result.st_mtime_ns else None
+        self._sidecars[key] = (version, found)
+        return found
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        media_type = guess_type(str(full_path))[0] or "text/plain"
+        if status_code != 200 or not is_compressible(media_type) or self._skipped(full_path):
+            return super().file_response(full_path, stat_result, scope, status_code)
+        request_headers = Headers(scope=scope)
+        sidecars = {
+            encoding: sidecar for encoding in SIDECAR_SUFFIXES
+            if (sidecar := self._sidecar(full_path, stat_result, encoding)) is not None
+        }
+        headers = {"Vary": "Accept-Encoding"}
+        encoding = negotiate_encoding(request_headers.get("accept-encoding"), list(sidecars))
+        if encoding is not None:
+            full_path, stat_result = sidecars[encoding]
+            headers["Content-Encoding"] = encoding
+        response = FileResponse(
+            full_path, stat_result=stat_result, method=scope["method"], media_type=media_type, headers=headers
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def compress_static(directory, skip=(), minimum_size=COMPRESSION_MIN_SIZE):
+    # Build step: writes .gz (and .br with brotli installed) next to every
+    # compressible asset. Sidecars that would not be smaller are removed.
+    directory = Path(directory)
+    written = 0
+    for path in sorted(directory.rglob("*")):
+        relative = path.relative_to(directory)
+        if not path.is_file() or relative.parts[0] in skip or path.suffix in (".gz", ".br"):
+            continue
+        if not is_compressible(guess_type(path.name)[0]):
+            continue
+        data = path.read_bytes()
+        stat_result = path.stat()
+        outputs = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            outputs["br"] = brotli.compress(data, quality=11)
+        for encoding, compressed in outputs.items():
+            sidecar = path.with_name(path.name + SIDECAR_SUFFIXES[encoding])
+            if len(data) < minimum_size or len(compressed) >= len(data):
+                sidecar.unlink(missing_ok=True)
+                continue
+            sidecar.write_bytes(compressed)
+            # Same mtime as the source, so the static handler sees it as current
+            os.utime(sidecar, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns))
+            written += 1
+    return written
@@ -1,15 +1,90 @@
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
-from myblog.models import Base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from myblog import metrics, querylog
+from myblog.migrations import migrate, schema_status
+import os
 
-DATABASE_URL = "sqlite+aiosqlite:///./blog.db"
+# Database configuration
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./blog.db")
 
-engine = create_async_engine(
-    DATABASE_URL,
-    poolclass=NullPool,
-    connect_args={"check_same_thread": False}
-)
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# SQLite tuning, applied to every new connection
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Apply pending migrations at startup. Set to false when `python -m myblog.cli migrate`
+# runs as a deploy step; workers then only check that the schema is current.
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+
+def normalize_url(url):
+    # Accept plain postgres:// URLs (as handed out by most hosts) and use asyncpg
+    url = make_url(url)
+    if url.drivername in ("postgres", "postgresql"):
+        url = url.set(drivername="postgresql+asyncpg")
+    return url
+
+
+def engine_options(url):
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            # An in-memory database only exists on a single connection
+            return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+        return {
+            "poolclass": AsyncAdaptedQueuePool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": DB_POOL_PRE_PING,
+            "connect_args": {"check_same_thread": False},
+        }
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def build_engine(url=DATABASE_URL):
+    url = normalize_url(url)
+    engine = create_async_engine(url, **engine_options(url))
+    if url.get_backend_name() == "sqlite":
+        event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+    if metrics.METRICS_ENABLED:
+        metrics.instrument_engine(engine)
+    if querylog.QUERY_TRACKING_ENABLED:
+        querylog.instrument_engine(engine)
+    return engine
+
+
+def insert_ignore(dialect_name, table):
+    # INSERT ... ON CONFLICT DO NOTHING in the dialect's own syntax
+    dialect_insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    return dialect_insert(table).on_conflict_do_nothing()
+
+
+engine = build_engine()
 
 AsyncSessionLocal = sessionmaker(
     engine,
@@ -18,8 +93,12 @@ AsyncSessionLocal = sessionmaker(
 )
 
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    if MIGRATE_ON_STARTUP:
+        await migrate(engine)
+        return
+    version, head = await schema_status(engine)
+    if version < head:
+        raise RuntimeError(f"Database schema is at revision {version}, expected {head}; run `python -m myblog.cli migrate`")
 
 async def get_db():
     async with AsyncSessionLocal() as session:
@@ -30,4 +109,4 @@ async def get_db():
             await session.rollback()
             raise
         finally:
-            await session.close()
\ No newline at end of file
+            await session.close()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it only originals are served
+    Image = None
+
+# Responsive image variants: name -> maximum width in pixels
+VARIANT_WIDTHS = {"thumb": 320, "medium": 960}
+VARIANT_FORMAT = "webp"
+VARIANT_QUALITY = int(os.getenv("VARIANT_QUALITY", "80"))
+
+
+def available():
+    return Image is not None
+
+
+def variant_filename(stem, name):
+    return f"{stem}-{name}.{VARIANT_FORMAT}"
+
+
+def read_dimensions(source):
+    with Image.open(source) as image:
+        return image.size
+
+
+def render_variant(source, destination, width):
+    # Runs in the job runner's process pool: resize to at most `width` (never upscaling) and
+    # re-encode, writing through a temp file so readers never see a partial image
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width, width * 3))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                image.save(tmp, format=VARIANT_FORMAT.upper(), quality=VARIANT_QUALITY)
+            os.replace(tmp_path, destination)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return image.size
+
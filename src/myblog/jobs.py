@@ -0,0 +1,261 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable
+from sqlalchemy import select, update, delete, or_, and_, event
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+from myblog.models import Job
+
+# Durable background jobs. Handlers enqueue a row in the same transaction as the
+# write that needs follow-up work, so the job exists exactly when the write was
+# committed. Every worker process runs a JobRunner that claims due jobs, runs
+# them and retries failures with exponential backoff.
+
+JOB_WORKER_ENABLED = os.getenv("JOB_WORKER_ENABLED", "true").lower() == "true"
+# Concurrent jobs per lane: "io" jobs mostly await the database or disk, "cpu"
+# jobs hand their heavy part to a process pool with JOB_CPU_WORKERS processes
+JOB_IO_CONCURRENCY = int(os.getenv("JOB_IO_CONCURRENCY", "8"))
+JOB_CPU_WORKERS = int(os.getenv("JOB_CPU_WORKERS", str(os.cpu_count() or 1)))
+# The pool is the only one in the process (variants, card and import rendering).
+# Its workers are never forked from the running app, whose event loop and
+# database threads would be copied half-way through their work.
+JOB_CPU_START_METHOD = os.getenv(
+    "JOB_CPU_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn",
+)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+# A claimed job is reclaimed by another worker if not finished within the lease
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_BACKOFF_BASE_SECONDS = float(os.getenv("JOB_BACKOFF_BASE_SECONDS", "2"))
+JOB_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "600"))
+# How long shutdown waits for running jobs before handing them back to the queue
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "10"))
+
+LANES = ("io", "cpu")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class JobType:
+    name: str
+    payload: Any
+    handler: Callable
+    lane: str
+    max_attempts: int
+
+
+JOB_TYPES = {}
+
+
+def job_handler(name, payload, lane="io", max_attempts=None):
+    # Registers `async def handler(payload, ctx)`; payload is a pydantic model class
+    if lane not in LANES:
+        raise ValueError(f"Unknown job lane {lane!r}")
+
+    def decorator(func):
+        JOB_TYPES[name] = JobType(name, payload, func, lane, max_attempts or JOB_MAX_ATTEMPTS)
+        return func
+    return decorator
+
+
+def enqueue(db, name, delay=0, **fields):
+    # Adds the job to the caller's session; it runs once that session commits
+    job_type = JOB_TYPES[name]
+    payload = job_type.payload(**fields)
+    job = Job(
+        kind=name,
+        payload=payload.model_dump_json(),
+        status="queued",
+        lane=job_type.lane,
+        attempts=0,
+        max_attempts=job_type.max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.add(job)
+    event.listen(db.sync_session, "after_commit", _wake_runner, once=True)
+    return job
+
+
+def _wake_runner(session):
+    runner.wake()
+
+
+def backoff_seconds(attempts):
+    # Exponential backoff with jitter, so failed jobs do not retry in lockstep
+    delay = min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+@dataclass
+class JobContext:
+    session_factory: Any
+    runner: Any
+
+    async def run_cpu(self, func, *args):
+        return await self.runner.run_cpu(func, *args)
+
+
+class JobRunner:
+    def __init__(self, io_concurrency=JOB_IO_CONCURRENCY, cpu_concurrency=JOB_CPU_WORKERS):
+        self.limits = {"io": io_concurrency, "cpu": cpu_concurrency}
+        self.running = {lane: 0 for lane in LANES}
+        self.session_factory = None
+        self.completed = 0
+        self.failed = 0
+        self._tasks = set()
+        self._pool = None
+        self._loop_task = None
+        self._wakeup = None
+        self._stopping = False
+
+    def start(self, session_factory):
+        self.session_factory = session_factory
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._run())
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run_cpu(self, func, *args):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.limits["cpu"], mp_context=multiprocessing.get_context(JOB_CPU_START_METHOD)
+            )
+        return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+
+    async def claim(self, session_factory, lane, limit):
+        now = datetime.utcnow()
+        due = or_(
+            and_(Job.status == "queued", Job.run_at <= now),
+            and_(Job.status == "running", Job.locked_until < now),
+        )
+        # SKIP LOCKED keeps PostgreSQL workers from claiming the same rows;
+        # on SQLite the single UPDATE is atomic on its own
+        candidates = (
+            select(Job.id).where(Job.lane == lane, due).order_by(Job.run_at, Job.id).limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        statement = (
+            update(Job)
+            .where(Job.id.in_(candidates.scalar_subquery()))
+            .values(status="running", attempts=Job.attempts + 1, locked_until=now + timedelta(seconds=JOB_LEASE_SECONDS))
+            .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+            .execution_options(synchronize_session=False)
+        )
+        async with session_factory() as db:
+            result = await db.execute(statement)
+            rows = result.all()
+            await db.commit()
+        return rows
+
+    async def execute(self, session_factory, row):
+        job_type = JOB_TYPES.get(row.kind)
+        try:
+            if job_type is None:
+                raise LookupError(f"No handler registered for job kind {row.kind!r}")
+            payload = job_type.payload.model_validate_json(row.payload)
+            await job_type.handler(payload, JobContext(session_factory, self))
+        except asyncio.CancelledError:
+            # Shutdown: hand the job back without counting this attempt
+            await self._finish(session_factory, row.id, status="queued", attempts=row.attempts - 1, locked_until=None)
+            raise
+        except Exception as e:
+            if row.attempts >= row.max_attempts:
+                logger.exception("Job %s (%s) failed permanently after %d attempts", row.id, row.kind, row.attempts)
+                self.failed += 1
+                await self._finish(session_factory, row.id, status="failed", last_error=repr(e), locked_until=None)
+            else:
+                delay = backoff_seconds(row.attempts)
+                logger.warning("Job %s (%s) failed, retrying in %.1fs: %r", row.id, row.kind, delay, e)
+                await self._finish(
+                    session_factory, row.id, status="queued", last_error=repr(e), locked_until=None,
+                    run_at=datetime.utcnow() + timedelta(seconds=delay),
+                )
+        else:
+            self.completed += 1
+            async with session_factory() as db:
+                await db.execute(delete(Job).where(Job.id == row.id))
+                await db.commit()
+
+    async def _finish(self, session_factory, job_id, **values):
+        async with session_factory() as db:
+            await db.execute(update(Job).where(Job.id == job_id).values(**values))
+            await db.commit()
+
+    async def run_until_idle(self, session_factory=None):
+        # Runs every due job in this task until none are left; for tests and the CLI
+        session_factory = session_factory or self.session_factory
+        while True:
+            claimed = 0
+            for lane in LANES:
+                for row in await self.claim(session_factory, lane, self.limits[lane]):
+                    claimed += 1
+                    await self.execute(session_factory, row)
+            if not claimed:
+                return
+
+    def _spawn(self, lane, row):
+        self.running[lane] += 1
+        task = asyncio.create_task(self.execute(self.session_factory, row))
+        self._tasks.add(task)
+
+        def done(task):
+            self._tasks.discard(task)
+            self.running[lane] -= 1
+            self.wake()
+        task.add_done_callback(done)
+
+    async def _run(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                for lane in LANES:
+                    free = self.limits[lane] - self.running[lane]
+                    if free > 0:
+                        for row in await self.claim(self.session_factory, lane, free):
+                            self._spawn(lane, row)
+            except Exception:
+                logger.exception("Failed to claim jobs")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self, timeout=JOB_DRAIN_SECONDS):
+        # Stop claiming, give running jobs `timeout` seconds, then cancel the rest
+        self._stopping = True
+        self.wake()
+        if self._loop_task is not None:
+            await self._loop_task
+            self._loop_task = None
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        self.shutdown_pool()
+
+    def shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {
+            "running": dict(self.running),
+            "limits": dict(self.limits),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+runner = JobRunner()
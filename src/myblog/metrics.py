@@ -0,0 +1,261 @@
+from contextvars import ContextVar
+from fastapi import HTTPException, Request
+import hmac
+import os
+import threading
+import time
+from myblog.querytiming import observe_queries
+
+# In-process metrics in the Prometheus text exposition format. When
+# METRICS_ENABLED is off nothing is hooked up: no middleware, no engine
+# events, no template wrapper, and /metrics is not routed. It is off unless
+# enabled, since the scrape lists every route and its traffic.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+# When set, scrapes must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# Starlette appends the charset to text/ media types
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}_total{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [per-bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self._values.items())
+        bucket_names = self.labelnames + ("le",)
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(bucket_names, labels + (_format_value(float(bound)),))
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(total)}"
+            yield f"{self.name}_count{label_text} {count}"
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+http_requests = register(Counter(
+    "http_requests", "HTTP requests by route and status", ("method", "route", "status")
+))
+http_request_duration = register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+))
+http_request_queries = register(Histogram(
+    "http_request_db_queries", "SQL statements issued per HTTP request", ("method", "route"), QUERY_COUNT_BUCKETS
+))
+db_query_duration = register(Histogram(
+    "db_query_duration_seconds", "SQL statement latency by statement type", ("statement",), QUERY_BUCKETS
+))
+markdown_render_duration = register(Histogram(
+    "markdown_render_duration_seconds", "Markdown to HTML conversion time"
+))
+template_render_duration = register(Histogram(
+    "template_render_duration_seconds", "Jinja2 template rendering time", ("template",)
+))
+auth_admissions = register(Counter(
+    "auth_admissions", "Password endpoint requests admitted or rejected by admission control", ("outcome",)
+))
+
+
+def authorize_scrape(request: Request):
+    if not METRICS_TOKEN:
+        return
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        kind = "counter" if isinstance(metric, Counter) else "histogram"
+        name = f"{metric.name}_total" if kind == "counter" else metric.name
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    for metric in REGISTRY:
+        metric.reset()
+
+
+# Per-request state, so engine events can attribute queries to a request
+class RequestStats:
+    __slots__ = ("queries", "query_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+current_request = ContextVar("current_request", default=None)
+
+
+def _observe_query(conn, statement, parameters, executemany, elapsed):
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    db_query_duration.observe(elapsed, keyword)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += elapsed
+
+
+def instrument_engine(engine):
+    # Works with both sync engines and AsyncEngine
+    return observe_queries(engine, _observe_query)
+
+
+def instrument_templates(environment):
+    # Every template loaded from this environment times its own rendering
+    base = environment.template_class
+
+    class TimedTemplate(base):
+        def render(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().render(*args, **kwargs)
+            finally:
+                template_render_duration.observe(time.perf_counter() - started, self.name or "<string>")
+
+        def generate(self, *args, **kwargs):
+            # Streamed output: only the time spent producing chunks is counted
+            elapsed = 0.0
+            chunks = super().generate(*args, **kwargs)
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        chunk = next(chunks)
+                    except StopIteration:
+                        break
+                    finally:
+                        elapsed += time.perf_counter() - started
+                    yield chunk
+            finally:
+                template_render_duration.observe(elapsed, self.name or "<string>")
+
+    environment.template_class = TimedTemplate
+    return environment
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware, so streamed and zero-copy responses pass through untouched
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(token)
+            # Label by route template, not raw path, to keep cardinality bounded
+            route = scope.get("route")
+            route_label = getattr(route, "path", None) or "other"
+            method = scope["method"]
+            http_requests.inc(method, route_label, str(status_code))
+            http_request_duration.observe(elapsed, method, route_label)
+            http_request_queries.observe(stats.queries, method, route_label)
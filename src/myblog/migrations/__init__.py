@@ -0,0 +1 @@
+from myblog.migrations.runner import migrate, schema_status, load_revisions, head_revision, current_version
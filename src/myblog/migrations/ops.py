@@ -0,0 +1,52 @@
+from sqlalchemy import inspect, text
+
+# Schema operations for revisions. Each one is idempotent, so a revision can
+# run against a database that was already patched by hand (see check_db.sql).
+
+
+def has_table(conn, table):
+    return inspect(conn).has_table(table)
+
+
+def column_names(conn, table):
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+def index_names(conn, table):
+    return {index["name"] for index in inspect(conn).get_indexes(table)}
+
+
+def add_column(conn, table, column):
+    if column.name in column_names(conn, table):
+        return
+    ddl = f"ALTER TABLE {table} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    conn.exec_driver_sql(ddl)
+
+
+def create_index(conn, name, table, columns, unique=False, concurrently=True):
+    # On PostgreSQL the index is built CONCURRENTLY, so writes continue while it
+    # builds; such revisions must set transactional = False. A failed concurrent
+    # build leaves an invalid index behind, which is dropped and rebuilt.
+    unique_sql = "UNIQUE " if unique else ""
+    column_sql = ", ".join(columns)
+    if conn.dialect.name == "postgresql" and concurrently:
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        conn.exec_driver_sql(f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({column_sql})")
+    else:
+        conn.exec_driver_sql(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({column_sql})")
+
+
+def drop_index(conn, name, concurrently=True):
+    # The counterpart of create_index: on PostgreSQL the index is dropped
+    # CONCURRENTLY, so the revision must set transactional = False
+    if conn.dialect.name == "postgresql" and concurrently:
+        conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    else:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
@@ -0,0 +1,50 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, DateTime, ForeignKey, Enum, Boolean
+
+revision = 1
+description = "Initial schema"
+transactional = True
+
+# The schema as it was before versioned migrations, frozen here so later model
+# changes do not leak into this revision.
+metadata = MetaData()
+
+Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String(50), unique=True, index=True),
+    Column("email", String(100), unique=True, index=True),
+    Column("hashed_password", String(100)),
+    Column("created_at", DateTime),
+    Column("role", Enum("ADMIN", "DEVELOPER", "VIEWER", name="role")),
+)
+
+Table(
+    "cards", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("title", String(200)),
+    Column("content", Text),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+    Column("author_id", Integer, ForeignKey("users.id")),
+    Column("to_all", Boolean),
+)
+
+Table(
+    "media_files", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("filename", String(255)),
+    Column("file_path", String(255)),
+    Column("file_type", String(50)),
+    Column("uploaded_at", DateTime),
+    Column("uploader_id", Integer, ForeignKey("users.id")),
+)
+
+Table(
+    "card_media", metadata,
+    Column("card_id", Integer, ForeignKey("cards.id")),
+    Column("media_id", Integer, ForeignKey("media_files.id")),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
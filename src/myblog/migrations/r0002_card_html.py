@@ -0,0 +1,12 @@
+from sqlalchemy import Column, String, Text
+from myblog.migrations.ops import add_column
+
+revision = 2
+description = "Store rendered card HTML"
+transactional = True
+
+
+def upgrade(conn):
+    # Existing rows are rendered on first read or by `python -m myblog.cli backfill-html`
+    add_column(conn, "cards", Column("content_html", Text))
+    add_column(conn, "cards", Column("render_version", String(64)))
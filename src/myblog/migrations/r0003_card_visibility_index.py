@@ -0,0 +1,9 @@
+from myblog.migrations.ops import create_index
+
+revision = 3
+description = "Index the card visibility filter"
+transactional = False
+
+
+def upgrade(conn):
+    create_index(conn, "ix_cards_visibility", "cards", ["to_all", "author_id", "created_at"])
@@ -0,0 +1,32 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
+from myblog.migrations.ops import add_column
+
+revision = 4
+description = "Content-addressed media, dimensions and variants"
+transactional = True
+
+metadata = MetaData()
+
+media_variants = Table(
+    "media_variants", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("media_id", Integer, ForeignKey("media_files.id"), nullable=False),
+    Column("name", String(20), nullable=False),
+    Column("file_path", String(255)),
+    Column("width", Integer),
+    Column("height", Integer),
+    Column("created_at", DateTime),
+    UniqueConstraint("media_id", "name", name="uq_media_variants_media_name"),
+)
+
+# Referenced table, so the foreign key above can be resolved
+Table("media_files", metadata, Column("id", Integer, primary_key=True))
+
+
+def upgrade(conn):
+    add_column(conn, "media_files", Column("content_hash", String(64)))
+    add_column(conn, "media_files", Column("ref_count", Integer, server_default="1"))
+    add_column(conn, "media_files", Column("size", Integer))
+    add_column(conn, "media_files", Column("width", Integer))
+    add_column(conn, "media_files", Column("height", Integer))
+    media_variants.create(conn, checkfirst=True)
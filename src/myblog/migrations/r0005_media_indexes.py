@@ -0,0 +1,11 @@
+from myblog.migrations.ops import create_index
+
+revision = 5
+description = "Index media by content hash, uploader and type"
+transactional = False
+
+
+def upgrade(conn):
+    create_index(conn, "ix_media_files_content_hash", "media_files", ["content_hash"], unique=True)
+    create_index(conn, "ix_media_files_uploader_uploaded", "media_files", ["uploader_id", "uploaded_at"])
+    create_index(conn, "ix_media_files_file_type", "media_files", ["file_type"])
@@ -0,0 +1,37 @@
+from myblog.migrations.ops import column_names, create_index
+
+revision = 6
+description = "Primary key, reverse index and attachment order for card_media"
+transactional = True
+
+
+def upgrade(conn):
+    if "position" not in column_names(conn, "card_media"):
+        if conn.dialect.name == "sqlite":
+            # SQLite cannot add a primary key in place, so the table is rebuilt
+            conn.exec_driver_sql("""
+                CREATE TABLE card_media_new (
+                    card_id INTEGER NOT NULL REFERENCES cards (id),
+                    media_id INTEGER NOT NULL REFERENCES media_files (id),
+                    position INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (card_id, media_id)
+                )
+            """)
+            conn.exec_driver_sql("""
+                INSERT OR IGNORE INTO card_media_new (card_id, media_id, position)
+                SELECT card_id, media_id, ROW_NUMBER() OVER (PARTITION BY card_id ORDER BY rowid) - 1
+                FROM card_media WHERE card_id IS NOT NULL AND media_id IS NOT NULL
+            """)
+            conn.exec_driver_sql("DROP TABLE card_media")
+            conn.exec_driver_sql("ALTER TABLE card_media_new RENAME TO card_media")
+        else:
+            # Drop duplicate and incomplete links before adding the key
+            conn.exec_driver_sql("""
+                DELETE FROM card_media a USING card_media b
+                WHERE a.ctid > b.ctid AND a.card_id = b.card_id AND a.media_id = b.media_id
+            """)
+            conn.exec_driver_sql("DELETE FROM card_media WHERE card_id IS NULL OR media_id IS NULL")
+            conn.exec_driver_sql("ALTER TABLE card_media ADD COLUMN position INTEGER NOT NULL DEFAULT 0")
+            conn.exec_driver_sql("ALTER TABLE card_media ADD PRIMARY KEY (card_id, media_id)")
+    # Runs inside the revision's transaction, so it cannot be built concurrently
+    create_index(conn, "ix_card_media_media_card", "card_media", ["media_id", "card_id"], concurrently=False)
@@ -0,0 +1,9 @@
+from myblog.search import install_search_index
+
+revision = 7
+description = "Full-text search index over cards"
+transactional = True
+
+
+def upgrade(conn):
+    install_search_index(conn)
@@ -0,0 +1,27 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, DateTime, Index
+
+revision = 8
+description = "Background job queue"
+transactional = True
+
+metadata = MetaData()
+
+jobs = Table(
+    "jobs", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("kind", String(64), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("status", String(16), nullable=False),
+    Column("lane", String(8), nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("max_attempts", Integer, nullable=False),
+    Column("run_at", DateTime, nullable=False),
+    Column("locked_until", DateTime),
+    Column("last_error", Text),
+    Column("created_at", DateTime),
+    Index("ix_jobs_claim", "status", "lane", "run_at"),
+)
+
+
+def upgrade(conn):
+    jobs.create(conn, checkfirst=True)
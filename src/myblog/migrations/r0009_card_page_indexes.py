@@ -0,0 +1,11 @@
+from myblog.migrations.ops import create_index
+
+revision = 9
+description = "Index each arm of the card list in page order"
+transactional = False
+
+
+def upgrade(conn):
+    create_index(conn, "ix_cards_shared_created", "cards", ["to_all", "created_at", "id"])
+    create_index(conn, "ix_cards_author_created", "cards", ["author_id", "created_at", "id"])
+    create_index(conn, "ix_cards_created", "cards", ["created_at", "id"])
@@ -0,0 +1,9 @@
+from myblog.migrations.ops import create_index
+
+revision = 10
+description = "Index media in page order"
+transactional = False
+
+
+def upgrade(conn):
+    create_index(conn, "ix_media_files_uploaded", "media_files", ["uploaded_at", "id"])
@@ -0,0 +1,9 @@
+from myblog.migrations.ops import drop_index
+
+revision = 11
+description = "Drop the card visibility index, superseded by the per-arm page indexes"
+transactional = False
+
+
+def upgrade(conn):
+    drop_index(conn, "ix_cards_visibility")
@@ -0,0 +1,138 @@
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, select, func, insert, inspect, text
+from sqlalchemy.exc import OperationalError
+import importlib
+import logging
+import os
+import pkgutil
+import re
+import time
+
+# Numbered schema revisions live next to this module as rNNNN_<name>.py. Each
+# defines `revision`, `description`, `transactional` and `upgrade(conn)`, where
+# conn is a synchronous Connection. Applied revisions are recorded in
+# schema_version; a database that is already current costs two small queries.
+
+MIGRATION_LOCK_TIMEOUT = float(os.getenv("MIGRATION_LOCK_TIMEOUT", "300"))
+# PostgreSQL advisory lock key shared by every process migrating this schema
+ADVISORY_LOCK_KEY = 0x6D79626C6F67
+
+logger = logging.getLogger(__name__)
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200)),
+    Column("applied_at", DateTime),
+)
+
+_revisions = None
+
+
+def load_revisions():
+    global _revisions
+    if _revisions is None:
+        package = importlib.import_module("myblog.migrations")
+        names = sorted(
+            name for _, name, _ in pkgutil.iter_modules(package.__path__) if re.fullmatch(r"r\d{4}_\w+", name)
+        )
+        revisions = [importlib.import_module(f"myblog.migrations.{name}") for name in names]
+        for expected, module in enumerate(revisions, start=1):
+            if module.revision != expected:
+                raise RuntimeError(f"Migration {module.__name__} has revision {module.revision}, expected {expected}")
+        _revisions = revisions
+    return _revisions
+
+
+def head_revision():
+    return len(load_revisions())
+
+
+def current_version(conn):
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+@contextmanager
+def migration_lock(conn):
+    # Only one process migrates; the others wait here, then find nothing to do.
+    # The connection is in autocommit mode, so transactions are explicit.
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        # BEGIN IMMEDIATE takes the database write lock. The whole run is one
+        # transaction, since SQLite DDL is transactional.
+        deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT
+        while True:
+            try:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                break
+            except OperationalError as e:
+                if "locked" not in str(e) or time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        try:
+            yield
+        except BaseException:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+        conn.exec_driver_sql("COMMIT")
+    elif dialect == "postgresql":
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+    else:
+        yield
+
+
+def apply_revision(conn, module):
+    logger.info("Applying migration %04d: %s", module.revision, module.description)
+    # On SQLite everything already runs inside the lock's transaction
+    own_transaction = module.transactional and conn.dialect.name != "sqlite"
+    if own_transaction:
+        conn.exec_driver_sql("BEGIN")
+    try:
+        module.upgrade(conn)
+        conn.execute(insert(schema_version).values(
+            version=module.revision, description=module.description, applied_at=datetime.utcnow()
+        ))
+    except BaseException:
+        if own_transaction:
+            conn.exec_driver_sql("ROLLBACK")
+        raise
+    if own_transaction:
+        conn.exec_driver_sql("COMMIT")
+
+
+def run_migrations(conn, target=None):
+    revisions = load_revisions()
+    target = len(revisions) if target is None else target
+    # Fast path: no lock and no DDL when the schema is already current
+    if current_version(conn) >= target:
+        return []
+    with migration_lock(conn):
+        schema_version.create(conn, checkfirst=True)
+        # Another process may have migrated while this one waited for the lock
+        version = current_version(conn)
+        applied = []
+        for module in revisions:
+            if version < module.revision <= target:
+                apply_revision(conn, module)
+                applied.append(module.revision)
+        return applied
+
+
+async def migrate(engine, target=None):
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        return await conn.run_sync(run_migrations, target)
+
+
+async def schema_status(engine):
+    async with engine.connect() as conn:
+        version = await conn.run_sync(current_version)
+    return version, head_revision()
@@ -1 +1 @@
-from .models import Base, User, MediaFile, Card, Role
\ No newline at end of file
+from .models import Base, User, MediaFile, MediaVariant, Card, Role, Job
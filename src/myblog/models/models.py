@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Table, Enum, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Table, Enum, Boolean, Index, UniqueConstraint
+from sqlalchemy import inspect
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
 import enum
@@ -15,8 +16,12 @@ class Role(enum.Enum):
 card_media = Table(
     'card_media',
     Base.metadata,
-    Column('card_id', Integer, ForeignKey('cards.id')),
-    Column('media_id', Integer, ForeignKey('media_files.id'))
+    Column('card_id', Integer, ForeignKey('cards.id'), primary_key=True),
+    Column('media_id', Integer, ForeignKey('media_files.id'), primary_key=True),
+    # Attachment order within a card
+    Column('position', Integer, nullable=False, default=0),
+    # The primary key serves card -> media; this serves media -> cards
+    Index('ix_card_media_media_card', 'media_id', 'card_id')
 )
 
 class User(Base):
@@ -36,21 +41,101 @@ class Card(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(200))
     content = Column(Text)
+    content_html = Column(Text)
+    render_version = Column(String(64))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     author_id = Column(Integer, ForeignKey("users.id"))
     author = relationship("User", back_populates="cards")
-    media_files = relationship("MediaFile", secondary=card_media, back_populates="cards")
+    media_files = relationship(
+        "MediaFile",
+        secondary=card_media,
+        back_populates="cards",
+        order_by=(card_media.c.position, card_media.c.media_id)
+    )
     to_all = Column(Boolean, default=False)
 
+    __table_args__ = (
+        # One ordered range scan per arm of the card list: shared cards, a
+        # user's own cards, and every card for admins
+        Index("ix_cards_shared_created", "to_all", "created_at", "id"),
+        Index("ix_cards_author_created", "author_id", "created_at", "id"),
+        Index("ix_cards_created", "created_at", "id"),
+    )
+
 class MediaFile(Base):
     __tablename__ = "media_files"
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255))
     file_path = Column(String(255))
-    file_type = Column(String(50))
+    file_type = Column(String(50), index=True)
+    # SHA-256 of the file bytes; identical uploads share one stored file and row
+    content_hash = Column(String(64), unique=True, index=True)
+    ref_count = Column(Integer, default=1)
+    size = Column(Integer)
+    width = Column(Integer)
+    height = Column(Integer)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     uploader_id = Column(Integer, ForeignKey("users.id"))
     uploader = relationship("User")
-    cards = relationship("Card", secondary=card_media, back_populates="media_files")
\ No newline at end of file
+    cards = relationship("Card", secondary=card_media, back_populates="media_files")
+    variants = relationship("MediaVariant", back_populates="media_file", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # Serves per-uploader listings, newest first
+        Index("ix_media_files_uploader_uploaded", "uploader_id", "uploaded_at"),
+        # Keyset pages of /media in (uploaded_at, id) order, filtered or not
+        Index("ix_media_files_uploaded", "uploaded_at", "id"),
+    )
+
+    @property
+    def is_image(self):
+        return self.file_type in ("jpg", "jpeg", "png", "gif", "webp")
+
+    def variant_url(self, name):
+        # A generated variant is linked by its stored static path, which is
+        # content-addressed and cached for good; otherwise (or when variants were
+        # not loaded) the media route generates it on first request
+        if "variants" not in inspect(self).unloaded:
+            for variant in self.variants:
+                if variant.name == name and variant.file_path:
+                    return variant.file_path
+        return f"/media/{self.id}/variants/{name}"
+
+class MediaVariant(Base):
+    __tablename__ = "media_variants"
+
+    id = Column(Integer, primary_key=True, index=True)
+    media_id = Column(Integer, ForeignKey("media_files.id"), nullable=False)
+    name = Column(String(20), nullable=False)
+    file_path = Column(String(255))
+    width = Column(Integer)
+    height = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    media_file = relationship("MediaFile", back_populates="variants")
+
+    __table_args__ = (
+        UniqueConstraint("media_id", "name", name="uq_media_variants_media_name"),
+    )
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(64), nullable=False)
+    payload = Column(Text, nullable=False)
+    # queued -> running -> (deleted on success) | queued again for a retry | failed
+    status = Column(String(16), nullable=False, default="queued")
+    lane = Column(String(8), nullable=False, default="io")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # A running job whose lease has expired belongs to a crashed worker and is claimed again
+    locked_until = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Serves the claim query: due jobs per lane, oldest first
+        Index("ix_jobs_claim", "status", "lane", "run_at"),
+    )
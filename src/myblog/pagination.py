@@ -0,0 +1,56 @@
+import base64
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import select, tuple_, union_all
+
+# Keyset (cursor) pagination over a (timestamp, id) pair, newest first.
+# Cursors are opaque url-safe tokens for the last row of the previous page.
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate(query, timestamp_column, id_column, cursor=None, limit=20):
+    # Fetch one extra row to know whether another page exists
+    query = query.order_by(timestamp_column.desc(), id_column.desc())
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.where(tuple_(timestamp_column, id_column) < (timestamp, row_id))
+    return query.limit(limit + 1)
+
+
+def paginate_union(query, conditions, timestamp_column, id_column, cursor=None, limit=20):
+    # An OR of conditions cannot walk one index in page order. Each condition
+    # gets its own ordered range scan instead, cut at limit + 1 rows, and the
+    # merged arms are sorted and cut again. The conditions must not overlap.
+    if len(conditions) == 1:
+        return paginate(query.where(conditions[0]), timestamp_column, id_column, cursor=cursor, limit=limit)
+    arms = [
+        paginate(query.where(condition), timestamp_column, id_column, cursor=cursor, limit=limit).subquery().select()
+        for condition in conditions
+    ]
+    merged = union_all(*arms).subquery()
+    return (
+        select(merged)
+        .order_by(merged.c[timestamp_column.key].desc(), merged.c[id_column.key].desc())
+        .limit(limit + 1)
+    )
+
+
+def split_page(rows, limit, key):
+    # Returns the page rows and the cursor of the next page (or None)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
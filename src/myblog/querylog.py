@@ -0,0 +1,145 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+import os
+import re
+from myblog.querytiming import observe_queries
+
+# Per-request SQL tracking: slow statements are logged with their parameters
+# and query plan, and a statement shape repeated many times within one request
+# is reported as a likely N+1 pattern.
+QUERY_TRACKING_ENABLED = os.getenv("QUERY_TRACKING_ENABLED", "true").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+EXPLAIN_SLOW_QUERIES = os.getenv("EXPLAIN_SLOW_QUERIES", "true").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+# Expanded IN lists and multi-row VALUES differ only in their placeholder count
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%\([^)]*\)s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\([^)]*\)s|\$\d+|:\w+))*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    return _PLACEHOLDER_LIST.sub("(?)", _WHITESPACE.sub(" ", statement).strip())
+
+
+class QueryTracker:
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.statements = []
+        self.shapes = {}
+        self.seconds = 0.0
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def record(self, statement, elapsed):
+        shape = statement_shape(statement)
+        tracker = self
+        # Nested trackers (a test helper around a request) all see the statement
+        while tracker is not None:
+            tracker.statements.append(shape)
+            tracker.shapes[shape] = tracker.shapes.get(shape, 0) + 1
+            tracker.seconds += elapsed
+            tracker = tracker.parent
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return [(shape, count) for shape, count in self.shapes.items() if count >= threshold]
+
+
+current_tracker = ContextVar("current_tracker", default=None)
+
+
+@contextmanager
+def track_queries():
+    tracker = QueryTracker(parent=current_tracker.get())
+    token = current_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        current_tracker.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit):
+    # Test helper: fails when the block issues more than `limit` statements
+    with track_queries() as tracker:
+        yield tracker
+    if tracker.count > limit:
+        listing = "\n".join(f"  {index}. {shape}" for index, shape in enumerate(tracker.statements, 1))
+        raise AssertionError(f"Expected at most {limit} queries, got {tracker.count}:\n{listing}")
+
+
+def explain(conn, statement, parameters):
+    # Run on a raw DBAPI cursor, so the EXPLAIN itself is not tracked. It shares
+    # the request's transaction, which any failed statement aborts on
+    # PostgreSQL, so there it runs inside a savepoint.
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        prefix, savepoint = "EXPLAIN QUERY PLAN ", False
+    elif dialect == "postgresql":
+        prefix, savepoint = "EXPLAIN ", True
+    else:
+        return None
+    cursor = conn.connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute("SAVEPOINT querylog_explain")
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        except Exception:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT querylog_explain")
+            raise
+        if savepoint:
+            cursor.execute("RELEASE SAVEPOINT querylog_explain")
+        return "\n".join(" ".join(str(value) for value in row) for row in rows)
+    finally:
+        cursor.close()
+
+
+def _observe_query(conn, statement, parameters, executemany, elapsed):
+    tracker = current_tracker.get()
+    if tracker is not None:
+        tracker.record(statement, elapsed)
+    if elapsed * 1000 < SLOW_QUERY_MS:
+        return
+    plan = None
+    if EXPLAIN_SLOW_QUERIES and not executemany and statement.lstrip()[:6].upper() in ("SELECT", "WITH"):
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception as e:
+            plan = f"(EXPLAIN failed: {e})"
+    logger.warning(
+        "Slow query (%.1f ms): %s\nparameters: %r%s",
+        elapsed * 1000,
+        statement,
+        parameters,
+        f"\nplan:\n{plan}" if plan else "",
+    )
+
+
+def instrument_engine(engine):
+    return observe_queries(engine, _observe_query)
+
+
+class QueryTrackingMiddleware:
+    # Plain ASGI middleware; reports repeated statement shapes once the request ends
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with track_queries() as tracker:
+            await self.app(scope, receive, send)
+        for shape, count in tracker.repeated():
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            logger.warning(
+                "Possible N+1 on %s %s: statement ran %d times (%d queries in request): %s",
+                scope["method"], route, count, tracker.count, shape,
+            )
@@ -0,0 +1,32 @@
+from sqlalchemy import event
+import time
+import weakref
+
+# One pair of cursor events per engine times every statement. Metrics and the
+# query log subscribe to those timings rather than each timing it again.
+
+_observers = weakref.WeakKeyDictionary()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def observe_queries(engine, observer):
+    # observer(conn, statement, parameters, executemany, elapsed) runs after
+    # every statement; works with both sync engines and AsyncEngine
+    sync_engine = getattr(engine, "sync_engine", engine)
+    observers = _observers.get(sync_engine)
+    if observers is None:
+        observers = _observers[sync_engine] = []
+
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - context._query_started
+            for observer in observers:
+                observer(conn, statement, parameters, executemany, elapsed)
+
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+    if observer not in observers:
+        observers.append(observer)
+    return engine
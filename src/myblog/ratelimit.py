@@ -0,0 +1,179 @@
+from fastapi import HTTPException, status
+from functools import partial
+import anyio
+import logging
+import math
+import sqlite3
+import threading
+import time
+from myblog.cache import TTLCache, connect_shared_file
+
+# Token buckets and a concurrency cap for admission control. A bucket holds
+# up to `capacity` tokens and refills at `per_second`; each request takes one.
+# Buckets live in process memory, or in a SQLite file shared by every worker
+# on the host when a path is given. Errors from that file are logged and the
+# limiter falls back to its in-process buckets, so it never blocks logins.
+
+RATE_LIMIT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_buckets_updated_at ON buckets (updated_at);
+"""
+
+# Forget shared buckets that have refilled completely, every this many takes
+RATE_LIMIT_PRUNE_INTERVAL = 256
+
+logger = logging.getLogger(__name__)
+
+
+def too_many_requests(detail, retry_after):
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class TokenBucketLimiter:
+    def __init__(self, name, capacity, per_second, maxsize=100_000, path=None, clock=time.time):
+        self.name = name
+        self.capacity = float(capacity)
+        self.per_second = float(per_second)
+        self.path = path
+        self.clock = clock
+        self.admitted = 0
+        self.rejected = 0
+        # An empty bucket is full again after this long, so it can be forgotten
+        self.refill_seconds = self.capacity / self.per_second
+        self.local = TTLCache(maxsize=maxsize, ttl=self.refill_seconds)
+        self._lock = threading.Lock()
+        self._thread = threading.local()
+        self._takes = 0
+
+    def _refill(self, state, now):
+        if state is None:
+            return self.capacity
+        tokens, updated_at = state
+        return min(self.capacity, tokens + max(0.0, now - updated_at) * self.per_second)
+
+    def _spend(self, tokens, cost):
+        # Returns the tokens left and how long until `cost` tokens are available
+        if tokens >= cost:
+            return tokens - cost, 0.0
+        return tokens, (cost - tokens) / self.per_second
+
+    def _take_local(self, key, cost, now):
+        with self._lock:
+            tokens, retry_after = self._spend(self._refill(self.local.get(key), now), cost)
+            self.local.set(key, (tokens, now))
+        return retry_after
+
+    def _connect(self):
+        conn = getattr(self._thread, "conn", None)
+        if conn is None:
+            conn = connect_shared_file(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.executescript(RATE_LIMIT_SCHEMA)
+            self._thread.conn = conn
+        return conn
+
+    def _take_shared(self, key, cost, now):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, retry_after = self._spend(self._refill(row, now), cost)
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._takes += 1
+        if self._takes % RATE_LIMIT_PRUNE_INTERVAL == 0:
+            conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - self.refill_seconds,))
+        return retry_after
+
+    def take(self, key, cost=1):
+        # Returns 0 when admitted, otherwise the seconds to wait before retrying
+        key = f"{self.name}:{key}"
+        now = self.clock()
+        retry_after = None
+        if self.path:
+            try:
+                retry_after = self._take_shared(key, cost, now)
+            except (sqlite3.Error, OSError) as e:
+                logger.warning("Shared rate limit %s unavailable: %s", self.name, e)
+        if retry_after is None:
+            retry_after = self._take_local(key, cost, now)
+        if retry_after:
+            self.rejected += 1
+        else:
+            self.admitted += 1
+        return retry_after
+
+    async def atake(self, key, cost=1):
+        # Async callers: the shared file is locked with BEGIN IMMEDIATE, so that
+        # take runs in a worker thread rather than on the event loop
+        if not self.path:
+            return self.take(key, cost)
+        return await anyio.to_thread.run_sync(partial(self.take, key, cost))
+
+    def clear(self):
+        self.local.clear()
+        if self.path:
+            try:
+                self._connect().execute("DELETE FROM buckets WHERE key LIKE ?", (f"{self.name}:%",))
+            except (sqlite3.Error, OSError) as e:
+                logger.warning("Shared rate limit %s unavailable: %s", self.name, e)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "capacity": self.capacity,
+            "per_second": self.per_second,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "tracked": len(self.local),
+        }
+
+
+class ConcurrencyLimiter:
+    # Caps requests inside an expensive section; the excess is shed, not queued.
+    # Checked and updated on the event loop thread, so no lock is needed.
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,59 @@
+import markdown
+import threading
+import time
+from sqlalchemy.orm.attributes import set_committed_value
+from myblog import metrics
+
+# Markdown extensions used for card content. Changing this list (or upgrading
+# the markdown package) changes RENDERER_VERSION, which marks every stored
+# rendering as stale until it is re-rendered.
+MARKDOWN_EXTENSIONS = []
+
+# Bump this when the rendering pipeline changes in a way not captured above
+RENDERER_REVISION = 1
+
+RENDERER_VERSION = f"{RENDERER_REVISION}:markdown-{markdown.__version__}:{','.join(MARKDOWN_EXTENSIONS)}"
+
+
+# Building a Markdown instance (and loading its extensions) costs more than
+# converting a short card, so each thread keeps one and resets it between uses
+_local = threading.local()
+
+
+def render_markdown(text):
+    md = getattr(_local, "md", None)
+    if md is None:
+        md = _local.md = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    if not metrics.METRICS_ENABLED:
+        return md.reset().convert(text or "")
+    started = time.perf_counter()
+    html = md.reset().convert(text or "")
+    metrics.markdown_render_duration.observe(time.perf_counter() - started)
+    return html
+
+
+def render_many(texts):
+    # Batch entry point for worker processes
+    return [render_markdown(text) for text in texts]
+
+
+def is_stale(card):
+    return card.content_html is None or card.render_version != RENDERER_VERSION
+
+
+def render_card(card):
+    # Store the rendered HTML together with the version that produced it
+    card.content_html = render_markdown(card.content)
+    card.render_version = RENDERER_VERSION
+    return card
+
+
+def ensure_rendered(card):
+    # Read paths: stale rows are rendered for this response only. The values are
+    # set as if loaded, so the session never writes them back and updated_at
+    # (part of the page validators) does not move on a GET. Stored HTML is
+    # refreshed by the render job and `python -m myblog.cli backfill-html`.
+    if is_stale(card):
+        set_committed_value(card, "content_html", render_markdown(card.content))
+        set_committed_value(card, "render_version", RENDERER_VERSION)
+    return card
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+# Files are sent in chunks of this size when the server has no sendfile support
+FILE_CHUNK_SIZE = 256 * 1024
+
+# More ranges than this in one request is treated as abuse and answered in full
+MAX_RANGES = 16
+
+
+def parse_range_header(value, size):
+    # Returns a sorted, merged list of (start, end) inclusive byte ranges, [] when
+    # no range is satisfiable, or None when the header should be ignored.
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    ranges = []
+    for part in spec.split(","):
+        start, sep, end = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if start:
+                first = int(start)
+                last = int(end) if end else size - 1
+                if end and first > last:
+                    return None
+            else:
+                # Suffix range: the last N bytes
+                length = int(end)
+                if length == 0:
+                    continue
+                first, last = max(size - length, 0), size - 1
+        except ValueError:
+            return None
+        if first < size:
+            ranges.append((first, min(last, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def make_etag(*parts):
+    # Strong validator for generated content from the inputs that determine it
+    digest = hashlib.blake2b("\x1f".join(str(part) for part in parts).encode(), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+def request_matches_etag(request, etag):
+    if_none_match = request.headers.get("if-none-match")
+    return if_none_match is not None and etag_matches(if_none_match, etag)
+
+
+def not_modified_response(etag, headers=None):
+    return Response(status_code=304, headers={"ETag": etag, **(headers or {})})
+
+
+def etag_matches(header_value, etag):
+    if header_value.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    candidates = [tag.strip() for tag in header_value.split(",")]
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def not_modified(request_headers, etag, mtime):
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def range_applies(request_headers, etag, last_modified):
+    # If-Range: only honour Range when the client's copy is still current
+    if_range = request_headers.get("if-range")
+    if if_range is None:
+        return True
+    return if_range.strip() in (etag, last_modified)
+
+
+class RangeFileResponse(Response):
+    # Serves a file with strong validators, conditional GET and byte ranges
+    # (single and multipart/byteranges). Uses the ASGI zero-copy send extension
+    # when the server offers it, otherwise reads in chunks off the event loop.
+
+    def __init__(self, path, request, media_type, etag, headers=None, stat_result=None):
+        self.path = path
+        self.status_code = 200
+        self.media_type = media_type
+        self.background = None
+        self.body = b""
+        self.ranges = None
+        self.boundary = None
+        self.parts = []
+
+        stat_result = stat_result or os.stat(path)
+        self.file_size = stat_result.st_size
+        last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        request_headers = Headers(scope=request.scope)
+
+        self.init_headers(headers)
+        self.headers.setdefault("accept-ranges", "bytes")
+        self.headers.setdefault("etag", etag)
+        self.headers.setdefault("last-modified", last_modified)
+
+        if request.method in ("GET", "HEAD") and not_modified(request_headers, etag, stat_result.st_mtime):
+            self.status_code = 304
+            del self.headers["content-length"]
+            return
+
+        range_header = request_headers.get("range")
+        if range_header and range_applies(request_headers, etag, last_modified):
+            self.ranges = parse_range_header(range_header, self.file_size)
+
+        if self.ranges is None:
+            self.parts = [(0, self.file_size - 1, b"")] if self.file_size else []
+            self.headers["content-type"] = media_type
+            self.headers["content-length"] = str(self.file_size)
+        elif not self.ranges:
+            self.status_code = 416
+            self.headers["content-range"] = f"bytes */{self.file_size}"
+            self.headers["content-length"] = "0"
+        elif len(self.ranges) == 1:
+            first, last = self.ranges[0]
+            self.status_code = 206
+            self.parts = [(first, last, b"")]
+            self.headers["content-type"] = media_type
+            self.headers["content-range"] = f"bytes {first}-{last}/{self.file_size}"
+            self.headers["content-length"] = str(last - first + 1)
+        else:
+            self.status_code = 206
+            self.boundary = secrets.token_hex(16)
+            length = 0
+            for first, last in self.ranges:
+                preamble = (
+                    f"--{self.boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {first}-{last}/{self.file_size}\r\n\r\n"
+                ).encode("latin-1")
+                if self.parts:
+                    preamble = b"\r\n" + preamble
+                self.parts.append((first, last, preamble))
+                length += len(preamble) + last - first + 1
+            self.epilogue = f"\r\n--{self.boundary}--\r\n".encode("latin-1")
+            length += len(self.epilogue)
+            self.headers["content-type"] = f"multipart/byteranges; boundary={self.boundary}"
+            self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD" or self.status_code in (304, 416) or not self.parts:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        zero_copy = "http.response.zerocopysend" in scope.get("extensions", {})
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            for first, last, preamble in self.parts:
+                if preamble:
+                    await send({"type": "http.response.body", "body": preamble, "more_body": True})
+                if zero_copy:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": file.wrapped.fileno(),
+                        "offset": first,
+                        "count": last - first + 1,
+                        "more_body": True,
+                    })
+                    continue
+                await file.seek(first)
+                remaining = last - first + 1
+                while remaining > 0:
+                    chunk = await file.read(min(FILE_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        epilogue = self.epilogue if self.boundary else b""
+        await send({"type": "http.response.body", "body": epilogue, "more_body": False})
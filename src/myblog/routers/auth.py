@@ -1,23 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from fastapi.templating import Jinja2Templates
 from pathlib import Path
 from fastapi.responses import RedirectResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, event
+from sqlalchemy.orm import object_session
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from typing import Optional
+from myblog import metrics
+from myblog.api import wants_json
+from myblog.cache import SharedCache, SHARED_CACHE_PATH, invalidate_on_commit
 from myblog.database import get_db
+from myblog.ratelimit import TokenBucketLimiter, ConcurrencyLimiter, too_many_requests
+from myblog.templating import templates
 from myblog.models import User, Role
+import asyncio
 import os
+import threading
 
 router = APIRouter()
 
-# Setup templates
-templates = Jinja2Templates(directory=str(Path(__file__).resolve().parent.parent / "templates"))
-
 # Security configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
@@ -26,6 +32,33 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
 
+# Authenticated user cache: token subject -> UserSnapshot, shared by all workers.
+# Changes made through the ORM are published to every worker; the TTL bounds
+# how long a change made any other way can go unnoticed.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    id: int
+    username: str
+    role: Role
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(id=user.id, username=user.username, role=user.role)
+
+user_cache = SharedCache("user", maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+def invalidate_user(session, username):
+    invalidate_on_commit(session, user_cache, username)
+
+# Drop cached snapshots once a change or deletion of a user row via the ORM commits
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user_on_write(mapper, connection, target):
+    invalidate_user(object_session(target), target.username)
+
 # Password and token utilities
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -33,6 +66,99 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# bcrypt releases the GIL, so a dedicated thread pool keeps hashing off the
+# event loop. Its size caps how many hashes run at once; the rest queue up.
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(min(4, os.cpu_count() or 1))))
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix="password-hash")
+_hash_stats_lock = threading.Lock()
+_hash_stats = {"queued": 0, "in_flight": 0, "completed": 0, "max_queued": 0}
+
+def password_hash_stats():
+    with _hash_stats_lock:
+        return {"concurrency": PASSWORD_HASH_CONCURRENCY, **_hash_stats}
+
+def _run_hash_job(func, *args):
+    with _hash_stats_lock:
+        _hash_stats["queued"] -= 1
+        _hash_stats["in_flight"] += 1
+    try:
+        return func(*args)
+    finally:
+        with _hash_stats_lock:
+            _hash_stats["in_flight"] -= 1
+            _hash_stats["completed"] += 1
+
+async def _submit_hash_job(func, *args):
+    with _hash_stats_lock:
+        _hash_stats["queued"] += 1
+        _hash_stats["max_queued"] = max(_hash_stats["max_queued"], _hash_stats["queued"])
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hash_executor, _run_hash_job, func, *args)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _submit_hash_job(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _submit_hash_job(get_password_hash, password)
+
+# Admission control for the endpoints that hash a password. Every attempt takes
+# a token from the client IP's bucket and the username's bucket; past that, at
+# most AUTH_MAX_IN_FLIGHT requests per worker may wait on the hash pool, and
+# the rest are shed with 429 before any hashing starts.
+AUTH_RATE_LIMIT_ENABLED = os.getenv("AUTH_RATE_LIMIT_ENABLED", "true").lower() == "true"
+AUTH_IP_BURST = int(os.getenv("AUTH_IP_BURST", "20"))
+AUTH_IP_PER_MINUTE = float(os.getenv("AUTH_IP_PER_MINUTE", "10"))
+AUTH_USERNAME_BURST = int(os.getenv("AUTH_USERNAME_BURST", "5"))
+AUTH_USERNAME_PER_MINUTE = float(os.getenv("AUTH_USERNAME_PER_MINUTE", "2"))
+AUTH_MAX_IN_FLIGHT = int(os.getenv("AUTH_MAX_IN_FLIGHT", str(4 * PASSWORD_HASH_CONCURRENCY)))
+AUTH_OVERLOAD_RETRY_SECONDS = int(os.getenv("AUTH_OVERLOAD_RETRY_SECONDS", "1"))
+# Share buckets across the workers on this host through the shared cache file
+AUTH_RATE_LIMIT_SHARED = os.getenv("AUTH_RATE_LIMIT_SHARED", "false").lower() == "true"
+# Behind a reverse proxy, the client address is the last X-Forwarded-For hop
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+_limiter_path = SHARED_CACHE_PATH if AUTH_RATE_LIMIT_SHARED else None
+ip_limiter = TokenBucketLimiter("auth-ip", AUTH_IP_BURST, AUTH_IP_PER_MINUTE / 60, path=_limiter_path)
+username_limiter = TokenBucketLimiter("auth-user", AUTH_USERNAME_BURST, AUTH_USERNAME_PER_MINUTE / 60, path=_limiter_path)
+auth_in_flight = ConcurrencyLimiter("auth", AUTH_MAX_IN_FLIGHT)
+
+def client_ip(request):
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.rsplit(",", 1)[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+def auth_admission_stats():
+    return {
+        "ip": ip_limiter.stats(),
+        "username": username_limiter.stats(),
+        "in_flight": auth_in_flight.stats(),
+    }
+
+def _reject(outcome, retry_after):
+    metrics.auth_admissions.inc(outcome)
+    return too_many_requests("Too many authentication attempts, try again later", retry_after)
+
+async def admit_auth_request(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    # FastAPI caches dependencies per request, so the endpoint gets the same form
+    if not AUTH_RATE_LIMIT_ENABLED:
+        yield
+        return
+    retry_after = await ip_limiter.atake(client_ip(request))
+    if retry_after:
+        raise _reject("rate_limited_ip", retry_after)
+    retry_after = await username_limiter.atake(form_data.username.strip().lower()[:256])
+    if retry_after:
+        raise _reject("rate_limited_username", retry_after)
+    if not auth_in_flight.try_acquire():
+        raise _reject("overloaded", AUTH_OVERLOAD_RETRY_SECONDS)
+    metrics.auth_admissions.inc("admitted")
+    try:
+        yield
+    finally:
+        auth_in_flight.release()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -57,6 +183,9 @@ async def get_current_user(request: Request = None, token: str = Depends(oauth2_
             token = cookie_authorization.replace("Bearer ", "")
     
     if not token:
+        # API clients get a 401 rather than a redirect to the login page
+        if request is not None and wants_json(request):
+            raise credentials_exception
         raise HTTPException(
             status_code=status.HTTP_303_SEE_OTHER,
             headers={"Location": "/auth/login"}
@@ -70,13 +199,21 @@ async def get_current_user(request: Request = None, token: str = Depends(oauth2_
     except JWTError:
         raise credentials_exception
     
+    # The token is validated above on every request; only the user lookup is cached
+    snapshot = await user_cache.aget(username)
+    if snapshot is not None:
+        return snapshot
+    
+    version = await user_cache.aversion(username)
     query = select(User).where(User.username == username)
     result = await db.execute(query)
     user = result.scalar_one_or_none()
     
     if user is None:
         raise credentials_exception
-    return user
+    snapshot = UserSnapshot.from_user(user)
+    await user_cache.aset(username, snapshot, version=version)
+    return snapshot
 
 
 # User authentication endpoints
@@ -87,14 +224,14 @@ async def login_page(request: Request):
         {"request": request, "title": "Login"}
     )
 
-@router.post("/login")
+@router.post("/login", dependencies=[Depends(admit_auth_request)])
 async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     # Find the user
     result = await db.execute(select(User).where(User.username == form_data.username))
     user = result.scalar_one_or_none()
     
     # Verify user and password
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -133,7 +270,7 @@ async def signup_page(request: Request):
         {"request": request, "title": "Sign Up"}
     )
 
-@router.post("/signup", response_model=dict)
+@router.post("/signup", response_model=dict, dependencies=[Depends(admit_auth_request)])
 async def signup(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     # Check if user already exists
     query = select(User).where(User.username == form_data.username)
@@ -146,7 +283,7 @@ async def signup(request: Request, form_data: OAuth2PasswordRequestForm = Depend
         return response
     
     # Create new user
-    hashed_password = get_password_hash(form_data.password)
+    hashed_password = await get_password_hash_async(form_data.password)
     new_user = User(
         username=form_data.username,
         email=form_data.username,  # Using username as email for simplicity
@@ -192,14 +329,14 @@ async def logout(request: Request, current_user: User = Depends(get_current_user
     response.delete_cookie(key="access_token")
     return response
 
-@router.post("/token")
+@router.post("/token", dependencies=[Depends(admit_auth_request)])
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     # Authenticate user
     query = select(User).where(User.username == form_data.username)
     result = await db.execute(query)
     user = result.scalar_one_or_none()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
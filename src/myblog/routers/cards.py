@@ -1,29 +1,65 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
-from typing import List
+from sqlalchemy import select, update, and_, or_, true, event
+from sqlalchemy.orm import selectinload, object_session
+from typing import List, Optional
 from myblog.database import get_db
-from myblog.models import Card, User, Role
+from myblog.templating import templates, StreamingTemplateResponse
+from myblog.models import Card, User, Role, MediaFile
+from myblog.models.models import card_media
 from .auth import get_current_user
-from fastapi.templating import Jinja2Templates
-from pathlib import Path
-import markdown
-from fastapi.responses import RedirectResponse
+from myblog.rendering import RENDERER_VERSION, render_markdown, ensure_rendered
+from myblog.jobs import job_handler, enqueue
+from myblog.responses import make_etag, request_matches_etag, not_modified_response
+from myblog.assets import manifest as asset_manifest
+from myblog.api import wants_json, dumps, json_response, parse_names, read_model
+from myblog.cache import SharedCache, invalidate_on_commit
+from myblog.pagination import paginate_union, split_page
+from myblog.search import build_search_query, encode_rank_cursor, highlight
+from myblog.bulk import export_cards, import_cards, iter_lines
+from fastapi.responses import RedirectResponse, HTMLResponse, StreamingResponse
+import os
 
 router = APIRouter()
+# The JSON API (mounted at /api/cards): only the routes that answer in JSON,
+# without the HTML forms and search page
+api_router = APIRouter()
 
-# Setup templates
-BASE_DIR = Path(__file__).resolve().parent.parent
-templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+# Pagination settings
+CARDS_PAGE_SIZE = int(os.getenv("CARDS_PAGE_SIZE", "20"))
+CARDS_MAX_PAGE_SIZE = int(os.getenv("CARDS_MAX_PAGE_SIZE", "100"))
+# List pages with at least this many cards are streamed while they render
+CARDS_STREAM_THRESHOLD = int(os.getenv("CARDS_STREAM_THRESHOLD", "50"))
 
 # Card schemas
 from pydantic import BaseModel
+from dataclasses import dataclass
 from datetime import datetime
 
 class CardCreate(BaseModel):
     title: str
     content: str
+    to_all: bool = False
+
+class CardUpdate(BaseModel):
+    title: Optional[str] = None
+    content: Optional[str] = None
+    to_all: Optional[bool] = None
+
+# Form posts send strings; the checkbox is "true" when ticked. The editor
+# script always sends to_all, so unticking it makes a card private again.
+CARD_FORM_FIELDS = {"title": str, "content": str, "to_all": lambda value: value == "true"}
+CARD_UPDATE_FORM_FIELDS = CARD_FORM_FIELDS
+
+class AuthorSummary(BaseModel):
+    id: int
+    username: str
+
+class MediaSummary(BaseModel):
+    id: int
+    filename: str
+    file_type: str
+    url: str
 
 class CardResponse(BaseModel):
     id: int
@@ -32,32 +68,244 @@ class CardResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     author_id: int
+    # Only present when asked for with ?embed=author,media
+    author: Optional[AuthorSummary] = None
+    media: Optional[List[MediaSummary]] = None
 
     class Config:
         from_attributes = True
 
+class CardPage(BaseModel):
+    items: List[CardResponse]
+    next_cursor: Optional[str]
+    limit: int
+
+# JSON mode: ?fields= picks columns (id is always included), ?embed= adds related data
+CARD_FIELDS = ("id", "title", "content", "created_at", "updated_at", "author_id")
+CARD_EMBEDS = ("author", "media")
+
+# Rendered page cache shared by all workers, keyed by the page validator (ETag).
+# The validator covers everything the HTML depends on, so entries never need
+# explicit invalidation; the TTL only bounds how long unused pages hold memory.
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "512"))
+PAGE_CACHE_TTL_SECONDS = float(os.getenv("PAGE_CACHE_TTL_SECONDS", "60"))
+# Pages and JSON share URLs, so caches must key on Accept too
+PAGE_CACHE_HEADERS = {"Cache-Control": "private, no-cache", "Vary": "Accept"}
+# Bump when card templates change, so clients do not revalidate old HTML
+PAGE_REVISION = 1
+page_cache = SharedCache("page", maxsize=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL_SECONDS)
+
+# What a card page needs before its HTML: visibility and the validator inputs.
+# With this cached, a repeat view of a card issues no queries at all.
+CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", "4096"))
+CARD_CACHE_TTL_SECONDS = float(os.getenv("CARD_CACHE_TTL_SECONDS", "300"))
+
+@dataclass(frozen=True)
+class CardHeader:
+    id: int
+    author_id: int
+    to_all: bool
+    updated_at: datetime
+
+card_cache = SharedCache("card", maxsize=CARD_CACHE_SIZE, ttl=CARD_CACHE_TTL_SECONDS)
+
+def invalidate_card(session, card_id):
+    invalidate_on_commit(session, card_cache, card_id)
+
+# Publish card edits and deletions made through the ORM to every worker once they commit
+@event.listens_for(Card, "after_update")
+@event.listens_for(Card, "after_delete")
+def _invalidate_card_on_write(mapper, connection, target):
+    invalidate_card(object_session(target), target.id)
+
+async def cache_page(response, etag):
+    await page_cache.aset(etag, response.body)
+    response.headers["ETag"] = etag
+    response.headers.update(PAGE_CACHE_HEADERS)
+    return response
+
+def card_json_options(fields, embed):
+    names = parse_names(fields, CARD_FIELDS, "fields") or list(CARD_FIELDS)
+    if "id" not in names:
+        names.insert(0, "id")
+    return names, parse_names(embed, CARD_EMBEDS, "embed") or []
+
+def card_payload(card):
+    return {name: getattr(card, name) for name in CARD_FIELDS}
+
+async def card_payloads(db, ids, fields, embeds):
+    # Reads only the requested columns as plain rows: no ORM objects, no
+    # rendering, and one extra query per embed rather than per card
+    columns = [getattr(Card, name) for name in fields if name not in ("id", "author_id")]
+    result = await db.execute(select(Card.id, Card.author_id, *columns).where(Card.id.in_(ids)))
+    rows = {row.id: row._mapping for row in result}
+    authors, media = {}, {}
+    if "author" in embeds and rows:
+        author_ids = {row["author_id"] for row in rows.values()}
+        result = await db.execute(select(User.id, User.username).where(User.id.in_(author_ids)))
+        authors = {row.id: {"id": row.id, "username": row.username} for row in result}
+    if "media" in embeds and rows:
+        result = await db.execute(
+            select(card_media.c.card_id, MediaFile.id, MediaFile.filename, MediaFile.file_type, MediaFile.file_path)
+            .join(MediaFile, MediaFile.id == card_media.c.media_id)
+            .where(card_media.c.card_id.in_(list(rows)))
+            .order_by(card_media.c.card_id, card_media.c.position, card_media.c.media_id)
+        )
+        for row in result:
+            media.setdefault(row.card_id, []).append(
+                {"id": row.id, "filename": row.filename, "file_type": row.file_type, "url": row.file_path}
+            )
+    payloads = []
+    for card_id in ids:
+        row = rows.get(card_id)
+        if row is None:
+            continue
+        payload = {name: row[name] for name in fields}
+        if "author" in embeds:
+            payload["author"] = authors.get(row["author_id"])
+        if "media" in embeds:
+            payload["media"] = media.get(card_id, [])
+        payloads.append(payload)
+    return payloads
+
+async def cached_json_response(request, etag, produce):
+    # Same validator and page cache handling as the HTML pages
+    if request_matches_etag(request, etag):
+        return not_modified_response(etag, PAGE_CACHE_HEADERS)
+    body = await page_cache.aget(etag)
+    if body is None:
+        body = dumps(await produce())
+        await page_cache.aset(etag, body)
+    return json_response(body, headers={"ETag": etag, **PAGE_CACHE_HEADERS})
+
+# Visibility rule: shared cards, the user's own cards, or everything for admins
+def visible_to(user):
+    if user.role == Role.ADMIN:
+        return true()
+    return or_(Card.to_all.is_(True), Card.author_id == user.id)
+
+# The same rule as disjoint arms, each served by its own index in page order
+def visibility_arms(user):
+    if user.role == Role.ADMIN:
+        return [true()]
+    return [Card.to_all.is_(True), and_(Card.author_id == user.id, Card.to_all.is_not(True))]
+
 # Card endpoints
-@router.get("/", response_model=List[CardResponse])
-async def list_cards(request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
-    query = select(Card).order_by(Card.created_at.desc()).options(selectinload(Card.author))
+@router.get("/", response_model=CardPage)
+@api_router.get("/", response_model=CardPage)
+async def list_cards(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(CARDS_PAGE_SIZE, ge=1, le=CARDS_MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    embed: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    # Resolve the page to (id, timestamps) first; that is all the validator needs
+    query = paginate_union(
+        select(Card.id, Card.created_at, Card.updated_at), visibility_arms(current_user),
+        Card.created_at, Card.id, cursor=cursor, limit=limit
+    )
+    result = await db.execute(query)
+    rows, next_cursor = split_page(result.all(), limit, key=lambda row: (row.created_at, row.id))
+    
+    newest = max((row.updated_at for row in rows if row.updated_at), default=None)
+    if wants_json(request):
+        # JSON has no edit buttons, so only the visible ids make it vary per user
+        names, embeds = card_json_options(fields, embed)
+        ids = [row.id for row in rows]
+        etag = make_etag(
+            "list.json", PAGE_REVISION, cursor, limit, newest, ",".join(map(str, ids)), ",".join(names), ",".join(embeds)
+        )
+
+        async def produce():
+            return {"items": await card_payloads(db, ids, names, embeds), "next_cursor": next_cursor, "limit": limit}
+        return await cached_json_response(request, etag, produce)
+
+    # The list varies per user: visibility and edit buttons depend on who is viewing
+    etag = make_etag(
+        "list", PAGE_REVISION, RENDERER_VERSION, asset_manifest.version, current_user.id, current_user.role.value,
+        cursor, limit, newest, ",".join(str(row.id) for row in rows)
+    )
+    if request_matches_etag(request, etag):
+        return not_modified_response(etag, PAGE_CACHE_HEADERS)
+    cached = await page_cache.aget(etag)
+    if cached is not None:
+        return HTMLResponse(cached, headers={"ETag": etag, **PAGE_CACHE_HEADERS})
+    
+    ids = [row.id for row in rows]
+    query = select(Card).where(Card.id.in_(ids)).options(
+        selectinload(Card.author), selectinload(Card.media_files).joinedload(MediaFile.variants)
+    )
     result = await db.execute(query)
-    cards = result.scalars().all()
+    cards_by_id = {card.id: card for card in result.scalars()}
+    cards = [cards_by_id[card_id] for card_id in ids if card_id in cards_by_id]
     
-    # Filter cards based on visibility
-    visible_cards = [
-        card for card in cards
-        if card.to_all or card.author_id == current_user.id or current_user.role == Role.ADMIN
-    ]
+    # Serve the HTML stored at write time
+    for card in cards:
+        ensure_rendered(card)
     
-    # Convert Markdown content to HTML
-    for card in visible_cards:
-        card.content = markdown.markdown(card.content)
+    context = {"request": request, "cards": cards, "next_cursor": next_cursor, "limit": limit, "current_user": current_user}
+    if len(cards) >= CARDS_STREAM_THRESHOLD:
+        return StreamingTemplateResponse(
+            "cards/list.html",
+            context,
+            headers={"ETag": etag, **PAGE_CACHE_HEADERS},
+            on_complete=lambda body: page_cache.set(etag, body)
+        )
+    response = templates.TemplateResponse("cards/list.html", context)
+    return await cache_page(response, etag)
+
+@router.get("/search", response_model=None)
+async def search_cards(
+    request: Request,
+    q: str = "",
+    cursor: Optional[str] = None,
+    limit: int = Query(CARDS_PAGE_SIZE, ge=1, le=CARDS_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    results, next_cursor = [], None
+    if q.strip():
+        query = build_search_query(db.bind.dialect.name, q, visible_to(current_user), cursor=cursor, limit=limit)
+        result = await db.execute(query.options(selectinload(Card.author)))
+        rows = result.all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_rank_cursor(rows[-1].rank, rows[-1].Card.id)
+        for row in rows:
+            ensure_rendered(row.Card)
+            results.append({"card": row.Card, "snippet": highlight(row.snippet)})
     
     return templates.TemplateResponse(
-        "cards/list.html",
-        {"request": request, "cards": visible_cards, "current_user": current_user}
+        "cards/search.html",
+        {"request": request, "title": "Search", "q": q, "results": results, "next_cursor": next_cursor,
+         "limit": limit, "current_user": current_user}
     )
 
+@router.get("/export", response_model=None)
+@api_router.get("/export", response_model=None)
+async def export_cards_ndjson(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role != Role.ADMIN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to export cards")
+    
+    return StreamingResponse(
+        export_cards(db),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="cards.ndjson"'}
+    )
+
+@router.post("/import", response_model=None)
+@api_router.post("/import", response_model=None)
+async def import_cards_ndjson(request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role != Role.ADMIN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to import cards")
+    
+    # Rows without an author are attributed to the importing admin
+    report = await import_cards(db, iter_lines(request.stream()), default_author_id=current_user.id)
+    return report.as_dict()
+
 @router.get("/new", response_model=None)
 async def new_card_form(request: Request, current_user: User = Depends(get_current_user)):
     return templates.TemplateResponse(
@@ -66,27 +314,67 @@ async def new_card_form(request: Request, current_user: User = Depends(get_curre
     )
 
 @router.get("/{card_id}", response_model=CardResponse)
-async def get_card(card_id: int, request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
-    query = select(Card).where(Card.id == card_id).options(selectinload(Card.author))
-    result = await db.execute(query)
-    card = result.scalar_one_or_none()
-    
-    if not card:
-        raise HTTPException(status_code=404, detail="Card not found")
+@api_router.get("/{card_id}", response_model=CardResponse)
+async def get_card(
+    card_id: int,
+    request: Request,
+    fields: Optional[str] = None,
+    embed: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    header = await card_cache.aget(card_id)
+    if header is None:
+        version = await card_cache.aversion(card_id)
+        query = select(Card.id, Card.author_id, Card.to_all, Card.updated_at).where(Card.id == card_id)
+        result = await db.execute(query)
+        row = result.one_or_none()
+        if not row:
+            raise HTTPException(status_code=404, detail="Card not found")
+        header = CardHeader(id=row.id, author_id=row.author_id, to_all=bool(row.to_all), updated_at=row.updated_at)
+        await card_cache.aset(card_id, header, version=version)
     
     # Check if the user is allowed to view the card
-    if not (card.to_all or card.author_id == current_user.id or current_user.role == Role.ADMIN):
+    if not (header.to_all or header.author_id == current_user.id or current_user.role == Role.ADMIN):
         raise HTTPException(status_code=403, detail="Not authorized to view this card")
     
-    # Convert Markdown content to HTML
-    card.content = markdown.markdown(card.content)
+    if wants_json(request):
+        names, embeds = card_json_options(fields, embed)
+        etag = make_etag("detail.json", PAGE_REVISION, header.id, header.updated_at, ",".join(names), ",".join(embeds))
+
+        async def produce():
+            payloads = await card_payloads(db, [card_id], names, embeds)
+            if not payloads:
+                raise HTTPException(status_code=404, detail="Card not found")
+            return payloads[0]
+        return await cached_json_response(request, etag, produce)
     
-    return templates.TemplateResponse(
+    # Every viewer who is not the author gets the same page (no edit buttons)
+    viewer_class = "author" if header.author_id == current_user.id else "reader"
+    etag = make_etag("detail", PAGE_REVISION, RENDERER_VERSION, asset_manifest.version, header.id, header.updated_at, viewer_class)
+    if request_matches_etag(request, etag):
+        return not_modified_response(etag, PAGE_CACHE_HEADERS)
+    cached = await page_cache.aget(etag)
+    if cached is not None:
+        return HTMLResponse(cached, headers={"ETag": etag, **PAGE_CACHE_HEADERS})
+    
+    query = select(Card).where(Card.id == card_id).options(
+        selectinload(Card.author), selectinload(Card.media_files).joinedload(MediaFile.variants)
+    )
+    result = await db.execute(query)
+    card = result.scalar_one()
+    
+    # Serve the HTML stored at write time
+    ensure_rendered(card)
+    
+    response = templates.TemplateResponse(
         "cards/detail.html",
         {"request": request, "card": card, "current_user": current_user}
     )
+    return await cache_page(response, etag)
 
 @router.post("/", response_model=CardResponse)
+@api_router.post("/", response_model=CardResponse, status_code=status.HTTP_201_CREATED)
 async def create_card(
     request: Request,
     db: AsyncSession = Depends(get_db),
@@ -96,16 +384,23 @@ async def create_card(
     if current_user.role not in [Role.ADMIN, Role.DEVELOPER]:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to create cards")
     
-    form_data = await request.form()
+    # JSON bodies and form posts are both accepted
+    data = await read_model(request, CardCreate, CARD_FORM_FIELDS)
     new_card = Card(
-        title=form_data.get('title'),
-        content=form_data.get('content'),
+        title=data.title,
+        content=data.content,
         author_id=current_user.id,
-        to_all=form_data.get('to_all') == 'true'
+        to_all=data.to_all
     )
     db.add(new_card)
+    await db.flush()
+    # Rendered by a background job; a read that gets there first renders inline
+    enqueue(db, "render_card", card_id=new_card.id)
     await db.commit()
     await db.refresh(new_card)
+    if wants_json(request):
+        location = f"{request.url.path.rstrip('/')}/{new_card.id}"
+        return json_response(card_payload(new_card), status_code=status.HTTP_201_CREATED, headers={"Location": location})
     return RedirectResponse(url="/cards", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.get("/{card_id}/edit", response_model=None)
@@ -132,13 +427,15 @@ async def edit_card_form(
 
 @router.put("/{card_id}", response_model=CardResponse)
 @router.post("/{card_id}", response_model=CardResponse)
+@api_router.put("/{card_id}", response_model=CardResponse)
+@api_router.post("/{card_id}", response_model=CardResponse)
 async def update_card(
     card_id: int,
     request: Request,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    form_data = await request.form()
+    data = await read_model(request, CardUpdate, CARD_UPDATE_FORM_FIELDS)
     query = select(Card).where(Card.id == card_id)
     result = await db.execute(query)
     card = result.scalar_one_or_none()
@@ -149,19 +446,29 @@ async def update_card(
     if card.author_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to edit this card")
     
-    card.title = form_data.get('title')
-    card.content = form_data.get('content')
+    # Only the fields sent are changed
+    changes = data.model_dump(exclude_unset=True, exclude_none=True)
+    for name, value in changes.items():
+        setattr(card, name, value)
+    if "content" in changes:
+        # Mark the stored HTML stale; the job re-renders it off the request path
+        card.content_html = None
+        card.render_version = None
+        enqueue(db, "render_card", card_id=card.id)
     await db.commit()
     await db.refresh(card)
+    if wants_json(request):
+        return json_response(card_payload(card))
     return RedirectResponse(url="/cards", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.delete("/{card_id}", status_code=status.HTTP_204_NO_CONTENT)
+@api_router.delete("/{card_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_card(
     card_id: int,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    query = select(Card).where(Card.id == card_id)
+    query = select(Card).where(Card.id == card_id).options(selectinload(Card.media_files))
     result = await db.execute(query)
     card = result.scalar_one_or_none()
     
@@ -171,6 +478,42 @@ async def delete_card(
     if card.author_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this card")
     
+    media_ids = [media_file.id for media_file in card.media_files]
     await db.delete(card)
+    if media_ids:
+        enqueue(db, "cleanup_deleted_card", card_id=card_id, media_ids=media_ids)
     await db.commit()
-    return None
\ No newline at end of file
+    return None
+
+# Background jobs
+class RenderCardJob(BaseModel):
+    card_id: int
+
+@job_handler("render_card", RenderCardJob, lane="cpu")
+async def render_card_job(job: RenderCardJob, ctx):
+    async with ctx.session_factory() as db:
+        result = await db.execute(
+            select(Card.content, Card.content_html, Card.render_version).where(Card.id == job.card_id)
+        )
+        row = result.one_or_none()
+        if row is None or (row.content_html is not None and row.render_version == RENDERER_VERSION):
+            return
+        html = await ctx.run_cpu(render_markdown, row.content)
+        # Only store it if the content is unchanged (a later edit queued its own job),
+        # and keep updated_at: the page itself did not change
+        await db.execute(
+            update(Card)
+            .where(Card.id == job.card_id, Card.content == row.content)
+            .values(content_html=html, render_version=RENDERER_VERSION, updated_at=Card.updated_at)
+        )
+        await db.commit()
+
+class CleanupDeletedCardJob(BaseModel):
+    card_id: int
+    media_ids: List[int]
+
+@job_handler("cleanup_deleted_card", CleanupDeletedCardJob)
+async def cleanup_deleted_card_job(job: CleanupDeletedCardJob, ctx):
+    # Imported here because the media router imports this module
+    from myblog.routers.media import purge_unattached_variants
+    await purge_unattached_variants(ctx.session_factory, job.media_ids)
\ No newline at end of file
@@ -1,22 +1,44 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
+from multipart.multipart import parse_options_header
+from fastapi.responses import RedirectResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 from pathlib import Path
-from typing import List
+from datetime import datetime
+from typing import List, Optional
+import hashlib
+import logging
 import shutil
 import os
-import time
-from myblog.database import get_db
+import tempfile
+from myblog import derivatives
+from myblog.database import get_db, insert_ignore
+from myblog.jobs import job_handler, enqueue, runner
 from myblog.routers.auth import get_current_user
-from myblog.models import User, MediaFile, Card
+from myblog.routers.cards import invalidate_card
+from myblog.models import User, MediaFile, MediaVariant, Card
+from myblog.models.models import card_media
+from myblog.responses import RangeFileResponse
+from myblog.pagination import paginate, split_page
+import mimetypes
+import multipart
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # Configure media settings
 BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_DIR = BASE_DIR / "static" / "media"
 MEDIA_DIR.mkdir(parents=True, exist_ok=True)
 
+# In-progress uploads, on the same filesystem so the final rename is atomic
+MEDIA_TMP_DIR = MEDIA_DIR / ".tmp"
+MEDIA_TMP_DIR.mkdir(exist_ok=True)
+
 # Allowed file types
 ALLOWED_IMAGE_TYPES = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
 ALLOWED_AUDIO_TYPES = {".mp3", ".wav", ".ogg", ".m4a"}
@@ -26,78 +48,343 @@ ALLOWED_EXTENSIONS = ALLOWED_IMAGE_TYPES | ALLOWED_AUDIO_TYPES | ALLOWED_VIDEO_T
 # Maximum file size (10MB)
 MAX_FILE_SIZE = 10 * 1024 * 1024
 
-@router.post("/upload")
+# Media listing page size
+MEDIA_PAGE_SIZE = int(os.getenv("MEDIA_PAGE_SIZE", "50"))
+MEDIA_MAX_PAGE_SIZE = int(os.getenv("MEDIA_MAX_PAGE_SIZE", "200"))
+
+# Uploads are written to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Multipart framing (boundary lines, part headers) allowed on top of MAX_FILE_SIZE
+MAX_UPLOAD_OVERHEAD = 64 * 1024
+UPLOAD_FIELD = "file"
+
+# The body is parsed by the handler itself, so the schema is declared here
+UPLOAD_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {UPLOAD_FIELD: {"type": "string", "format": "binary"}},
+                "required": [UPLOAD_FIELD],
+            }
+        }
+    },
+}
+
+def size_limit_error():
+    return HTTPException(
+        status_code=400,
+        detail=f"File size exceeds maximum limit of {MAX_FILE_SIZE // (1024 * 1024)}MB"
+    )
+
+def extension_error():
+    return HTTPException(
+        status_code=400,
+        detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
+    )
+
+def decode_header(value):
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+def write_chunk(tmp, hasher, chunk):
+    hasher.update(chunk)
+    tmp.write(chunk)
+
+class UploadReceiver:
+    # Multipart parser callbacks for one upload. Only the file part is kept: its
+    # extension is checked from the part headers before any of its bytes, the
+    # size limit is checked as each chunk is parsed, and the bytes are buffered
+    # for write_pending(), which hashes them into a temp file off the event loop.
+    def __init__(self, boundary):
+        self.parser = multipart.MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        })
+        self.filename = None
+        self.file_ext = None
+        self.size = 0
+        self.complete = False
+        self.tmp = None
+        self.hasher = hashlib.sha256()
+        self.pending = bytearray()
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._in_file = False
+
+    def on_part_begin(self):
+        self._disposition = b""
+        self._in_file = False
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if decode_header(options.get(b"name", b"")) != UPLOAD_FIELD or not options.get(b"filename"):
+            return
+        if self.filename is not None:
+            raise HTTPException(status_code=400, detail="Only one file can be uploaded at a time")
+        self.filename = decode_header(options[b"filename"])
+        self.file_ext = Path(self.filename).suffix.lower()
+        if self.file_ext not in ALLOWED_EXTENSIONS:
+            raise extension_error()
+        self._in_file = True
+
+    def on_part_data(self, data, start, end):
+        if not self._in_file:
+            return
+        self.size += end - start
+        if self.size > MAX_FILE_SIZE:
+            raise size_limit_error()
+        self.pending += data[start:end]
+
+    def on_part_end(self):
+        if self._in_file:
+            self.complete = True
+        self._in_file = False
+
+    def write_pending(self, final=False):
+        # Runs in the threadpool
+        if self.filename is None or (len(self.pending) < UPLOAD_CHUNK_SIZE and not final):
+            return
+        if self.tmp is None:
+            self.tmp = tempfile.NamedTemporaryFile(dir=MEDIA_TMP_DIR, prefix="upload-", delete=False)
+        write_chunk(self.tmp, self.hasher, bytes(self.pending))
+        self.pending.clear()
+        if final:
+            self.tmp.close()
+
+    def discard(self):
+        if self.tmp is not None:
+            discard_temp_file(self.tmp)
+
+async def receive_upload(request: Request):
+    # Parse the multipart body as it arrives and stream the file part straight
+    # to a temp file next to its destination. A declared Content-Length over the
+    # limit is refused before any of the body is read; without one, the limit
+    # is enforced per chunk.
+    max_body_size = MAX_FILE_SIZE + MAX_UPLOAD_OVERHEAD
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_body_size:
+        raise size_limit_error()
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    upload = UploadReceiver(params[b"boundary"])
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_body_size:
+                raise size_limit_error()
+            upload.parser.write(chunk)
+            if len(upload.pending) >= UPLOAD_CHUNK_SIZE:
+                await run_in_threadpool(upload.write_pending)
+        upload.parser.finalize()
+        if not upload.complete:
+            raise HTTPException(status_code=400, detail=f"No file uploaded in the '{UPLOAD_FIELD}' field")
+        await run_in_threadpool(upload.write_pending, True)
+    except BaseException:
+        await run_in_threadpool(upload.discard)
+        raise
+    return upload.filename, upload.file_ext, Path(upload.tmp.name), upload.size, upload.hasher.hexdigest()
+
+def discard_temp_file(tmp):
+    tmp.close()
+    Path(tmp.name).unlink(missing_ok=True)
+
+# Content-addressed layout: media/<first two hex chars>/<sha256><ext>
+def content_path(content_hash, file_ext):
+    return Path(content_hash[:2]) / f"{content_hash}{file_ext}"
+
+def store_file(tmp_path, relative_path):
+    destination = MEDIA_DIR / relative_path
+    destination.parent.mkdir(exist_ok=True)
+    os.replace(tmp_path, destination)
+
+async def add_reference(db: AsyncSession, content_hash):
+    # Bump the reference count of an existing file; None if the bytes are new
+    result = await db.execute(select(MediaFile).where(MediaFile.content_hash == content_hash))
+    media_file = result.scalar_one_or_none()
+    if media_file is not None:
+        await db.execute(
+            update(MediaFile)
+            .where(MediaFile.id == media_file.id)
+            .values(ref_count=MediaFile.ref_count + 1)
+        )
+        await db.commit()
+        await db.refresh(media_file)
+    return media_file
+
+def variant_urls(media_file):
+    # Variant URLs are always valid: missing variants are generated on first request
+    if not media_file.is_image or not derivatives.available():
+        return {}
+    return {name: media_file.variant_url(name) for name in derivatives.VARIANT_WIDTHS}
+
+def media_info(media_file):
+    return {
+        "id": media_file.id,
+        "url": media_file.file_path,
+        "filename": media_file.filename,
+        "file_type": media_file.file_type,
+        "size": media_file.size,
+        "width": media_file.width,
+        "height": media_file.height,
+        "content_hash": media_file.content_hash,
+        "uploader_id": media_file.uploader_id,
+        "uploaded_at": media_file.uploaded_at,
+        "variants": variant_urls(media_file)
+    }
+
+@router.post("/upload", openapi_extra={"requestBody": UPLOAD_REQUEST_BODY})
 async def upload_media(
-    file: UploadFile = File(...),
+    request: Request,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    # Validate file size
-    file_size = 0
-    chunk_size = 1024
-    chunks = []
-    
-    while True:
-        chunk = await file.read(chunk_size)
-        if not chunk:
-            break
-        file_size += len(chunk)
-        if file_size > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File size exceeds maximum limit of {MAX_FILE_SIZE // (1024 * 1024)}MB"
-            )
-        chunks.append(chunk)
-    
-    # Reset file position
-    await file.seek(0)
-    
-    # Validate file type
-    file_ext = Path(file.filename).suffix.lower()
-    if file_ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
-        )
+    # The file type and size are checked while the body streams in
+    filename, file_ext, tmp_path, file_size, content_hash = await receive_upload(request)
     
-    # Generate unique filename
-    timestamp = int(time.time())
-    unique_filename = f"{timestamp}_{file.filename}"
-    file_path = MEDIA_DIR / unique_filename
+    # Identical bytes are stored once: return the existing record
+    existing = await add_reference(db, content_hash)
+    if existing is not None:
+        await run_in_threadpool(tmp_path.unlink, missing_ok=True)
+        return media_info(existing)
     
-    # Save file
+    # Move the finished file into place atomically
+    relative_path = content_path(content_hash, file_ext)
     try:
-        with file_path.open("wb") as f:
-            for chunk in chunks:
-                f.write(chunk)
-    except Exception as e:
+        await run_in_threadpool(store_file, tmp_path, relative_path)
+    except OSError as e:
+        await run_in_threadpool(tmp_path.unlink, missing_ok=True)
         raise HTTPException(status_code=500, detail=str(e))
     
     # Create MediaFile record
     media_file = MediaFile(
-        filename=file.filename,
-        file_path=f"/static/media/{unique_filename}",
+        filename=filename,
+        file_path=f"/static/media/{relative_path.as_posix()}",
         file_type=file_ext.lstrip('.'),
+        content_hash=content_hash,
+        ref_count=1,
+        size=file_size,
         uploader_id=current_user.id
     )
     db.add(media_file)
+    try:
+        await db.flush()
+    except IntegrityError:
+        # A concurrent upload of the same bytes won the insert
+        await db.rollback()
+        return media_info(await add_reference(db, content_hash))
+    
+    # Derivatives are produced by a background job, committed with the record
+    if media_file.is_image and derivatives.available():
+        enqueue(db, "generate_variants", media_id=media_file.id)
     await db.commit()
     await db.refresh(media_file)
     
     # Return file information
-    return {
-        "id": media_file.id,
-        "url": media_file.file_path,
-        "filename": media_file.filename,
-        "file_type": media_file.file_type
-    }
+    return media_info(media_file)
 
 @router.get("/files")
 async def list_media_files(
+    cursor: Optional[str] = None,
+    limit: int = Query(MEDIA_PAGE_SIZE, ge=1, le=MEDIA_MAX_PAGE_SIZE),
+    uploader_id: Optional[int] = None,
+    file_type: Optional[str] = None,
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
-) -> List[str]:
-    files = [f for f in MEDIA_DIR.iterdir() if f.is_file()]
-    return [f"/static/media/{f.name}" for f in files]
+):
+    query = select(MediaFile)
+    if uploader_id is not None:
+        query = query.where(MediaFile.uploader_id == uploader_id)
+    if file_type:
+        query = query.where(MediaFile.file_type == file_type.lower().lstrip("."))
+    if uploaded_after:
+        query = query.where(MediaFile.uploaded_at >= uploaded_after)
+    if uploaded_before:
+        query = query.where(MediaFile.uploaded_at < uploaded_before)
+    query = paginate(query, MediaFile.uploaded_at, MediaFile.id, cursor=cursor, limit=limit)
+    result = await db.execute(query)
+    media_files, next_cursor = split_page(
+        result.scalars().all(), limit, key=lambda media_file: (media_file.uploaded_at, media_file.id)
+    )
+    return {
+        "items": [media_info(media_file) for media_file in media_files],
+        "next_cursor": next_cursor
+    }
+
+class MediaAttachment(BaseModel):
+    media_ids: List[int]
+
+async def get_own_card(db: AsyncSession, card_id: int, current_user):
+    # Only the columns needed for the permission check; the media collection is not loaded
+    result = await db.execute(select(Card.id, Card.author_id).where(Card.id == card_id))
+    card = result.first()
+    if card is None:
+        raise HTTPException(status_code=404, detail="Card not found")
+    if card.author_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to modify this card")
+    return card
+
+async def link_media(db: AsyncSession, card_id: int, media_ids):
+    # Attach in the given order after any existing attachments, with one
+    # set-based insert; links that already exist are left where they are
+    media_ids = list(dict.fromkeys(media_ids))
+    if not media_ids:
+        return 0
+    result = await db.execute(select(MediaFile.id).where(MediaFile.id.in_(media_ids)))
+    found = set(result.scalars())
+    missing = [media_id for media_id in media_ids if media_id not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Media files not found: {missing}")
+    start = await db.scalar(
+        select(func.coalesce(func.max(card_media.c.position) + 1, 0)).where(card_media.c.card_id == card_id)
+    )
+    statement = insert_ignore(db.bind.dialect.name, card_media).values([
+        {"card_id": card_id, "media_id": media_id, "position": start + offset}
+        for offset, media_id in enumerate(media_ids)
+    ])
+    result = await db.execute(statement)
+    return result.rowcount
+
+async def unlink_media(db: AsyncSession, card_id: int, media_ids):
+    if not media_ids:
+        return 0
+    result = await db.execute(
+        delete(card_media)
+        .where(card_media.c.card_id == card_id)
+        .where(card_media.c.media_id.in_(set(media_ids)))
+    )
+    return result.rowcount
+
+async def touch_card(db: AsyncSession, card_id: int):
+    # Bump updated_at so cached card pages are revalidated
+    await db.execute(update(Card).where(Card.id == card_id).values(updated_at=datetime.utcnow()))
+    invalidate_card(db, card_id)
 
 @router.post("/attach/{card_id}")
 async def attach_media_to_card(
@@ -106,19 +393,184 @@ async def attach_media_to_card(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    # Get the card and media file
-    card = await db.get(Card, card_id)
+    await get_own_card(db, card_id, current_user)
+    await link_media(db, card_id, [media_id])
+    await touch_card(db, card_id)
+    await db.commit()
+    
+    return {"message": "Media file attached successfully"}
+
+@router.post("/attach/{card_id}/bulk")
+async def attach_media_bulk(
+    card_id: int,
+    attachment: MediaAttachment,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    await get_own_card(db, card_id, current_user)
+    attached = await link_media(db, card_id, attachment.media_ids)
+    if attached:
+        await touch_card(db, card_id)
+    await db.commit()
+    return {"attached": attached}
+
+@router.post("/detach/{card_id}/bulk")
+async def detach_media_bulk(
+    card_id: int,
+    attachment: MediaAttachment,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    await get_own_card(db, card_id, current_user)
+    detached = await unlink_media(db, card_id, attachment.media_ids)
+    if detached:
+        await touch_card(db, card_id)
+    await db.commit()
+    return {"detached": detached}
+
+def media_disk_path(media_file):
+    # file_path is the public /static URL; map it back onto MEDIA_DIR
+    relative = media_file.file_path[len("/static/media/"):]
+    path = (MEDIA_DIR / relative).resolve()
+    if MEDIA_DIR.resolve() not in path.parents:
+        raise HTTPException(status_code=404, detail="Media file not found")
+    return path
+
+def media_etag(media_file, stat_result):
+    # Strong validator: the content hash, or size and mtime for legacy rows
+    if media_file.content_hash:
+        return f'"{media_file.content_hash}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+@router.api_route("/{media_id}", methods=["GET", "HEAD"])
+async def get_media_file(
+    media_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
     media_file = await db.get(MediaFile, media_id)
+    if not media_file:
+        raise HTTPException(status_code=404, detail="Media file not found")
     
-    if not card or not media_file:
-        raise HTTPException(status_code=404, detail="Card or media file not found")
+    path = media_disk_path(media_file)
+    try:
+        stat_result = await run_in_threadpool(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Media file not found")
     
-    # Check if user owns the card
-    if card.author_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized to modify this card")
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    return RangeFileResponse(
+        path,
+        request,
+        media_type=media_type,
+        etag=media_etag(media_file, stat_result),
+        headers={"Cache-Control": "private, max-age=0, must-revalidate"},
+        stat_result=stat_result
+    )
+
+async def create_variant(db: AsyncSession, media_file, name, run_cpu=runner.run_cpu):
+    stem = media_file.content_hash or f"id{media_file.id}"
+    relative_path = Path("variants") / stem[:2] / derivatives.variant_filename(stem, name)
+    destination = MEDIA_DIR / relative_path
+    await run_in_threadpool(destination.parent.mkdir, parents=True, exist_ok=True)
+    width, height = await run_cpu(
+        derivatives.render_variant,
+        str(media_disk_path(media_file)),
+        str(destination),
+        derivatives.VARIANT_WIDTHS[name]
+    )
+    variant = MediaVariant(
+        media_id=media_file.id,
+        name=name,
+        file_path=f"/static/media/{relative_path.as_posix()}",
+        width=width,
+        height=height
+    )
+    db.add(variant)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Generated concurrently by the background job or another request
+        await db.rollback()
+        result = await db.execute(
+            select(MediaVariant).where(MediaVariant.media_id == media_file.id, MediaVariant.name == name)
+        )
+        variant = result.scalar_one()
+    return variant
+
+async def generate_variants(session_factory, media_id: int, run_cpu=runner.run_cpu):
+    # Record the image dimensions and render every missing variant in the
+    # runner's process pool
+    async with session_factory() as db:
+        media_file = await db.get(MediaFile, media_id, options=[selectinload(MediaFile.variants)])
+        if media_file is None:
+            return
+        if media_file.width is None:
+            media_file.width, media_file.height = await run_cpu(
+                derivatives.read_dimensions, str(media_disk_path(media_file))
+            )
+            await db.commit()
+        existing = {variant.name for variant in media_file.variants}
+        for name in derivatives.VARIANT_WIDTHS:
+            if name not in existing:
+                await create_variant(db, media_file, name, run_cpu)
+
+async def purge_unattached_variants(session_factory, media_ids):
+    # Variants of media no longer attached to any card are deleted; they are
+    # generated again on demand if the file is shown somewhere later
+    async with session_factory() as db:
+        attached = select(card_media.c.media_id).where(card_media.c.media_id.in_(media_ids))
+        result = await db.execute(
+            select(MediaVariant).where(MediaVariant.media_id.in_(media_ids), MediaVariant.media_id.not_in(attached))
+        )
+        for variant in result.scalars().all():
+            await run_in_threadpool(media_disk_path(variant).unlink, missing_ok=True)
+            await db.delete(variant)
+        await db.commit()
+
+class MediaJob(BaseModel):
+    media_id: int
+
+@job_handler("generate_variants", MediaJob, lane="cpu")
+async def generate_variants_job(job: MediaJob, ctx):
+    await generate_variants(ctx.session_factory, job.media_id, ctx.run_cpu)
+
+@router.get("/{media_id}/variants/{name}")
+async def get_media_variant(
+    media_id: int,
+    name: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    media_file = await db.get(MediaFile, media_id)
+    if not media_file or not media_file.is_image or name not in derivatives.VARIANT_WIDTHS:
+        raise HTTPException(status_code=404, detail="Media variant not found")
     
-    # Add media file to card
-    card.media_files.append(media_file)
-    await db.commit()
+    # Without an image library the original is the only rendition
+    if not derivatives.available():
+        return RedirectResponse(url=f"/media/{media_id}", status_code=307)
     
-    return {"message": "Media file attached successfully"}
\ No newline at end of file
+    result = await db.execute(
+        select(MediaVariant).where(MediaVariant.media_id == media_id, MediaVariant.name == name)
+    )
+    variant = result.scalar_one_or_none()
+    path = media_disk_path(variant) if variant else None
+    if path is None or not await run_in_threadpool(path.exists):
+        # Produce a missing variant lazily on first request
+        if variant:
+            await db.delete(variant)
+            await db.commit()
+        variant = await create_variant(db, media_file, name)
+        path = media_disk_path(variant)
+    
+    stat_result = await run_in_threadpool(os.stat, path)
+    return RangeFileResponse(
+        path,
+        request,
+        media_type=f"image/{derivatives.VARIANT_FORMAT}",
+        etag=f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"',
+        headers={"Cache-Control": "private, max-age=0, must-revalidate"},
+        stat_result=stat_result
+    )
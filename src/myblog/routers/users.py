@@ -4,18 +4,16 @@ from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 from typing import List
 from myblog.database import get_db
+from myblog.templating import templates
 from myblog.models import User, Role
 from .auth import get_current_user
-from fastapi.templating import Jinja2Templates
 from pathlib import Path
 import markdown
 from fastapi.responses import RedirectResponse
 
 router = APIRouter()
 
-# Setup templates
-BASE_DIR = Path(__file__).resolve().parent.parent
-templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))# Dependency to get current user
+# Dependency to get current user
 
 
 @router.put("/{user_id}/role")
@@ -37,7 +35,7 @@ async def set_user_role(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Update the user's role
+    # Update the user's role; the cached snapshot is invalidated when this commits
     user.role = role
     await db.commit()
     await db.refresh(user)
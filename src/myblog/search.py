@@ -0,0 +1,118 @@
+import base64
+import re
+from fastapi import HTTPException
+from markupsafe import Markup, escape
+from sqlalchemy import select, func, literal, literal_column, or_, and_, false, text, table, column
+from myblog.models import Card
+
+# Full-text search over cards. On SQLite this is an external-content FTS5 table
+# kept in sync by triggers, so every write path (ORM, bulk inserts, raw SQL) is
+# covered. Other databases fall back to a substring match.
+
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts USING fts5(
+        title, content, content='cards', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cards_fts_insert AFTER INSERT ON cards BEGIN
+        INSERT INTO cards_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cards_fts_delete AFTER DELETE ON cards BEGIN
+        INSERT INTO cards_fts(cards_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cards_fts_update AFTER UPDATE OF title, content ON cards BEGIN
+        INSERT INTO cards_fts(cards_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO cards_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+]
+
+# Title matches weigh more than body matches in the bm25 ranking
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+
+# Snippet markers; private-use characters that cannot collide with card text
+HIGHLIGHT_START = "\ue000"
+HIGHLIGHT_END = "\ue001"
+SNIPPET_TOKENS = 16
+
+cards_fts = table("cards_fts", column("rowid"))
+fts_table = literal_column("cards_fts")
+
+
+def install_search_index(connection):
+    # Run through AsyncConnection.run_sync; creates and fills the index once
+    if connection.dialect.name != "sqlite":
+        return
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cards_fts'")
+    ).first()
+    for statement in SEARCH_INDEX_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        connection.execute(text("INSERT INTO cards_fts(cards_fts) VALUES ('rebuild')"))
+
+
+def to_match_expression(query):
+    # Quote every term so user input can never be parsed as FTS5 syntax
+    terms = re.findall(r"\w+", query)
+    return " ".join('"' + term + '"' for term in terms)
+
+
+def like_pattern(query):
+    # Substring pattern with LIKE wildcards in the input matched literally
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def encode_rank_cursor(rank, card_id):
+    raw = f"{rank!r}|{card_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_rank_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, card_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return float(rank), int(card_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def build_search_query(dialect_name, query, visibility, cursor=None, limit=20):
+    # Returns (card, snippet, rank) rows, best match first, one extra row for paging
+    if dialect_name == "sqlite":
+        match = to_match_expression(query)
+        rank = func.bm25(fts_table, TITLE_WEIGHT, CONTENT_WEIGHT)
+        snippet = func.snippet(fts_table, 1, HIGHLIGHT_START, HIGHLIGHT_END, "…", SNIPPET_TOKENS)
+        statement = (
+            select(Card, snippet.label("snippet"), rank.label("rank"))
+            .join_from(Card, cards_fts, cards_fts.c.rowid == Card.id)
+            .where(fts_table.op("MATCH")(match) if match else false())
+        )
+    else:
+        pattern = like_pattern(query)
+        rank = literal(0.0)
+        statement = (
+            select(Card, literal(None).label("snippet"), rank.label("rank"))
+            .where(or_(Card.title.ilike(pattern, escape="\\"), Card.content.ilike(pattern, escape="\\")))
+        )
+    statement = statement.where(visibility)
+    if cursor:
+        last_rank, last_id = decode_rank_cursor(cursor)
+        statement = statement.where(or_(rank > last_rank, and_(rank == last_rank, Card.id > last_id)))
+    return statement.order_by(rank, Card.id).limit(limit + 1)
+
+
+def highlight(snippet):
+    # Escape the snippet text, then turn the markers into <mark> tags
+    if snippet is None:
+        return None
+    escaped = str(escape(snippet))
+    return Markup(escaped.replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>"))
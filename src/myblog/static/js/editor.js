@@ -0,0 +1,111 @@
+// Initialize EasyMDE
+const easyMDE = new EasyMDE({
+    element: document.getElementById('content'),
+    spellChecker: false,
+    autosave: {
+        enabled: true,
+        delay: 1000,
+        uniqueId: 'card-editor'
+    }
+});
+
+// Handle media upload
+document.getElementById('uploadButton').addEventListener('click', async function() {
+    const fileInput = document.getElementById('mediaUpload');
+    const file = fileInput.files[0];
+    if (!file) {
+        alert('Please select a file to upload');
+        return;
+    }
+
+    const formData = new FormData();
+    formData.append('file', file);
+
+    const progressBar = document.querySelector('#uploadProgress');
+    const progressBarInner = progressBar.querySelector('.progress-bar');
+    progressBar.classList.remove('d-none');
+    progressBarInner.style.width = '0%';
+
+    try {
+        const response = await fetch('/media/upload', {
+            method: 'POST',
+            body: formData,
+            headers: {
+                'Accept': 'application/json'
+            },
+            credentials: 'same-origin'
+        });
+
+        if (response.ok) {
+            const data = await response.json();
+            const fileUrl = data.url;
+            const fileExt = file.name.split('.').pop().toLowerCase();
+            
+            let markdownInsert = '';
+            if (['jpg', 'jpeg', 'png', 'gif', 'webp'].includes(fileExt)) {
+                markdownInsert = `![${file.name}](${fileUrl})`;
+            } else if (['mp3', 'wav', 'ogg', 'm4a'].includes(fileExt)) {
+                markdownInsert = `<audio controls src="${fileUrl}"></audio>`;
+            } else if (['mp4', 'webm'].includes(fileExt)) {
+                markdownInsert = `<video controls src="${fileUrl}"></video>`;
+            }
+
+            const currentContent = easyMDE.value();
+            const cursorPosition = easyMDE.codemirror.getCursor();
+            const newContent = currentContent.slice(0, cursorPosition.ch) + markdownInsert + currentContent.slice(cursorPosition.ch);
+            easyMDE.value(newContent);
+
+            fileInput.value = '';
+            progressBar.classList.add('d-none');
+            progressBarInner.style.width = '0%';
+        } else {
+            const error = await response.json();
+            alert(error.detail || 'Failed to upload file');
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        alert('An error occurred while uploading the file');
+    } finally {
+        progressBar.classList.add('d-none');
+        progressBarInner.style.width = '0%';
+    }
+});
+
+// Handle form submission
+document.getElementById('cardForm').addEventListener('submit', function(e) {
+    e.preventDefault();
+    // Update the content field with the EasyMDE value before submitting
+    document.getElementById('content').value = easyMDE.value();
+    
+    const form = e.target;
+    const isEdit = form.action.includes('/');
+    const method = isEdit ? 'PUT' : 'POST';
+    
+    const payload = Object.fromEntries(new FormData(form));
+    // An unticked checkbox is left out of the form data; send it explicitly
+    // so a shared card can be made private again
+    payload.to_all = form.elements['to_all'].checked;
+    
+    fetch(form.action, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            ...(method === 'PUT' ? { 'X-HTTP-Method-Override': 'PUT' } : {})
+        },
+        body: JSON.stringify(payload)
+    }).then(response => {
+        if (response.ok) {
+            window.location.href = '/cards';
+        } else {
+            response.json().then(data => {
+                alert(data.detail || 'Failed to save the card');
+            }).catch(() => {
+                alert('Failed to save the card');
+            });
+        }
+    }).catch(error => {
+        console.error('Error:', error);
+        alert('An error occurred while saving the card');
+    });
+});
@@ -0,0 +1,75 @@
+from fastapi.templating import Jinja2Templates
+from fastapi.responses import StreamingResponse
+from jinja2 import FileSystemBytecodeCache
+from starlette.concurrency import iterate_in_threadpool
+from pathlib import Path
+import os
+from myblog import metrics
+from myblog.assets import static_url
+
+# One template environment shared by the app and every router, so each worker
+# compiles a template once and every process reuses the on-disk bytecode.
+TEMPLATES_DIR = Path(__file__).resolve().parent / "templates"
+# Unset: Jinja's own per-user cache directory, which it creates private and
+# refuses to use if another user owns it
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR") or None
+# Checking template mtimes on every render is only useful while developing
+TEMPLATES_AUTO_RELOAD = os.getenv("TEMPLATES_AUTO_RELOAD", "false").lower() == "true"
+TEMPLATES_PRECOMPILE = os.getenv("TEMPLATES_PRECOMPILE", "true").lower() == "true"
+
+# Streamed pages are flushed to the client in chunks of about this size
+STREAM_CHUNK_SIZE = int(os.getenv("TEMPLATE_STREAM_CHUNK_SIZE", str(16 * 1024)))
+
+if TEMPLATE_CACHE_DIR:
+    Path(TEMPLATE_CACHE_DIR).mkdir(mode=0o700, parents=True, exist_ok=True)
+
+templates = Jinja2Templates(
+    directory=str(TEMPLATES_DIR),
+    auto_reload=TEMPLATES_AUTO_RELOAD,
+    bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR),
+    cache_size=-1,
+)
+if metrics.METRICS_ENABLED:
+    metrics.instrument_templates(templates.env)
+# {{ static_url('js/editor.js') }} -> /static/js/editor.<hash>.js
+templates.env.globals["static_url"] = static_url
+
+
+def precompile_templates():
+    # Load every template at startup so no request pays for compilation
+    if not TEMPLATES_PRECOMPILE:
+        return 0
+    names = templates.env.list_templates(extensions=["html"])
+    for name in names:
+        templates.get_template(name)
+    return len(names)
+
+
+def _buffered(chunks, on_complete=None):
+    # Group Jinja's many small fragments into chunk-sized pieces
+    buffer, size, parts = [], 0, []
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_SIZE:
+            data = "".join(buffer).encode("utf-8")
+            if on_complete is not None:
+                parts.append(data)
+            yield data
+            buffer, size = [], 0
+    data = "".join(buffer).encode("utf-8")
+    yield data
+    if on_complete is not None:
+        parts.append(data)
+        on_complete(b"".join(parts))
+
+
+def StreamingTemplateResponse(name, context, status_code=200, headers=None, on_complete=None):
+    # Render incrementally in the threadpool and send each chunk as it is produced,
+    # so the first bytes go out before the whole page is built. on_complete gets the
+    # full body once rendering finishes (e.g. to fill a page cache).
+    if "request" not in context:
+        raise ValueError('context must include a "request" key')
+    template = templates.get_template(name)
+    body = iterate_in_threadpool(_buffered(template.generate(context), on_complete))
+    return StreamingResponse(body, status_code=status_code, headers=headers, media_type="text/html")
@@ -0,0 +1,81 @@
+import re
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from myblog.assets import AssetManifest, FingerprintedStaticFiles, IMMUTABLE_CACHE_CONTROL, write_manifest
+from myblog.templating import templates
+
+
+@pytest.fixture(scope="function")
+def static_dir(tmp_path):
+    """Provide a static directory with one stylesheet and one upload."""
+    (tmp_path / "css").mkdir()
+    (tmp_path / "media").mkdir()
+    (tmp_path / "css" / "site.css").write_text("body { margin: 0; }\n")
+    (tmp_path / "media" / "photo.png").write_bytes(b"\x89PNG")
+    return tmp_path
+
+def make_app(manifest, directory):
+    app = FastAPI()
+    app.mount("/static", FingerprintedStaticFiles(directory=str(directory), skip=("media",), manifest=manifest))
+    return app
+
+def test_manifest_fingerprints_assets_but_not_uploads(static_dir):
+    """Test that asset URLs carry a content hash, which changes with the content."""
+    manifest = AssetManifest(static_dir, path=None)
+    manifest.load()
+    url = manifest.url("css/site.css")
+    assert re.fullmatch(r"/static/css/site\.[0-9a-f]{12}\.css", url)
+    assert manifest.url("media/photo.png") == "/static/media/photo.png"
+    assert manifest.url("/js/missing.js") == "/static/js/missing.js"
+
+    version = manifest.version
+    (static_dir / "css" / "site.css").write_text("body { margin: 1px; }\n")
+    manifest.load()
+    assert manifest.url("css/site.css") != url
+    assert manifest.version != version
+
+def test_prebuilt_manifest_is_used(static_dir):
+    """Test that a manifest written by the build step is loaded instead of rehashing."""
+    path = static_dir / "manifest.json"
+    written = write_manifest(static_dir, path)
+    (static_dir / "css" / "site.css").write_text("changed after the build\n")
+    manifest = AssetManifest(static_dir, path=path)
+    assert manifest.load() == written
+
+@pytest.mark.asyncio
+async def test_fingerprinted_urls_served_immutable(static_dir):
+    """Test that hashed URLs are cached forever and plain URLs keep revalidating."""
+    manifest = AssetManifest(static_dir, path=None)
+    async with AsyncClient(app=make_app(manifest, static_dir), base_url="http://testserver") as client:
+        hashed = await client.get(manifest.url("css/site.css"))
+        assert hashed.status_code == 200
+        assert hashed.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+        assert hashed.text == "body { margin: 0; }\n"
+
+        plain = await client.get("/static/css/site.css")
+        assert plain.status_code == 200 and "cache-control" not in plain.headers
+
+        stale = await client.get("/static/css/site.000000000000.css")
+    assert stale.status_code == 404
+
+@pytest.mark.asyncio
+async def test_content_addressed_media_served_immutable(static_dir):
+    """Test that uploads stored under their hash are cached forever and other uploads are not."""
+    digest = "cd" * 32
+    (static_dir / "media" / "variants" / "cd").mkdir(parents=True)
+    (static_dir / "media" / "variants" / "cd" / f"{digest}-thumb.webp").write_bytes(b"RIFF")
+    manifest = AssetManifest(static_dir, path=None)
+    async with AsyncClient(app=make_app(manifest, static_dir), base_url="http://testserver") as client:
+        variant = await client.get(f"/static/media/variants/cd/{digest}-thumb.webp")
+        legacy = await client.get("/static/media/photo.png")
+    assert variant.status_code == 200
+    assert variant.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert legacy.status_code == 200 and "cache-control" not in legacy.headers
+
+def test_templates_link_fingerprinted_assets():
+    """Test that templates get the static_url helper and the editor script is fingerprinted."""
+    url = templates.env.globals["static_url"]("js/editor.js")
+    assert re.fullmatch(r"/static/js/editor\.[0-9a-f]{12}\.js", url)
+    source = templates.env.loader.get_source(templates.env, "cards/editor.html")[0]
+    assert "static_url('js/editor.js')" in source
@@ -9,6 +9,7 @@ from myblog.database import get_db  # Replace with your actual import
 from myblog.models import User  # Replace with your actual import
 from myblog.routers.auth import (router as auth_router, get_password_hash, create_access_token, login, login_page, logout, verify_password, 
                                  signup_page, signup, get_current_user,  # Replace with your actual import
+                                 verify_password_async, get_password_hash_async, password_hash_stats,
                                  SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES)  # Replace with your actual import
 
 
@@ -78,6 +79,34 @@ def test_get_password_hash():
     assert hashed != password  # Hash should differ from plain password
     assert verify_password(password, hashed) is True
 
+@pytest.mark.asyncio
+async def test_password_hashing_async():
+    """Test that the async variants hash and verify like the sync ones."""
+    hashed = await get_password_hash_async("testpassword")
+    assert verify_password("testpassword", hashed) is True
+    assert await verify_password_async("testpassword", hashed) is True
+    assert await verify_password_async("wrongpassword", hashed) is False
+
+@pytest.mark.asyncio
+async def test_password_hashing_does_not_block_event_loop():
+    """Test that a burst of hashes runs off the loop and drains the queue."""
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    task = asyncio.ensure_future(ticker())
+    await asyncio.gather(*[get_password_hash_async("burst") for _ in range(8)])
+    task.cancel()
+    assert ticks > 1  # The loop kept running while bcrypt was busy
+    stats = password_hash_stats()
+    assert stats["queued"] == 0
+    assert stats["in_flight"] == 0
+    assert stats["max_queued"] >= 1
+
 def test_create_access_token():
     """Test JWT token creation with default and custom expiration."""
     data = {"sub": "testuser"}
@@ -0,0 +1,30 @@
+from benchmarks.run import percentile, summarize, compare
+
+
+def report(p50, p95, p99, rps):
+    return {"routes": {"GET /cards": {
+        "throughput_rps": rps,
+        "latency_ms": {"p50": p50, "p95": p95, "p99": p99},
+    }}}
+
+
+def test_percentiles_use_nearest_rank():
+    """Test that percentiles pick an observed sample."""
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 0.50) == 0.050
+    assert percentile(values, 0.99) == 0.099
+    assert percentile([], 0.5) is None
+    summary = summarize(values, errors=2, elapsed=2.0)
+    assert summary["requests"] == 100
+    assert summary["throughput_rps"] == 50.0
+    assert summary["latency_ms"]["p95"] == 95.0
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    """Test that only changes beyond the threshold and the noise floor are flagged."""
+    baseline = report(10.0, 20.0, 30.0, 100.0)
+    assert compare(report(10.5, 21.0, 30.5, 95.0), baseline) == []
+    regressions = compare(report(10.0, 25.0, 30.0, 80.0), baseline)
+    assert [item["metric"] for item in regressions] == ["latency_ms.p95", "throughput_rps"]
+    # Sub-millisecond changes are noise, however large in relative terms
+    assert compare(report(0.5, 0.9, 0.9, 100.0), report(0.2, 0.3, 0.3, 100.0)) == []
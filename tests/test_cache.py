@@ -0,0 +1,200 @@
+import pickle
+import sqlite3
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from fastapi import HTTPException
+from starlette.requests import Request
+from myblog.cache import TTLCache, SharedCache
+from myblog.models import Base, User, Role
+from myblog.routers.auth import get_current_user, create_access_token, user_cache, UserSnapshot
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+# Async session fixture on a fresh in-memory database
+@pytest.fixture(scope="function")
+async def session():
+    """Provide an async session bound to an empty in-memory database."""
+    user_cache.clear()
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)() as session:
+        yield session
+    await engine.dispose()
+    user_cache.clear()
+
+def test_ttl_cache_expires_entries():
+    """Test that entries are not served past their TTL."""
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.0
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_ttl_cache_never_extends_ttl():
+    """Test that a per-entry TTL can shorten but not extend the bound."""
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set("a", 1, ttl=60)
+    clock.now = 6
+    assert cache.get("a") is None
+
+def test_ttl_cache_evicts_least_recently_used():
+    """Test that the cache stays bounded and evicts the LRU entry."""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_shared_cache_invalidation_reaches_other_workers(tmp_path):
+    """Test that an invalidation in one worker is seen by another after its poll interval."""
+    path = str(tmp_path / "cache.sqlite3")
+    worker_a = SharedCache("card", path=path, poll_interval=0)
+    worker_b = SharedCache("card", path=path, poll_interval=3600)
+    worker_b.get("warm-up")
+    worker_a.set(1, "v1")
+    assert worker_b.get(1) == "v1"
+
+    worker_a.invalidate(1)
+    assert worker_a.get(1) is None
+    # Still inside worker b's poll interval: its in-process copy is served
+    assert worker_b.get(1) == "v1"
+    worker_b.poll_interval = 0
+    assert worker_b.get(1) is None
+
+def test_shared_cache_rejects_values_computed_before_invalidation(tmp_path):
+    """Test that a value read before an invalidation is not stored under the new version."""
+    cache = SharedCache("user", path=str(tmp_path / "cache.sqlite3"), poll_interval=0)
+    version = cache.version("carol")
+    cache.invalidate("carol")
+    assert cache.set("carol", "stale", version=version) is False
+    assert cache.get("carol") is None
+    assert cache.set("carol", "fresh", version=cache.version("carol")) is True
+    assert cache.get("carol") == "fresh"
+
+def test_shared_cache_evicts_least_recently_used_by_size(tmp_path):
+    """Test that the shared tier stays within its byte budget."""
+    cache = SharedCache("page", path=str(tmp_path / "cache.sqlite3"), max_bytes=10_000, clock=FakeClock())
+    for i in range(20):
+        cache.clock.now = i
+        cache.set(i, b"x" * 1000)
+    cache.evict()
+    assert cache.stats()["shared_bytes"] <= 10_000
+    cache.local.clear()
+    assert cache.get(0) is None
+    assert cache.get(19) == b"x" * 1000
+
+def test_shared_cache_without_file_is_process_local():
+    """Test that an empty path keeps only the in-process tier."""
+    cache = SharedCache("page", path="")
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    cache.invalidate("a")
+    assert cache.get("a") is None
+
+def test_shared_cache_discards_tampered_entries(tmp_path):
+    """Test that a blob not signed with the cache key is never unpickled."""
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SharedCache("page", path=path)
+    cache.set("a", b"page")
+    assert (tmp_path / "cache.sqlite3").stat().st_mode & 0o777 == 0o600
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE entries SET value = ? WHERE key = 'page:a'", (b"\0" * 32 + pickle.dumps("planted"),))
+    cache.local.clear()
+    assert cache.get("a") is None
+
+def test_shared_cache_refuses_directory_writable_by_others(tmp_path):
+    """Test that a cache file in a world-writable directory is not used."""
+    tmp_path.chmod(0o777)
+    cache = SharedCache("page", path=str(tmp_path / "cache.sqlite3"))
+    cache.set("a", 1)
+    assert cache.path == ""
+    assert not (tmp_path / "cache.sqlite3").exists()
+    assert cache.get("a") == 1
+
+@pytest.mark.asyncio
+async def test_async_access_matches_sync_access(tmp_path):
+    """Test that the async methods read and write the same shared entries."""
+    path = str(tmp_path / "cache.sqlite3")
+    worker_a = SharedCache("card", path=path)
+    worker_b = SharedCache("card", path=path)
+    assert await worker_a.aset(1, "v1", version=await worker_a.aversion(1)) is True
+    assert await worker_b.aget(1) == "v1"
+    assert await worker_b.aget(1) == "v1"
+    assert worker_b.hits == 2
+
+@pytest.mark.asyncio
+async def test_get_current_user_is_cached_and_invalidated(session):
+    """Test that the user lookup is cached and a role change invalidates it."""
+    user = User(username="carol", email="carol@example.com", role=Role.VIEWER)
+    session.add(user)
+    await session.commit()
+    token = create_access_token({"sub": "carol"})
+    request = Request({"type": "http", "headers": []})
+
+    first = await get_current_user(request=request, token=token, db=session)
+    assert first == UserSnapshot(id=user.id, username="carol", role=Role.VIEWER)
+    hits = user_cache.hits
+    second = await get_current_user(request=request, token=token, db=session)
+    assert second == first
+    assert user_cache.hits == hits + 1
+
+    user.role = Role.ADMIN
+    await session.commit()
+    third = await get_current_user(request=request, token=token, db=session)
+    assert third.role == Role.ADMIN
+
+@pytest.mark.asyncio
+async def test_user_cache_invalidated_on_commit_not_flush(session):
+    """Test that an uncommitted role change never reaches the cache."""
+    user = User(username="erin", email="erin@example.com", role=Role.VIEWER)
+    session.add(user)
+    await session.commit()
+    token = create_access_token({"sub": "erin"})
+    request = Request({"type": "http", "headers": []})
+    await get_current_user(request=request, token=token, db=session)
+
+    user.role = Role.ADMIN
+    await session.flush()
+    assert user_cache.get("erin").role == Role.VIEWER
+    await session.rollback()
+    assert user_cache.get("erin").role == Role.VIEWER
+
+    user.role = Role.ADMIN
+    await session.commit()
+    assert user_cache.get("erin") is None
+    assert (await get_current_user(request=request, token=token, db=session)).role == Role.ADMIN
+
+@pytest.mark.asyncio
+async def test_deleted_user_is_not_served_from_cache(session):
+    """Test that deleting a user drops the cached snapshot."""
+    user = User(username="dave", email="dave@example.com")
+    session.add(user)
+    await session.commit()
+    token = create_access_token({"sub": "dave"})
+    request = Request({"type": "http", "headers": []})
+    await get_current_user(request=request, token=token, db=session)
+
+    await session.delete(user)
+    await session.commit()
+    with pytest.raises(HTTPException) as exc:
+        await get_current_user(request=request, token=token, db=session)
+    assert exc.value.status_code == 401
@@ -0,0 +1,529 @@
+import json
+import pytest
+from pathlib import Path
+from datetime import datetime, timedelta
+from fastapi import FastAPI, Request
+from httpx import AsyncClient
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from myblog.models import Base, Card, User, Role, MediaFile, MediaVariant
+from myblog.models.models import card_media
+from myblog.rendering import RENDERER_VERSION, render_card, ensure_rendered, is_stale
+from myblog.pagination import paginate, paginate_union, split_page
+from myblog.routers.cards import visible_to, visibility_arms, page_cache, card_cache, router as cards_router
+from myblog.routers.cards import api_router as cards_api_router
+from myblog.routers.auth import get_current_user, UserSnapshot
+from myblog.database import get_db
+from myblog.search import install_search_index, build_search_query, encode_rank_cursor, highlight
+from myblog.querylog import instrument_engine, assert_max_queries
+from myblog.jobs import runner
+from myblog.cli import backfill_rendered_cards
+
+
+# Database fixtures on a fresh in-memory database
+@pytest.fixture(scope="function")
+async def session_factory():
+    """Provide a session factory bound to an empty in-memory database."""
+    engine = instrument_engine(create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool))
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(install_search_index)
+    yield sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
+
+@pytest.fixture(scope="function")
+async def session(session_factory):
+    """Provide an async session on the test database."""
+    async with session_factory() as session:
+        yield session
+
+# Async client fixture for the cards router; the viewer is switched per request
+@pytest.fixture(scope="function")
+async def client(session_factory, users):
+    """Provide an async test client logged in as the user named in the X-Test-User header."""
+    app = FastAPI()
+    app.include_router(cards_router, prefix="/cards")
+    app.include_router(cards_api_router, prefix="/api/cards")
+
+    async def override_get_db():
+        async with session_factory() as session:
+            yield session
+            await session.commit()
+
+    def override_current_user(request: Request):
+        return UserSnapshot.from_user(users[request.headers.get("x-test-user", "alice")])
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_current_user] = override_current_user
+    page_cache.clear()
+    card_cache.clear()
+    async with AsyncClient(app=app, base_url="http://testserver") as ac:
+        yield ac
+    page_cache.clear()
+    card_cache.clear()
+
+# Users and cards fixture: alice owns private and shared cards, bob owns one private card
+@pytest.fixture(scope="function")
+async def users(session):
+    """Create an admin, two developers and a set of cards with mixed visibility."""
+    admin = User(username="admin", email="admin@example.com", role=Role.ADMIN)
+    alice = User(username="alice", email="alice@example.com", role=Role.DEVELOPER)
+    bob = User(username="bob", email="bob@example.com", role=Role.DEVELOPER)
+    session.add_all([admin, alice, bob])
+    await session.flush()
+    start = datetime(2024, 1, 1)
+    for i in range(6):
+        session.add(render_card(Card(title=f"alice {i}", content="", author_id=alice.id, to_all=i % 2 == 0,
+                                     created_at=start + timedelta(minutes=i))))
+    # Same timestamp as the newest alice card, so ties are broken by id
+    session.add(render_card(Card(title="bob private", content="", author_id=bob.id, to_all=False,
+                                 created_at=start + timedelta(minutes=5))))
+    await session.commit()
+    return {"admin": admin, "alice": alice, "bob": bob}
+
+async def collect_pages(session, user, limit):
+    pages, cursor = [], None
+    while True:
+        query = paginate(select(Card).where(visible_to(user)), Card.created_at, Card.id, cursor=cursor, limit=limit)
+        result = await session.execute(query)
+        rows, cursor = split_page(result.scalars().all(), limit, key=lambda card: (card.created_at, card.id))
+        pages.append([card.title for card in rows])
+        if cursor is None:
+            return pages
+
+
+def test_render_card_stores_html_and_version():
+    """Test that rendering a card fills the HTML column and version stamp."""
+    card = Card(title="Hello", content="# Title\n\nSome *text*")
+    render_card(card)
+    assert "<h1>Title</h1>" in card.content_html
+    assert "<em>text</em>" in card.content_html
+    assert card.render_version == RENDERER_VERSION
+    assert card.content == "# Title\n\nSome *text*"  # Source Markdown is untouched
+
+def test_ensure_rendered_refreshes_stale_html():
+    """Test that HTML from an older renderer version is re-rendered."""
+    card = Card(title="Hello", content="**bold**", content_html="<p>old</p>", render_version="0:old")
+    assert is_stale(card)
+    ensure_rendered(card)
+    assert card.content_html == "<p><strong>bold</strong></p>"
+    assert not is_stale(card)
+
+def test_ensure_rendered_keeps_current_html():
+    """Test that current HTML is served as stored without re-rendering."""
+    card = Card(title="Hello", content="**bold**", content_html="<p>cached</p>", render_version=RENDERER_VERSION)
+    ensure_rendered(card)
+    assert card.content_html == "<p>cached</p>"
+
+@pytest.mark.asyncio
+async def test_backfill_keeps_updated_at(session_factory, session, users):
+    """Test that re-rendering stored HTML does not count as an edit."""
+    await session.execute(update(Card).values(content="*hi*", render_version="0:old", updated_at=Card.updated_at))
+    await session.commit()
+    before = dict((await session.execute(select(Card.id, Card.updated_at))).all())
+
+    assert await backfill_rendered_cards(batch_size=3, session_factory=session_factory) == 7
+    session.expire_all()
+    rows = (await session.execute(select(Card.id, Card.updated_at, Card.content_html, Card.render_version))).all()
+    assert {row.id: row.updated_at for row in rows} == before
+    assert all(row.content_html == "<p><em>hi</em></p>" and row.render_version == RENDERER_VERSION for row in rows)
+    assert await backfill_rendered_cards(session_factory=session_factory) == 0
+
+@pytest.mark.asyncio
+async def test_visibility_filter_in_sql(session, users):
+    """Test that each role only gets the cards it is allowed to see."""
+    for name, expected in [("admin", 7), ("alice", 6), ("bob", 4)]:
+        result = await session.execute(select(Card).where(visible_to(users[name])))
+        assert len(result.scalars().all()) == expected
+
+@pytest.mark.asyncio
+async def test_keyset_pagination_walks_all_rows_once(session, users):
+    """Test that cursor pages are newest first, disjoint and complete."""
+    pages = await collect_pages(session, users["admin"], limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    titles = [title for page in pages for title in page]
+    assert titles == ["bob private", "alice 5", "alice 4", "alice 3", "alice 2", "alice 1", "alice 0"]
+
+@pytest.mark.asyncio
+async def test_keyset_pagination_respects_visibility(session, users):
+    """Test that paging for a developer never includes other users' private cards."""
+    pages = await collect_pages(session, users["bob"], limit=2)
+    titles = [title for page in pages for title in page]
+    assert titles == ["bob private", "alice 4", "alice 2", "alice 0"]
+
+@pytest.mark.asyncio
+async def test_union_pagination_matches_visibility_filter(session, users):
+    """Test that the per-index union pages match the plain visibility filter."""
+    for name in ("admin", "alice", "bob"):
+        user = users[name]
+        pages, cursor = [], None
+        while True:
+            query = paginate_union(
+                select(Card.title, Card.created_at, Card.id), visibility_arms(user), Card.created_at, Card.id,
+                cursor=cursor, limit=2
+            )
+            rows, cursor = split_page((await session.execute(query)).all(), 2, key=lambda row: (row.created_at, row.id))
+            pages.append([row.title for row in rows])
+            if cursor is None:
+                break
+        assert pages == await collect_pages(session, user, limit=2)
+
+async def search(session, user, q, limit=20, dialect_name="sqlite"):
+    titles, cursor = [], None
+    while True:
+        result = await session.execute(build_search_query(dialect_name, q, visible_to(user), cursor=cursor, limit=limit))
+        rows = result.all()
+        titles.extend(row.Card.title for row in rows[:limit])
+        if len(rows) <= limit:
+            return titles
+        cursor = encode_rank_cursor(rows[limit - 1].rank, rows[limit - 1].Card.id)
+
+@pytest.mark.asyncio
+async def test_search_ranks_title_matches_first(session, users):
+    """Test that title matches outrank body matches and results are paged."""
+    alice = users["alice"]
+    session.add_all([
+        Card(title="Gardening notes", content="tomatoes and basil", author_id=alice.id, to_all=True),
+        Card(title="Cooking", content="a sauce made from gardening leftovers", author_id=alice.id, to_all=True),
+        Card(title="Unrelated", content="nothing here", author_id=alice.id, to_all=True),
+    ])
+    await session.commit()
+    assert await search(session, alice, "gardening") == ["Gardening notes", "Cooking"]
+    assert await search(session, alice, "gardening", limit=1) == ["Gardening notes", "Cooking"]
+
+@pytest.mark.asyncio
+async def test_fallback_search_matches_wildcards_literally(session, users):
+    """Test that %, _ and backslash in the query are not LIKE wildcards on other databases."""
+    alice = users["alice"]
+    session.add_all([
+        Card(title="100% done", content="", author_id=alice.id, to_all=True),
+        Card(title="1000 done", content="", author_id=alice.id, to_all=True),
+        Card(title="snake_case", content="", author_id=alice.id, to_all=True),
+        Card(title="snakeXcase", content="", author_id=alice.id, to_all=True),
+        Card(title="C:\\temp", content="", author_id=alice.id, to_all=True),
+    ])
+    await session.commit()
+    assert await search(session, alice, "100%", dialect_name="postgresql") == ["100% done"]
+    assert await search(session, alice, "snake_", dialect_name="postgresql") == ["snake_case"]
+    assert await search(session, alice, "C:\\t", dialect_name="postgresql") == ["C:\\temp"]
+    assert await search(session, alice, "%", dialect_name="postgresql") == ["100% done"]
+
+@pytest.mark.asyncio
+async def test_search_respects_visibility_and_tracks_writes(session, users):
+    """Test that search hides private cards and follows updates and deletes."""
+    card = Card(title="Secret recipe", content="private", author_id=users["alice"].id, to_all=False)
+    session.add(card)
+    await session.commit()
+    assert await search(session, users["alice"], "recipe") == ["Secret recipe"]
+    assert await search(session, users["bob"], "recipe") == []
+
+    card.title = "Public recipe"
+    card.to_all = True
+    await session.commit()
+    assert await search(session, users["bob"], "secret") == []
+    assert await search(session, users["bob"], "recipe") == ["Public recipe"]
+
+    await session.delete(card)
+    await session.commit()
+    assert await search(session, users["admin"], "recipe") == []
+
+@pytest.mark.asyncio
+async def test_search_query_syntax_is_neutralised(session, users):
+    """Test that FTS operators in user input are treated as plain words."""
+    session.add(Card(title="near or far", content="", author_id=users["alice"].id, to_all=True))
+    await session.commit()
+    assert await search(session, users["admin"], 'far" OR NEAR(') == ["near or far"]
+    assert await search(session, users["admin"], "alice OR bob") == []
+    assert await search(session, users["admin"], "!!!") == []
+
+def test_highlight_escapes_snippet_text():
+    """Test that snippets are HTML-escaped and only markers become <mark>."""
+    assert highlight("<b>\ue000hit\ue001</b>") == "&lt;b&gt;<mark>hit</mark>&lt;/b&gt;"
+
+@pytest.mark.asyncio
+async def test_card_detail_conditional_get(client):
+    """Test that a matching If-None-Match gets 304 and an edit changes the validator."""
+    response = await client.get("/cards/1")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    cached = await client.get("/cards/1", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    # Another reader shares the page; the author sees edit buttons and gets another validator
+    reader = await client.get("/cards/1", headers={"X-Test-User": "admin"})
+    assert reader.status_code == 200
+    bob = await client.get("/cards/1", headers={"X-Test-User": "bob", "If-None-Match": reader.headers["etag"]})
+    assert bob.status_code == 304
+    assert reader.headers["etag"] != etag
+
+    await client.post("/cards/1", data={"title": "edited", "content": "new body"})
+    after_edit = await client.get("/cards/1", headers={"If-None-Match": etag})
+    assert after_edit.status_code == 200
+    assert "new body" in after_edit.text
+
+@pytest.mark.asyncio
+async def test_reading_stale_cards_writes_nothing(client, session):
+    """Test that rendering stale HTML on a GET leaves the row and its validator alone."""
+    await session.execute(update(Card).values(content_html=None, updated_at=Card.updated_at))
+    await session.commit()
+    before = (await session.execute(select(Card.updated_at).where(Card.id == 1))).scalar_one()
+
+    for url in ("/cards/1", "/cards/"):
+        response = await client.get(url)
+        assert response.status_code == 200
+        page_cache.clear()
+        cached = await client.get(url, headers={"If-None-Match": response.headers["etag"]})
+        assert cached.status_code == 304
+
+    session.expire_all()
+    row = (await session.execute(select(Card.content_html, Card.updated_at).where(Card.id == 1))).one()
+    assert row.content_html is None and row.updated_at == before
+
+@pytest.mark.asyncio
+async def test_card_list_conditional_get_varies_per_user(client):
+    """Test that list validators differ per viewer and change when the page changes."""
+    alice = await client.get("/cards/")
+    bob = await client.get("/cards/", headers={"X-Test-User": "bob"})
+    assert alice.headers["etag"] != bob.headers["etag"]
+    assert "bob private" in bob.text and "bob private" not in alice.text
+
+    again = await client.get("/cards/", headers={"If-None-Match": alice.headers["etag"]})
+    assert again.status_code == 304
+
+    await client.delete("/cards/1")
+    changed = await client.get("/cards/", headers={"If-None-Match": alice.headers["etag"]})
+    assert changed.status_code == 200
+    assert "alice 0" not in changed.text
+
+@pytest.mark.asyncio
+async def test_large_card_list_is_streamed_and_cached(client, monkeypatch):
+    """Test that large list pages are streamed and the full body still reaches the page cache."""
+    from myblog.routers import cards
+    monkeypatch.setattr(cards, "CARDS_STREAM_THRESHOLD", 2)
+    streamed = await client.get("/cards/")
+    assert streamed.status_code == 200
+    assert "content-length" not in streamed.headers
+    assert streamed.text.count("Read More") == 6
+    assert page_cache.get(streamed.headers["etag"]) == streamed.content
+
+def test_templates_precompile():
+    """Test that every template compiles at startup through the shared environment."""
+    from myblog.templating import precompile_templates, templates
+    assert precompile_templates() == len(templates.env.list_templates(extensions=["html"]))
+    assert templates.env.auto_reload is False
+
+@pytest.mark.asyncio
+async def test_export_then_import_round_trip(client, session_factory):
+    """Test that exported NDJSON re-imports in batches with per-row errors reported."""
+    from myblog import bulk
+    denied = await client.get("/cards/export")
+    assert denied.status_code == 403
+
+    exported = await client.get("/cards/export", headers={"X-Test-User": "admin"})
+    assert exported.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in exported.text.splitlines()]
+    assert [record["title"] for record in records] == [f"alice {i}" for i in range(6)] + ["bob private"]
+    assert records[-1]["author"] == "bob"
+
+    lines = exported.text.splitlines()
+    lines.insert(2, "{not json")
+    lines.append(json.dumps({"title": "ghost", "content": "x", "author": "nobody"}))
+    lines.append(json.dumps({"content": "missing title"}))
+    lines.append(json.dumps({"title": "by importer", "content": "*hi*"}))
+    async with session_factory() as session:
+        report = await bulk.import_cards(session, bulk.iter_lines(chunked("\n".join(lines).encode())),
+                                         default_author_id=1, batch_size=3)
+    assert report.imported == 8
+    assert report.failed == 3
+    assert sorted(error["line"] for error in report.errors) == [3, 9, 10]
+
+    async with session_factory() as session:
+        result = await session.execute(select(Card).where(Card.title == "by importer"))
+        card = result.scalar_one()
+        assert card.content_html == "<p><em>hi</em></p>"
+        assert card.author_id == 1
+        result = await session.execute(select(Card).where(Card.title == "bob private"))
+        assert {c.author_id for c in result.scalars()} == {users_id_of(records, "bob")}
+
+@pytest.mark.asyncio
+async def test_import_reports_unknown_author_ids(session_factory, users):
+    """Test that a row naming a missing author id is a row error, not a failed batch."""
+    from myblog import bulk
+    lines = [
+        json.dumps({"title": "by id", "content": "x", "author_id": users["bob"].id}),
+        json.dumps({"title": "ghost id", "content": "x", "author_id": 999}),
+        json.dumps({"title": "default", "content": "x"}),
+    ]
+    async with session_factory() as session:
+        report = await bulk.import_cards(session, bulk.iter_lines(chunked("\n".join(lines).encode())),
+                                         default_author_id=users["alice"].id)
+    assert report.imported == 2
+    assert report.errors == [{"line": 2, "error": "Unknown author id 999"}]
+
+    async with session_factory() as session:
+        result = await session.execute(select(Card.title, Card.author_id).where(Card.title.in_(["by id", "default"])))
+        assert sorted(result.all()) == [("by id", users["bob"].id), ("default", users["alice"].id)]
+
+def users_id_of(records, username):
+    return next(record["author_id"] for record in records if record["author"] == username)
+
+async def chunked(data, size=7):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+@pytest.mark.asyncio
+async def test_card_pages_link_stored_variants(client, session):
+    """Test that generated variants are linked by their static path and missing ones by the media route."""
+    digest = "ab" * 32
+    session.add(MediaFile(id=1, filename="a.png", file_path=f"/static/media/ab/{digest}.png", file_type="png",
+                          content_hash=digest))
+    await session.flush()
+    session.add(MediaVariant(media_id=1, name="medium", file_path=f"/static/media/variants/ab/{digest}-medium.webp"))
+    await session.execute(card_media.insert(), [{"card_id": 1, "media_id": 1, "position": 0}])
+    await session.commit()
+
+    response = await client.get("/cards/1")
+    assert f'src="/static/media/variants/ab/{digest}-medium.webp"' in response.text
+    assert "/media/1/variants/thumb 320w" in response.text
+    assert "/media/1/variants/medium" not in response.text
+
+@pytest.mark.asyncio
+async def test_card_pages_query_count_does_not_grow_with_media(client, session):
+    """Test that list and detail pages load authors and media without a query per card."""
+    session.add_all([MediaFile(id=i, filename=f"{i}.png", file_path=f"/static/media/{i}.png", file_type="png")
+                     for i in range(1, 5)])
+    await session.flush()
+    await session.execute(card_media.insert(), [
+        {"card_id": card_id, "media_id": media_id, "position": media_id}
+        for card_id in range(1, 7) for media_id in range(1, 5)
+    ])
+    await session.commit()
+
+    with assert_max_queries(4) as tracker:
+        response = await client.get("/cards/")
+    assert response.status_code == 200
+    assert tracker.repeated(threshold=2) == []
+
+    with assert_max_queries(4):
+        response = await client.get("/cards/1")
+    assert response.status_code == 200
+
+    # A repeat view is served from the card and page caches
+    with assert_max_queries(0):
+        again = await client.get("/cards/1")
+    assert again.status_code == 200
+
+    # Attaching media publishes an invalidation, so the next view sees the change
+    await session.execute(card_media.delete().where(card_media.c.card_id == 1))
+    await session.execute(Card.__table__.update().where(Card.id == 1).values(updated_at=datetime(2030, 1, 1)))
+    await session.commit()
+    card_cache.invalidate(1)
+    changed = await client.get("/cards/1", headers={"If-None-Match": again.headers["etag"]})
+    assert changed.status_code == 200
+
+@pytest.mark.asyncio
+async def test_edit_is_rendered_by_background_job(client, session_factory):
+    """Test that an edit leaves the HTML for the render job, which keeps updated_at."""
+    await client.post("/cards/1", data={"title": "edited", "content": "*new* body"})
+    async with session_factory() as session:
+        card = await session.get(Card, 1)
+        assert card.content_html is None
+        edited_at = card.updated_at
+
+    await runner.run_until_idle(session_factory)
+    async with session_factory() as session:
+        card = await session.get(Card, 1)
+        assert card.content_html == "<p><em>new</em> body</p>"
+        assert card.render_version == RENDERER_VERSION
+        assert card.updated_at == edited_at
+
+@pytest.mark.asyncio
+async def test_json_list_sparse_fields_embeds_and_paging(client, session):
+    """Test that JSON lists honour fields, embeds and keyset paging like the HTML list."""
+    session.add(MediaFile(id=1, filename="a.png", file_path="/static/media/a.png", file_type="png"))
+    await session.flush()
+    await session.execute(card_media.insert(), [{"card_id": 5, "media_id": 1, "position": 0}])
+    await session.commit()
+
+    headers = {"Accept": "application/json"}
+    response = await client.get("/cards/", params={"limit": 4, "fields": "title", "embed": "author,media"},
+                                headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert "Accept" in response.headers["vary"]
+    page = response.json()
+    assert [item["title"] for item in page["items"]] == ["alice 5", "alice 4", "alice 3", "alice 2"]
+    first = page["items"][0]
+    assert set(first) == {"id", "title", "author", "media"}
+    assert first["author"] == {"id": 2, "username": "alice"}
+    assert page["items"][1]["media"] == [{"id": 1, "filename": "a.png", "file_type": "png", "url": "/static/media/a.png"}]
+
+    rest = await client.get("/api/cards/", params={"limit": 4, "cursor": page["next_cursor"], "fields": "title"})
+    assert [item["title"] for item in rest.json()["items"]] == ["alice 1", "alice 0"]
+    assert rest.json()["next_cursor"] is None
+
+    cached = await client.get("/cards/", params={"limit": 4, "fields": "title", "embed": "author,media"},
+                              headers={**headers, "If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+    html = await client.get("/cards/", params={"limit": 4})
+    assert html.headers["content-type"].startswith("text/html")
+
+    bad = await client.get("/api/cards/", params={"fields": "title,secret"})
+    assert bad.status_code == 400
+
+@pytest.mark.asyncio
+async def test_json_detail_and_json_writes(client):
+    """Test that cards can be read, created and edited with JSON bodies and responses."""
+    detail = await client.get("/api/cards/1")
+    assert detail.status_code == 200
+    assert set(detail.json()) == {"id", "title", "content", "created_at", "updated_at", "author_id"}
+    assert (await client.get("/api/cards/2", headers={"X-Test-User": "bob"})).status_code == 403
+
+    created = await client.post("/api/cards/", json={"title": "api card", "content": "*hi*", "to_all": True})
+    assert created.status_code == 201
+    card = created.json()
+    assert created.headers["location"] == f"/api/cards/{card['id']}"
+    assert card["title"] == "api card" and card["author_id"] == 2
+
+    edited = await client.put(f"/api/cards/{card['id']}", json={"title": "renamed"})
+    assert edited.status_code == 200
+    assert edited.json()["title"] == "renamed" and edited.json()["content"] == "*hi*"
+
+    invalid = await client.post("/api/cards/", json={"title": "no content"})
+    assert invalid.status_code == 422
+
+    # Form posts keep redirecting back to the HTML list
+    form = await client.post("/cards/", data={"title": "form card", "content": "body"})
+    assert form.status_code == 303
+
+@pytest.mark.asyncio
+async def test_api_prefix_only_serves_json_routes(client):
+    """Test that the HTML forms and search page are not mounted under /api."""
+    for url in ("/api/cards/new", "/api/cards/search", "/api/cards/1/edit"):
+        response = await client.get(url)
+        assert response.status_code in (404, 405, 422)
+        assert response.headers["content-type"] == "application/json"
+    app = FastAPI()
+    app.include_router(cards_router, prefix="/cards")
+    app.include_router(cards_api_router, prefix="/api/cards")
+    paths = app.openapi()["paths"]
+    assert "/api/cards/search" not in paths and "/api/cards/{card_id}/edit" not in paths
+    assert "/cards/search" in paths
+
+@pytest.mark.asyncio
+async def test_editor_can_make_a_shared_card_private(client):
+    """Test that the editor sends to_all even when the box is unticked."""
+    source = (Path(__file__).parent.parent / "src/myblog/static/js/editor.js").read_text()
+    assert "payload.to_all = form.elements['to_all'].checked" in source
+    form = await client.get("/cards/1/edit")
+    assert 'name="to_all" value="true" checked' in form.text
+
+    # Card 1 is shared; the editor posts JSON with the box unticked
+    response = await client.post("/cards/1", json={"title": "alice 0", "content": "", "to_all": False},
+                                 headers={"Accept": "application/json"})
+    assert response.status_code == 200
+    assert (await client.get("/cards/1", headers={"X-Test-User": "bob"})).status_code == 403
@@ -0,0 +1,117 @@
+import gzip
+import zlib
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+from httpx import AsyncClient
+from myblog.compression import (
+    CompressionMiddleware, PrecompressedStaticFiles, compress_static, negotiate_encoding,
+)
+
+
+PAGE = "<html><body>" + "<p>hello compressed world</p>" * 200 + "</body></html>"
+
+test_app = FastAPI()
+test_app.add_middleware(CompressionMiddleware, minimum_size=500, exclude_prefixes=("/static/",))
+
+@test_app.get("/page")
+async def page():
+    return HTMLResponse(PAGE, headers={"ETag": '"page-v1"'})
+
+@test_app.get("/small")
+async def small():
+    return HTMLResponse("<p>short</p>")
+
+@test_app.get("/image")
+async def image():
+    return Response(b"\x89PNG" + b"\x00" * 2000, media_type="image/png")
+
+@test_app.get("/stream")
+async def stream():
+    async def chunks():
+        for index in range(50):
+            yield f"<li>item {index}</li>" * 20
+    return StreamingResponse(chunks(), media_type="text/html")
+
+# Raw bytes: httpx would otherwise decode the body for us
+async def get_raw(client, url, headers=None):
+    async with client.stream("GET", url, headers=headers) as response:
+        return response, b"".join([chunk async for chunk in response.aiter_raw()])
+
+def test_negotiate_encoding_honours_q_values():
+    """Test that q-values pick the coding and ties follow the server order."""
+    assert negotiate_encoding("gzip, br", ("br", "gzip")) == "br"
+    assert negotiate_encoding("br;q=0.5, gzip", ("br", "gzip")) == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity", ("br", "gzip")) is None
+    assert negotiate_encoding("*", ("gzip",)) == "gzip"
+    assert negotiate_encoding(None, ("gzip",)) is None
+
+@pytest.mark.asyncio
+async def test_dynamic_responses_compressed_above_threshold():
+    """Test that large pages are gzipped with a weak ETag while small and binary bodies are not."""
+    async with AsyncClient(app=test_app, base_url="http://testserver") as client:
+        response, body = await get_raw(client, "/page", {"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["etag"] == 'W/"page-v1"'
+        assert int(response.headers["content-length"]) == len(body) < len(PAGE)
+        assert gzip.decompress(body).decode() == PAGE
+
+        response, body = await get_raw(client, "/page", {"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert body.decode() == PAGE
+
+        small = await client.get("/small", headers={"Accept-Encoding": "gzip"})
+        image = await client.get("/image", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert "content-encoding" not in image.headers and "vary" not in image.headers
+
+@pytest.mark.asyncio
+async def test_streamed_responses_compressed_incrementally():
+    """Test that a streamed body is compressed without a Content-Length and decodes intact."""
+    async with AsyncClient(app=test_app, base_url="http://testserver") as client:
+        response, body = await get_raw(client, "/stream", {"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    expected = "".join(f"<li>item {index}</li>" * 20 for index in range(50))
+    assert zlib.decompress(body, 31).decode() == expected
+
+@pytest.mark.asyncio
+async def test_static_sidecars_served_and_media_skipped(tmp_path):
+    """Test that built sidecars are served by negotiation and uploaded media never is."""
+    (tmp_path / "css").mkdir()
+    (tmp_path / "media").mkdir()
+    stylesheet = "body { color: #333; }\n" * 200
+    (tmp_path / "css" / "site.css").write_text(stylesheet)
+    (tmp_path / "media" / "notes.txt").write_text(stylesheet)
+    (tmp_path / "css" / "tiny.css").write_text("a{}")
+    assert compress_static(tmp_path, skip=("media",)) >= 1
+    assert (tmp_path / "css" / "site.css.gz").exists()
+    assert not (tmp_path / "css" / "tiny.css.gz").exists()
+    assert not (tmp_path / "media" / "notes.txt.gz").exists()
+
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, exclude_prefixes=("/static/",))
+    app.mount("/static", PrecompressedStaticFiles(directory=str(tmp_path), skip=("media",)))
+    async with AsyncClient(app=app, base_url="http://testserver") as client:
+        response, body = await get_raw(client, "/static/css/site.css", {"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["content-type"].startswith("text/css")
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert gzip.decompress(body).decode() == stylesheet
+
+        cached = await client.get("/static/css/site.css", headers={
+            "Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"],
+        })
+        assert cached.status_code == 304
+
+        plain, body = await get_raw(client, "/static/css/site.css", {"Accept-Encoding": "identity"})
+        assert "content-encoding" not in plain.headers and body.decode() == stylesheet
+        assert plain.headers["etag"] != response.headers["etag"]
+
+        # Gzip sidecars planted in the upload directory are ignored
+        (tmp_path / "media" / "notes.txt.gz").write_bytes(gzip.compress(b"other"))
+        media, body = await get_raw(client, "/static/media/notes.txt", {"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in media.headers
+    assert body.decode() == stylesheet
@@ -0,0 +1,300 @@
+import hashlib
+import io
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker, selectinload
+from sqlalchemy.pool import StaticPool
+from myblog.database import get_db
+from myblog.models import Base, User, Role, MediaFile, MediaVariant, Card
+from myblog import derivatives
+from myblog.jobs import runner
+from myblog.routers import media
+from myblog.routers.auth import get_current_user, UserSnapshot
+
+
+# Test database, shared by the app and the fixtures through a static pool
+test_engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False)
+
+# FastAPI app for testing
+test_app = FastAPI()
+test_app.include_router(media.router, prefix="/media")
+
+async def override_get_db():
+    async with TestingSessionLocal() as session:
+        yield session
+        await session.commit()
+
+test_app.dependency_overrides[get_db] = override_get_db
+test_app.dependency_overrides[get_current_user] = lambda: UserSnapshot(id=1, username="uploader", role=Role.DEVELOPER)
+
+# Fresh schema and media directory for every test
+@pytest.fixture(scope="function", autouse=True)
+async def media_env(tmp_path, monkeypatch):
+    """Point media storage at a temporary directory and reset the database."""
+    tmp_dir = tmp_path / ".tmp"
+    tmp_dir.mkdir()
+    monkeypatch.setattr(media, "MEDIA_DIR", tmp_path)
+    monkeypatch.setattr(media, "MEDIA_TMP_DIR", tmp_dir)
+    async with test_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with TestingSessionLocal() as session:
+        session.add(User(id=1, username="uploader", email="uploader@example.com", role=Role.DEVELOPER))
+        await session.commit()
+    yield tmp_path
+
+# Async client fixture
+@pytest.fixture(scope="function")
+async def client():
+    """Provide an async test client."""
+    async with AsyncClient(app=test_app, base_url="http://testserver") as ac:
+        yield ac
+
+@pytest.mark.asyncio
+async def test_upload_streams_file_to_disk(client, media_env):
+    """Test that an upload lands in the media directory with no temp files left."""
+    payload = b"\x89PNG" + b"x" * (3 * media.UPLOAD_CHUNK_SIZE // 2)
+    response = await client.post("/media/upload", files={"file": ("pic.png", payload, "image/png")})
+    assert response.status_code == 200
+    digest = hashlib.sha256(payload).hexdigest()
+    stored = media_env / digest[:2] / f"{digest}.png"
+    assert stored.read_bytes() == payload
+    assert response.json()["url"] == f"/static/media/{digest[:2]}/{digest}.png"
+    assert response.json()["size"] == len(payload)
+    assert list((media_env / ".tmp").iterdir()) == []
+
+@pytest.mark.asyncio
+async def test_identical_uploads_are_deduplicated(client, media_env):
+    """Test that identical bytes are stored once and share one reference-counted record."""
+    first = await client.post("/media/upload", files={"file": ("a.png", b"same bytes", "image/png")})
+    second = await client.post("/media/upload", files={"file": ("b.png", b"same bytes", "image/png")})
+    other = await client.post("/media/upload", files={"file": ("c.png", b"other bytes", "image/png")})
+    assert first.json()["id"] == second.json()["id"]
+    assert other.json()["id"] != first.json()["id"]
+    assert len([path for path in media_env.rglob("*.png")]) == 2
+    async with TestingSessionLocal() as session:
+        media_file = await session.get(MediaFile, first.json()["id"])
+        assert media_file.ref_count == 2
+
+@pytest.mark.asyncio
+async def test_upload_rejects_extension_before_reading(client, media_env):
+    """Test that a disallowed extension is rejected and nothing is written."""
+    response = await client.post("/media/upload", files={"file": ("script.exe", b"MZ", "application/octet-stream")})
+    assert response.status_code == 400
+    assert [path for path in media_env.rglob("*") if path.is_file()] == []
+
+@pytest.mark.asyncio
+async def test_upload_enforces_size_limit(client, media_env, monkeypatch):
+    """Test that oversized uploads fail and their partial temp file is removed."""
+    monkeypatch.setattr(media, "MAX_FILE_SIZE", 1024)
+    response = await client.post("/media/upload", files={"file": ("big.png", b"x" * 4096, "image/png")})
+    assert response.status_code == 400
+    assert [path for path in media_env.rglob("*") if path.is_file()] == []
+
+def multipart_body(filename, data, boundary="upload-boundary"):
+    return (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+
+@pytest.mark.asyncio
+async def test_upload_enforces_size_limit_when_size_unknown(client, media_env, monkeypatch):
+    """Test that a chunked upload without Content-Length is cut off once it passes the limit."""
+    monkeypatch.setattr(media, "MAX_FILE_SIZE", 1024)
+    monkeypatch.setattr(media, "UPLOAD_CHUNK_SIZE", 256)
+    body = multipart_body("big.png", b"x" * 4096)
+    sent = []
+
+    async def chunks():
+        for start in range(0, len(body), 200):
+            sent.append(start)
+            yield body[start:start + 200]
+
+    response = await client.post(
+        "/media/upload", content=chunks(), headers={"Content-Type": "multipart/form-data; boundary=upload-boundary"}
+    )
+    assert response.status_code == 400
+    # The rest of the body was never read
+    assert len(sent) < len(range(0, len(body), 200))
+    assert [path for path in media_env.rglob("*") if path.is_file()] == []
+
+@pytest.mark.asyncio
+async def test_upload_rejects_declared_length_before_reading(media_env, monkeypatch):
+    """Test that an oversized Content-Length is refused without reading the body."""
+    from fastapi import HTTPException
+    from starlette.requests import Request
+    monkeypatch.setattr(media, "MAX_FILE_SIZE", 1024)
+
+    async def receive():
+        raise AssertionError("the body must not be read")
+
+    request = Request({"type": "http", "method": "POST", "headers": [
+        (b"content-type", b"multipart/form-data; boundary=upload-boundary"),
+        (b"content-length", str(10 * 1024 * 1024).encode()),
+    ]}, receive)
+    with pytest.raises(HTTPException) as exc:
+        await media.receive_upload(request)
+    assert exc.value.status_code == 400
+
+@pytest.mark.asyncio
+async def test_upload_rejects_body_without_file(client):
+    """Test that a multipart body without a file part is a 400."""
+    response = await client.post("/media/upload", data={"title": "no file"}, files={"other": ("a.png", b"x", "image/png")})
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_media_delivery_ranges_and_validators(client):
+    """Test full, single-range, multi-range and conditional media responses."""
+    payload = bytes(range(256)) * 40
+    upload = await client.post("/media/upload", files={"file": ("clip.mp4", payload, "video/mp4")})
+    url = f"/media/{upload.json()['id']}"
+
+    full = await client.get(url)
+    assert full.status_code == 200
+    assert full.content == payload
+    assert full.headers["accept-ranges"] == "bytes"
+    etag = full.headers["etag"]
+    assert etag == f'"{hashlib.sha256(payload).hexdigest()}"'
+
+    partial = await client.get(url, headers={"Range": "bytes=100-199"})
+    assert partial.status_code == 206
+    assert partial.content == payload[100:200]
+    assert partial.headers["content-range"] == f"bytes 100-199/{len(payload)}"
+
+    suffix = await client.get(url, headers={"Range": "bytes=-10"})
+    assert suffix.content == payload[-10:]
+
+    multi = await client.get(url, headers={"Range": "bytes=0-9,20-29"})
+    assert multi.status_code == 206
+    assert multi.headers["content-type"].startswith("multipart/byteranges; boundary=")
+    assert int(multi.headers["content-length"]) == len(multi.content)
+    assert payload[0:10] in multi.content and payload[20:30] in multi.content
+
+    unsatisfiable = await client.get(url, headers={"Range": f"bytes={len(payload)}-"})
+    assert unsatisfiable.status_code == 416
+
+    cached = await client.get(url, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    since = await client.get(url, headers={"If-Modified-Since": full.headers["last-modified"]})
+    assert since.status_code == 304
+
+    stale_range = await client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert stale_range.status_code == 200
+
+def png_bytes(width, height):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+@pytest.mark.asyncio
+async def test_image_variants_generated_in_background(client):
+    """Test that uploading an image produces resized variants off the request path."""
+    pytest.importorskip("PIL")
+    response = await client.post("/media/upload", files={"file": ("wide.png", png_bytes(2000, 1000), "image/png")})
+    media_id = response.json()["id"]
+    assert response.json()["variants"] == {
+        "thumb": f"/media/{media_id}/variants/thumb",
+        "medium": f"/media/{media_id}/variants/medium",
+    }
+    # The upload committed a variants job; run it the way a worker would
+    await runner.run_until_idle(TestingSessionLocal)
+    async with TestingSessionLocal() as session:
+        media_file = await session.get(MediaFile, media_id)
+        assert (media_file.width, media_file.height) == (2000, 1000)
+        result = await session.execute(select(MediaVariant).where(MediaVariant.media_id == media_id))
+        sizes = {variant.name: (variant.width, variant.height) for variant in result.scalars()}
+    assert sizes == {"thumb": (320, 160), "medium": (960, 480)}
+
+@pytest.mark.asyncio
+async def test_missing_variant_generated_on_first_request(client, media_env):
+    """Test that a variant whose file is missing is produced lazily when requested."""
+    pytest.importorskip("PIL")
+    response = await client.post("/media/upload", files={"file": ("tall.png", png_bytes(100, 400), "image/png")})
+    media_id = response.json()["id"]
+    for path in (media_env / "variants").rglob("*.webp"):
+        path.unlink()
+
+    variant = await client.get(f"/media/{media_id}/variants/thumb")
+    assert variant.status_code == 200
+    assert variant.headers["content-type"] == "image/webp"
+    from PIL import Image
+    assert Image.open(io.BytesIO(variant.content)).size == (100, 400)  # Never upscaled
+    assert (await client.get(f"/media/{media_id}/variants/huge")).status_code == 404
+
+@pytest.mark.asyncio
+async def test_list_media_files_paged_and_filtered(client):
+    """Test that the listing comes from the database with paging and filters."""
+    for i in range(5):
+        await client.post("/media/upload", files={"file": (f"song{i}.mp3", f"audio {i}".encode(), "audio/mpeg")})
+    await client.post("/media/upload", files={"file": ("clip.mp4", b"video", "video/mp4")})
+
+    first = await client.get("/media/files", params={"limit": 4})
+    assert first.status_code == 200
+    assert len(first.json()["items"]) == 4
+    second = await client.get("/media/files", params={"limit": 4, "cursor": first.json()["next_cursor"]})
+    assert len(second.json()["items"]) == 2
+    assert second.json()["next_cursor"] is None
+    ids = [item["id"] for item in first.json()["items"] + second.json()["items"]]
+    assert len(set(ids)) == 6
+
+    audio = await client.get("/media/files", params={"file_type": "mp3"})
+    assert {item["file_type"] for item in audio.json()["items"]} == {"mp3"}
+    assert len(audio.json()["items"]) == 5
+    assert set(audio.json()["items"][0]) >= {"id", "size", "file_type", "width", "height", "url"}
+
+    nobody = await client.get("/media/files", params={"uploader_id": 999})
+    assert nobody.json()["items"] == []
+    future = await client.get("/media/files", params={"uploaded_after": "2999-01-01T00:00:00"})
+    assert future.json()["items"] == []
+
+@pytest.mark.asyncio
+async def test_bulk_attach_and_detach_keep_order(client):
+    """Test that bulk attach is idempotent, keeps attachment order and bumps the card."""
+    ids = []
+    for i in range(4):
+        response = await client.post("/media/upload", files={"file": (f"s{i}.mp3", f"sound {i}".encode(), "audio/mpeg")})
+        ids.append(response.json()["id"])
+    async with TestingSessionLocal() as session:
+        card = Card(title="Card", content="Body", author_id=1)
+        session.add(card)
+        await session.commit()
+        card_id, updated_at = card.id, card.updated_at
+
+    single = await client.post(f"/media/attach/{card_id}", params={"media_id": ids[2]})
+    assert single.status_code == 200
+    bulk = await client.post(f"/media/attach/{card_id}/bulk", json={"media_ids": [ids[0], ids[2], ids[1], ids[0]]})
+    assert bulk.json() == {"attached": 2}
+    again = await client.post(f"/media/attach/{card_id}/bulk", json={"media_ids": [ids[1]]})
+    assert again.json() == {"attached": 0}
+    missing = await client.post(f"/media/attach/{card_id}/bulk", json={"media_ids": [ids[3], 999]})
+    assert missing.status_code == 404
+
+    async def attached():
+        async with TestingSessionLocal() as session:
+            result = await session.execute(
+                select(Card).where(Card.id == card_id).options(selectinload(Card.media_files))
+            )
+            card = result.scalar_one()
+            return [media_file.id for media_file in card.media_files], card.updated_at
+
+    order, bumped = await attached()
+    assert order == [ids[2], ids[0], ids[1]]
+    assert bumped > updated_at
+
+    detach = await client.post(f"/media/detach/{card_id}/bulk", json={"media_ids": [ids[0], ids[3]]})
+    assert detach.json() == {"detached": 1}
+    order, _ = await attached()
+    assert order == [ids[2], ids[1]]
+
+    async with TestingSessionLocal() as session:
+        session.add(Card(id=99, title="Other", content="", author_id=2))
+        await session.commit()
+    forbidden = await client.post("/media/attach/99/bulk", json={"media_ids": [ids[0]]})
+    assert forbidden.status_code == 403
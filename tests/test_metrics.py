@@ -0,0 +1,79 @@
+import pytest
+from fastapi import FastAPI, Depends
+from fastapi.responses import PlainTextResponse
+from httpx import AsyncClient
+from jinja2 import Environment, DictLoader
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from myblog import metrics
+from myblog.rendering import render_markdown
+
+
+test_engine = metrics.instrument_engine(create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool))
+TestingSessionLocal = sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False)
+
+async def get_session():
+    async with TestingSessionLocal() as session:
+        yield session
+
+test_app = FastAPI()
+test_app.add_middleware(metrics.MetricsMiddleware)
+
+@test_app.get("/items/{item_id}")
+async def read_item(item_id: int, db: AsyncSession = Depends(get_session)):
+    for _ in range(3):
+        await db.execute(text("SELECT 1"))
+    return {"id": item_id}
+
+@test_app.get("/metrics", dependencies=[Depends(metrics.authorize_scrape)])
+async def read_metrics():
+    return PlainTextResponse(metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    """Start every test from empty metrics."""
+    metrics.reset_metrics()
+    yield
+
+@pytest.mark.asyncio
+async def test_requests_are_counted_per_route_template():
+    """Test that latency, status and query counts are labelled by route, not raw path."""
+    async with AsyncClient(app=test_app, base_url="http://testserver") as client:
+        await client.get("/items/1")
+        await client.get("/items/2")
+        await client.get("/missing")
+        body = (await client.get("/metrics")).text
+
+    assert metrics.http_requests.value("GET", "/items/{item_id}", "200") == 2
+    assert metrics.http_requests.value("GET", "other", "404") == 1
+    assert metrics.http_request_duration.count("GET", "/items/{item_id}") == 2
+    assert metrics.db_query_duration.count("SELECT") == 6
+    assert 'http_requests_total{method="GET",route="/items/{item_id}",status="200"} 2' in body
+    assert 'http_request_db_queries_bucket{method="GET",route="/items/{item_id}",le="3"} 2' in body
+    assert 'http_request_db_queries_bucket{method="GET",route="/items/{item_id}",le="2"} 0' in body
+    assert "# TYPE http_request_duration_seconds histogram" in body
+
+def test_markdown_and_templates_are_timed(monkeypatch):
+    """Test that Markdown conversion and template rendering are observed."""
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    render_markdown("# Title")
+    assert metrics.markdown_render_duration.count() == 1
+
+    environment = metrics.instrument_templates(Environment(loader=DictLoader({"page.html": "{{ x }}"})))
+    template = environment.get_template("page.html")
+    assert template.render(x="a") == "a"
+    assert "".join(template.generate(x="b")) == "b"
+    assert metrics.template_render_duration.count("page.html") == 2
+
+@pytest.mark.asyncio
+async def test_scrape_requires_token_when_configured(monkeypatch):
+    """Test that /metrics answers 401 without the configured bearer token."""
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+    async with AsyncClient(app=test_app, base_url="http://testserver") as client:
+        assert (await client.get("/metrics")).status_code == 401
+        wrong = await client.get("/metrics", headers={"Authorization": "Bearer nope"})
+        assert wrong.status_code == 401
+        scraped = await client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+        assert scraped.status_code == 200
@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from myblog.models import Base
+from myblog.migrations import migrate, head_revision, current_version
+from myblog.migrations import r0001_initial
+from myblog.migrations.ops import drop_index, index_names
+from myblog.querylog import instrument_engine, track_queries
+
+
+def describe_schema(conn):
+    inspector = inspect(conn)
+    schema = {}
+    for table in inspector.get_table_names():
+        if table.startswith("cards_fts") or table == "schema_version":
+            continue
+        schema[table] = {
+            "columns": sorted(column["name"] for column in inspector.get_columns(table)),
+            "primary_key": sorted(inspector.get_pk_constraint(table)["constrained_columns"]),
+            "indexes": sorted((index["name"], tuple(index["column_names"]), bool(index["unique"]))
+                              for index in inspector.get_indexes(table)),
+        }
+    return schema
+
+@pytest.fixture
+def database_url(tmp_path):
+    """Provide the URL of an empty SQLite database file."""
+    return f"sqlite+aiosqlite:///{tmp_path / 'blog.db'}"
+
+@pytest.mark.asyncio
+async def test_fresh_database_matches_models(database_url, tmp_path):
+    """Test that migrating an empty database yields the schema the models describe."""
+    engine = instrument_engine(create_async_engine(database_url))
+    assert await migrate(engine) == list(range(1, head_revision() + 1))
+    async with engine.connect() as conn:
+        migrated = await conn.run_sync(describe_schema)
+        assert await conn.run_sync(current_version) == head_revision()
+
+    reference = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'reference.db'}")
+    async with reference.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        expected = await conn.run_sync(describe_schema)
+    assert migrated == expected
+
+    # A current schema is detected without taking the lock or running DDL
+    with track_queries() as tracker:
+        assert await migrate(engine) == []
+    assert tracker.count <= 3
+    assert not [shape for shape in tracker.statements if shape.split()[0] in ("CREATE", "ALTER", "BEGIN")]
+    await engine.dispose()
+    await reference.dispose()
+
+@pytest.mark.asyncio
+async def test_unversioned_database_is_upgraded_in_place(database_url):
+    """Test that a pre-migration database, partly patched by hand, keeps its data."""
+    engine = create_async_engine(database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(r0001_initial.metadata.create_all)
+        await conn.execute(text("ALTER TABLE cards ADD COLUMN content_html TEXT"))
+        await conn.execute(text("INSERT INTO users (id, username) VALUES (1, 'alice')"))
+        await conn.execute(text("INSERT INTO cards (id, title, content, author_id) VALUES (1, 'hello world', 'body', 1)"))
+        await conn.execute(text("INSERT INTO media_files (id, filename) VALUES (1, 'a.png'), (2, 'b.png')"))
+        await conn.execute(text("INSERT INTO card_media (card_id, media_id) VALUES (1, 2), (1, 1), (1, 2)"))
+
+    await migrate(engine)
+    async with engine.connect() as conn:
+        links = (await conn.execute(text("SELECT media_id, position FROM card_media ORDER BY position"))).all()
+        assert links == [(2, 0), (1, 1)]
+        assert (await conn.execute(text("SELECT ref_count FROM media_files WHERE id = 1"))).scalar() == 1
+        found = await conn.execute(text("SELECT rowid FROM cards_fts WHERE cards_fts MATCH 'hello'"))
+        assert found.scalars().all() == [1]
+    await engine.dispose()
+
+@pytest.mark.asyncio
+async def test_concurrent_migrations_apply_once(database_url):
+    """Test that processes booting together migrate the database exactly once."""
+    engines = [create_async_engine(database_url) for _ in range(3)]
+    results = await asyncio.gather(*[migrate(engine) for engine in engines])
+    assert sorted(len(applied) for applied in results) == [0, 0, head_revision()]
+    async with engines[0].connect() as conn:
+        versions = (await conn.execute(text("SELECT version FROM schema_version ORDER BY version"))).scalars().all()
+    assert versions == list(range(1, head_revision() + 1))
+    for engine in engines:
+        await engine.dispose()
+
+@pytest.mark.asyncio
+async def test_superseded_card_index_dropped_idempotently(database_url):
+    """Test that the old visibility index is gone after migrating and dropping it again is a no-op."""
+    engine = create_async_engine(database_url)
+    await migrate(engine)
+    async with engine.begin() as conn:
+        assert "ix_cards_visibility" not in await conn.run_sync(index_names, "cards")
+        await conn.run_sync(drop_index, "ix_cards_visibility")
+    await engine.dispose()
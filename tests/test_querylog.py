@@ -0,0 +1,88 @@
+import logging
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from myblog import metrics, querylog
+
+
+test_engine = querylog.instrument_engine(create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool))
+
+test_app = FastAPI()
+test_app.add_middleware(querylog.QueryTrackingMiddleware)
+
+@test_app.get("/items")
+async def list_items():
+    async with test_engine.connect() as conn:
+        for item_id in range(querylog.N_PLUS_ONE_THRESHOLD):
+            await conn.execute(text("SELECT :id"), {"id": item_id})
+    return {}
+
+def test_statement_shape_collapses_placeholder_lists():
+    """Test that IN lists of different lengths share one shape."""
+    assert querylog.statement_shape("SELECT * FROM t WHERE id IN (?, ?,\n ?)") == "SELECT * FROM t WHERE id IN (?)"
+    assert querylog.statement_shape("SELECT * FROM t WHERE id IN (?)") == "SELECT * FROM t WHERE id IN (?)"
+
+@pytest.mark.asyncio
+async def test_repeated_statements_reported_as_n_plus_one(caplog):
+    """Test that a statement shape repeated within one request is logged once as N+1."""
+    with caplog.at_level(logging.WARNING, logger="myblog.querylog"):
+        async with AsyncClient(app=test_app, base_url="http://testserver") as client:
+            await client.get("/items")
+    warnings = [record.getMessage() for record in caplog.records if "N+1" in record.getMessage()]
+    assert len(warnings) == 1
+    assert "GET /items" in warnings[0] and "SELECT ?" in warnings[0]
+
+@pytest.mark.asyncio
+async def test_slow_statements_logged_with_plan(caplog, monkeypatch):
+    """Test that statements over the threshold are logged with parameters and query plan."""
+    monkeypatch.setattr(querylog, "SLOW_QUERY_MS", 0)
+    async with test_engine.connect() as conn:
+        await conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)"))
+        with caplog.at_level(logging.WARNING, logger="myblog.querylog"):
+            with querylog.assert_max_queries(1):
+                await conn.execute(text("SELECT name FROM items WHERE id = :id"), {"id": 7})
+    message = caplog.records[-1].getMessage()
+    assert "Slow query" in message
+    assert "(7,)" in message
+    assert "SEARCH items USING INTEGER PRIMARY KEY" in message
+
+def test_metrics_and_query_log_share_one_timing_hook():
+    """Test that instrumenting an engine for both registers a single pair of cursor events."""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+    metrics.instrument_engine(engine)
+    querylog.instrument_engine(engine)
+    querylog.instrument_engine(engine)
+    assert len(engine.sync_engine.dispatch.before_cursor_execute) == 1
+    assert len(engine.sync_engine.dispatch.after_cursor_execute) == 1
+
+class FakeCursor:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, statement, parameters=None):
+        self.executed.append(statement)
+        if statement.startswith("EXPLAIN"):
+            raise RuntimeError("cannot explain")
+
+    def close(self):
+        pass
+
+def test_failed_explain_is_rolled_back_to_a_savepoint_on_postgresql():
+    """Test that a failing EXPLAIN on PostgreSQL cannot abort the request's transaction."""
+    executed = []
+
+    class Connection:
+        class dialect:
+            name = "postgresql"
+
+        class connection:
+            @staticmethod
+            def cursor():
+                return FakeCursor(executed)
+
+    with pytest.raises(RuntimeError):
+        querylog.explain(Connection, "SELECT 1", {})
+    assert executed == ["SAVEPOINT querylog_explain", "EXPLAIN SELECT 1", "ROLLBACK TO SAVEPOINT querylog_explain"]
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import pytest
+from fastapi import Depends, FastAPI
+from httpx import AsyncClient
+from myblog import metrics
+from myblog.ratelimit import TokenBucketLimiter, ConcurrencyLimiter
+from myblog.routers import auth
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_allows_burst_then_refills():
+    """Test that a bucket admits its burst, then one request per refill interval."""
+    clock = FakeClock()
+    limiter = TokenBucketLimiter("test", capacity=3, per_second=0.5, clock=clock)
+    assert [limiter.take("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.take("a") == pytest.approx(2.0)
+    # Other keys have their own bucket
+    assert limiter.take("b") == 0
+    clock.now += 2
+    assert limiter.take("a") == 0
+    assert limiter.take("a") > 0
+    assert limiter.stats()["rejected"] == 2
+
+def test_shared_buckets_span_limiter_instances(tmp_path):
+    """Test that limiters on one shared file, as in separate workers, draw from the same bucket."""
+    clock = FakeClock()
+    path = str(tmp_path / "limits.sqlite3")
+    first = TokenBucketLimiter("test", capacity=2, per_second=1, path=path, clock=clock)
+    second = TokenBucketLimiter("test", capacity=2, per_second=1, path=path, clock=clock)
+    assert first.take("a") == 0
+    assert second.take("a") == 0
+    assert first.take("a") > 0
+    assert second.take("a") > 0
+
+def test_concurrency_limiter_sheds_excess():
+    """Test that acquisitions past the limit fail until a slot is released."""
+    limiter = ConcurrencyLimiter("test", 2)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+    assert limiter.stats()["rejected"] == 1
+
+
+# A stand-in for the password endpoints, held open until the test releases it
+release = asyncio.Event()
+
+test_app = FastAPI()
+
+@test_app.post("/token", dependencies=[Depends(auth.admit_auth_request)])
+async def token():
+    await release.wait()
+    return {"ok": True}
+
+@pytest.fixture(scope="function")
+async def limits(monkeypatch):
+    """Install small limiters for the admission dependency."""
+    clock = FakeClock()
+    monkeypatch.setattr(auth, "AUTH_RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(auth, "ip_limiter", TokenBucketLimiter("ip", 4, 1, clock=clock))
+    monkeypatch.setattr(auth, "username_limiter", TokenBucketLimiter("user", 2, 1, clock=clock))
+    monkeypatch.setattr(auth, "auth_in_flight", ConcurrencyLimiter("auth", 1))
+    release.set()
+    yield clock
+
+@pytest.mark.asyncio
+async def test_auth_attempts_limited_per_username_and_ip(limits):
+    """Test that repeated attempts get 429 with Retry-After, per username and then per IP."""
+    rejected = metrics.auth_admissions.value("rate_limited_username")
+    async with AsyncClient(app=test_app, base_url="http://testserver") as client:
+        statuses = [(await client.post("/token", data={"username": "alice", "password": "x"})).status_code
+                    for _ in range(3)]
+        assert statuses == [200, 200, 429]
+        assert metrics.auth_admissions.value("rate_limited_username") == rejected + 1
+
+        assert (await client.post("/token", data={"username": "bob", "password": "x"})).status_code == 200
+        response = await client.post("/token", data={"username": "carol", "password": "x"})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+
+@pytest.mark.asyncio
+async def test_auth_requests_over_in_flight_cap_are_shed(limits):
+    """Test that a request arriving while the cap is reached is rejected, not queued."""
+    release.clear()
+    async with AsyncClient(app=test_app, base_url="http://testserver") as client:
+        first = asyncio.create_task(client.post("/token", data={"username": "alice", "password": "x"}))
+        while auth.auth_in_flight.in_flight == 0:
+            await asyncio.sleep(0.01)
+        shed = await client.post("/token", data={"username": "bob", "password": "x"})
+        release.set()
+        assert (await first).status_code == 200
+    assert shed.status_code == 429
+    assert "retry-after" in shed.headers
+    assert auth.auth_in_flight.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_shared_limits_taken_off_the_event_loop(limits, monkeypatch, tmp_path):
+    """Test that shared buckets are limited across workers and taken in a worker thread."""
+    path = str(tmp_path / "limits.sqlite3")
+    worker_a = TokenBucketLimiter("user", 2, 1, path=path, clock=limits)
+    worker_b = TokenBucketLimiter("user", 2, 1, path=path, clock=limits)
+    threads = []
+    take_shared = worker_a._take_shared
+
+    def recording_take_shared(*args):
+        threads.append(threading.current_thread())
+        return take_shared(*args)
+
+    monkeypatch.setattr(worker_a, "_take_shared", recording_take_shared)
+    monkeypatch.setattr(auth, "ip_limiter", TokenBucketLimiter("ip", 10, 1, path=path, clock=limits))
+    monkeypatch.setattr(auth, "username_limiter", worker_a)
+    assert await worker_b.atake("alice") == 0
+    async with AsyncClient(app=test_app, base_url="http://testserver") as client:
+        statuses = [(await client.post("/token", data={"username": "alice", "password": "x"})).status_code
+                    for _ in range(2)]
+    assert statuses == [200, 429]
+    assert threads and threading.main_thread() not in threads